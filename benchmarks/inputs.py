@@ -0,0 +1,109 @@
+import contextlib
+import io
+import os
+import pickle
+import shutil
+import warnings
+
+from src.data import data_utils
+from src.data.query_backend import LocalMimicBackend
+from src.data.synthetic_mimic import generate_synthetic_mimic
+from src.path_manager import ProjectPaths
+from benchmarks import reference
+
+
+###################################
+# Stage inputs built from synthetic MIMIC-III data
+###################################
+# For each cohort size, synthetic MIMIC-III tables are generated (src/data/synthetic_mimic.py) and the
+# pipeline is run on them with the local backend up to the inputs of the benchmarked stages:
+#   abx_orders        qualifying antibiotic order entries        -> consolidate_abx_orders
+#   cx, abx, sofa     preprocessed cultures, antibiotics, SOFA   -> sepsis_onset_candidates
+#   raw_vs            hourly vital signs of the trauma cohort    -> extract_night_data
+#   night_<method>    night-time records (reference output)      -> gen_2Dnight_ti
+#   night_ti_<method> 2D night instances (reference output)      -> assign_label2instance
+#   sepsis_label      sepsis label table of the cohort           -> assign_label2instance
+# Downstream inputs are produced with the reference implementations, so every stage is measured on the same
+# input whatever the state of the upstream stages. Inputs are pickled under
+#   <work_dir>/n<n_admissions>_seed<seed>/inputs.pkl
+# and reused by later runs (`rebuild=True` regenerates them).
+
+PROJECT_ID = 'synthetic'
+FILLING_METHODS = {'f_and_b': 'f_and_b', 'none': None}
+_REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def size_dir(work_dir, n_admissions, seed):
+    return os.path.join(work_dir, f'n{n_admissions}_seed{seed}')
+
+def _project_paths(base_path):
+    for folder in ['data/raw', 'data/processed', 'dataset']:
+        os.makedirs(os.path.join(base_path, folder), exist_ok=True)
+    project_path_obj = ProjectPaths(base_path)
+    # The cohort extraction reads the qualified E-codes from the repository's supplementary folder
+    project_path_obj.supplementary_path = os.path.join(_REPO_ROOT, 'supplementary')
+    return project_path_obj
+
+def _run_pipeline(mimic_dir, project_dir):
+    # Imported here: the pipeline scripts are only needed when the inputs are (re)built
+    from scripts.cohort_extraction import extract_trauma_cohort_ids
+    from scripts import sepsis_onset_label_assignment as label_assignment
+    from scripts import early_sepsis_onset_detection_setup as detection_setup
+
+    project_path_obj = _project_paths(project_dir)
+    previous_backend = data_utils.get_query_backend()
+    data_utils.set_query_backend(LocalMimicBackend(mimic_dir))
+    try:
+        trauma_ids = extract_trauma_cohort_ids(project_path_obj, PROJECT_ID, is_report=False, is_saved=True)
+        trum_cohort_info_df, cx_df, abx_df, sofa_df = label_assignment.preprocess_data(project_path_obj, PROJECT_ID)
+        # Antibiotic order entries as passed to `consolidate_abx_orders` by `preprocess_abx_data`
+        abx_orders = project_path_obj.load_artifact('trauma_abx_order').drop_duplicates(['hadm_id', 'startdate', 'enddate', 'drug'])
+        raw_vs = detection_setup.extract_trauma_vitalsign(
+            project_path_obj, PROJECT_ID, trauma_ids[['subject_id', 'hadm_id', 'icustay_id', 'admittime']], is_report=False)
+    finally:
+        data_utils.set_query_backend(previous_backend)
+
+    candidates_df = reference.sepsis_onset_candidates(cx_df, abx_df, sofa_df)
+    sepsis_label = label_assignment.generate_sepsis_label_info(trum_cohort_info_df, candidates_df)
+    inputs = {'abx_orders': abx_orders, 'cx': cx_df, 'abx': abx_df, 'sofa': sofa_df,
+              'raw_vs': raw_vs, 'sepsis_label': sepsis_label}
+    for name, filling_method in FILLING_METHODS.items():
+        inputs[f'night_{name}'] = reference.extract_night_data(raw_vs, filling_method=filling_method)
+        inputs[f'night_ti_{name}'] = reference.gen_2Dnight_ti(inputs[f'night_{name}'])
+    return inputs
+
+def load_stage_inputs(work_dir, n_admissions, seed=0, rebuild=False, verbose=False):
+    """
+    Returns the inputs of the benchmarked stages (see the module notes) for a synthetic cohort of
+    `n_admissions` hospital admissions, building them on the first call.
+
+    Args:
+    - work_dir (str): Folder holding the synthetic data, pipeline artifacts and pickled inputs.
+    - n_admissions (int): Number of synthetic admissions (about 70% of them meet the trauma cohort criteria).
+    - seed (int, optional): Seed of the synthetic data.
+    - rebuild (bool, optional): Regenerate the data and inputs even if they were saved by an earlier run.
+    - verbose (bool, optional): Show the output of the pipeline while the inputs are built.
+
+    Returns:
+    - dict: {input name: DataFrame}.
+    """
+    base_path = size_dir(work_dir, n_admissions, seed)
+    inputs_path = os.path.join(base_path, 'inputs.pkl')
+    if os.path.exists(inputs_path) and not rebuild:
+        with open(inputs_path, 'rb') as f:
+            return pickle.load(f)
+
+    print(f"Building stage inputs for {n_admissions} synthetic admissions (seed={seed}) in {base_path}")
+    mimic_dir = os.path.join(base_path, 'mimic')
+    project_dir = os.path.join(base_path, 'project')
+    # Start from scratch: the pipeline would otherwise reuse the artifacts of an interrupted build
+    shutil.rmtree(base_path, ignore_errors=True)
+    generate_synthetic_mimic(mimic_dir, n_admissions=n_admissions, seed=seed)
+    with contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings():
+        if not verbose:
+            warnings.simplefilter('ignore')
+        inputs = _run_pipeline(mimic_dir, project_dir)
+
+    with open(inputs_path, 'wb') as f:
+        pickle.dump(inputs, f)
+    return inputs
@@ -0,0 +1,426 @@
+"""
+Reference implementations of the benchmarked pipeline stages.
+
+These are frozen copies of the original (unoptimized) functions of
+    scripts/sepsis_onset_label_assignment.py      assign_abx_seq, consolidate_abx_orders, suspected_infections,
+                                                  organ_dysfunction, sepsis_onset_candidates
+    scripts/early_sepsis_onset_detection_setup.py extract_night_data, gen_2Dnight_ti, assign_label2instance
+as first released. The benchmark suite (benchmarks/run_benchmarks.py) checks that the current implementations
+return the same tables as these ones, so optimizations of the pipeline never change the dataset.
+
+Do not edit or optimize this file: it defines the expected outputs.
+"""
+import numpy as np
+import pandas as pd
+from datetime import timedelta
+
+
+###################################
+# scripts/sepsis_onset_label_assignment.py
+###################################
+
+def assign_abx_seq(df):
+  """
+  This function groups antibiotic orders into sequences,
+  where each sequence represents a contiguous period of antibiotic administration,
+  The sequence ID is assigned to all orders within a single event.
+  A new event is identified based on the `newAbx` column, which marks the beginning of a new sequence.
+  """
+  newAbx_index = df[df.newAbx==1].index
+  n=newAbx_index.size
+  for seq, row_ind in enumerate(newAbx_index,1):
+    if (seq)==n:
+      df.loc[row_ind:df.index[-1],'Abx_seq'] = seq
+    else:
+      df.loc[row_ind:newAbx_index[seq], 'Abx_seq'] = seq
+    # print(seq, row_ind)
+  return df
+
+
+def consolidate_abx_orders(abx_df):
+  """
+  This function consolidates antibiotic order entries into distinct antibiotic events.
+  Specifically, it performs the following steps:
+
+  1. Clean the Raw Antibiotic Order Entries:
+    - Remove invalid time data where the end date is earlier than the start date.
+
+  2. Aggregate Order Entries into Event:
+    - Identify the starting points for each antibiotic event based on gaps in administration.
+      Specifically, a new event is defined when the same drug is not administered on the previous day.
+    - Aggregate overlapping or continuous segmented orders into a single event.
+  """
+  # 1. Clean up records: time period & drug name format
+  # Remove invalid records where end date is earlier than start date
+  before_drop_noise = abx_df.shape[0]
+  noise_data = abx_df.startdate > abx_df.enddate
+  clean_abx_df = abx_df[~noise_data]
+  print(f"Drop %d noise abx records s.t. startdate>enddate"%(before_drop_noise-clean_abx_df.shape[0]))
+
+  # 2. Assign newAbx: identify the starting points
+  new_abx_df = clean_abx_df.sort_values(['hadm_id', 'drug','startdate',	'enddate'])
+  new_abx_df['newAbx'] = np.nan #init
+  new_abx_df.iloc[0,-1] = 1 # assign newAbx label for first row
+  prev_df = new_abx_df.shift(periods=1)
+  prev_df.iloc[0] = new_abx_df.iloc[0]
+  new_abx_df.loc[new_abx_df.hadm_id != prev_df.hadm_id, 'newAbx'] = 1 # new pacient
+  new_abx_df.loc[new_abx_df.drug !=prev_df.drug, 'newAbx'] = 1 # new drug
+  diff_day =(new_abx_df.startdate - prev_df.enddate).apply(lambda x: x.days)
+  new_abx_df.loc[diff_day>1, 'newAbx'] = 1 # same drug not administered on previous day
+  # Group: assigns sequence IDs to antibiotic orders based on identified new orders.
+  new_abx_df = new_abx_df.groupby('hadm_id').apply(assign_abx_seq).reset_index(drop=True)
+  # Aggregate:
+  new_abx_df = new_abx_df.groupby(['hadm_id', 'Abx_seq']).agg({
+      # keep the 1st records
+
+      'adm_date': lambda x: x.iloc[0],
+      'disch_date': lambda x: x.iloc[0],
+      'drug': lambda x: x.iloc[0],
+      # keep the widest range
+      'startdate': "min",
+      'enddate': "max",
+  }).reset_index()
+
+  return new_abx_df
+
+
+def suspected_infections(cx_df, abx_df):
+    """
+    Identifies suspected infections by locating body tissue cultures that have been ordered within a 5-day window of antibiotic initiation.
+
+    Parameters:
+    - cx_df (pd.DataFrame): DataFrame containing culture information for one patient with columns 'hadm_id', 'cx_datetime', and 'cx_day'.
+    - abx_df (pd.DataFrame): DataFrame containing antibiotic initiation information for one patient with columns 'hadm_id' 'abx_date' and 'abx_day'.
+
+    Returns:
+    - pd.DataFrame: A DataFrame with information about suspected infections including:
+      - 'hadm_id': Hospital admission ID.
+      - 'onset_datetime': Timestamp of the suspected infections.
+      - 'onset_day': Day of the suspected infections.
+      - 'cx_index': Index of the culture that meet suspected infection criteria.
+      - 'cx_datetime': Datetime of the qualifying culture.
+      - 'cx_day': Day of the qualifying culture.
+      - 'abx_index': Index of the earliest antibiotic that meet suspected infection criteria.
+      - 'abx_date': Date of the earliest qualifying antibiotic.
+      - 'abx_day': Day of the earliest qualifying antibiotic.
+      - 'is_infection': Flag indicating if meets the infection criteria.
+    """
+    # Extract day from DataFrames
+    cx_dates = cx_df.cx_day.values
+    abx_dates = abx_df.abx_day.values
+
+    # Compute pairwise differences between culture days and antibiotic days
+    differences = np.abs(np.subtract.outer(cx_dates, abx_dates))  # Shape (#of cx, #of abx)
+
+    # Determine which antibiotics fall within the 5-day window [-2, 2] of each culture
+    in_5_day_window = np.where(differences <= 2, 1, 0)
+
+    # Create a DataFrame to store results
+    candidate_df = cx_df.reset_index().rename({'index':"cx_index"},axis=1)[['hadm_id', 'cx_index', 'cx_datetime','cx_day']].copy()
+    candidate_df['num_abx'] = np.sum(in_5_day_window, axis=1)  # Number of qualifying antibiotics
+    candidate_df['abx_index_li'] = [abx_df.index.values[np.nonzero(in_5_day_window[i])[0]] for i in range(candidate_df.shape[0])]  # Save indices of qualifying antibiotics
+    # candidate_df['abx_index_li'] = candidate_df['abx_index_li'].apply(lambda x: x[x != 0])  # Drop indices where criteria not met
+
+    # Filter cultures that meet the suspected infection criteria
+    candidate_df = candidate_df[candidate_df['num_abx'] > 0]
+    candidate_df['is_infection'] = 1
+
+    # Only Keep the earliest qualifying antibiotic info for each culture
+    candidate_df['abx_index'] = candidate_df.abx_index_li.apply(lambda x: x[0])
+    candidate_df['abx_date'] = candidate_df.abx_index_li.apply(lambda x: abx_df.loc[x[0],'startdate'])
+    candidate_df['abx_day'] = candidate_df.abx_index_li.apply(lambda x: abx_df.loc[x[0],'abx_day'])
+
+    # Use culture timestamp as suspected onset time
+    candidate_df['onset_datetime'] = candidate_df['cx_datetime']
+    candidate_df['onset_day'] = candidate_df['cx_day']
+
+    return candidate_df[['hadm_id', 'onset_datetime', 'onset_day',
+                         'cx_index', #'cx_datetime', 'cx_day',
+                         'abx_index',#'abx_date', 'abx_day',
+                         'is_infection']]
+
+
+def organ_dysfunction(day, sofa):
+    """
+    Pinpoints organ dysfunction by examining changes in the modified version of the SOFA score.
+    Specifically, identifies at least a 2-point increase within a 7-day window (3 days before, the day of, and 3 days after).
+
+    Parameters:
+    - day (int): The day used as the central point of a 7-day window (3 days before, day of, and 3 days after).
+    - sofa (pd.DataFrame): A DataFrame containing SOFA scores for a single patient (includes columns 'sofa_day' and 'sofa_24hours').
+
+    Returns:
+    - np.array: An array with three elements:
+        - A flag indicating whether the SOFA score increased by at least 2 points within the 7-day window (1 if true, 0 otherwise).
+        - The index of the SOFA score recorded at the earlier time (if an increase was observed, otherwise NaN).
+        - The index of the SOFA score recorded at the later time (if an increase was observed, otherwise NaN).
+
+    Notes:
+    - The function checks for SOFA score increases only within the specified 7-day window.
+    - If multiple increases are found, only the first pair is returned.
+    """
+    # Filter SOFA scores within the 7-day window around the specified day
+    sofa_7day_window_df = sofa[sofa.sofa_day.between(day - 3, day + 3, inclusive='both')].reset_index().rename({'index': 'sofa_index'}, axis=1)
+    if sofa_7day_window_df['sofa_24hours'].dtype != 'int64':
+        sofa_7day_window_df['sofa_24hours'] = sofa_7day_window_df['sofa_24hours'].astype('int64')
+    sofa_7day_window_values = sofa_7day_window_df.sofa_24hours.values
+
+    # Compute pairwise differences between SOFA scores
+    diff = np.subtract.outer(sofa_7day_window_values, sofa_7day_window_values)
+    increase = np.tril(diff, -1)  # only keep the Si-Sj, s.t i>j
+    later_time, earlier_time = (increase > 1).nonzero()
+
+    if later_time.size == 0:
+        # SOFA score increased less than 2 points
+        is_sofa_inc_at_least_2 = 0
+        later_index, earlier_index = np.nan, np.nan
+    else:
+        is_sofa_inc_at_least_2 = 1
+        # Only return the first pair where the increase is observed
+        later_index = sofa_7day_window_df.iloc[later_time[0]].sofa_index
+        earlier_index = sofa_7day_window_df.iloc[earlier_time[0]].sofa_index
+
+    return np.array([is_sofa_inc_at_least_2, earlier_index, later_index])
+
+
+def sepsis_onset_candidates(cx_df, abx_df, sofa_df, save_path=None):
+    """
+    Aggregates sepsis onset candidate information by analyzing culture, antibiotic, and SOFA score data for each patient.
+    - Identifies suspected infections.
+    - Pinpoints instances of organ dysfunction.
+
+    Parameters:
+    - cx_df (pd.DataFrame): DataFrame containing culture information.
+    - abx_df (pd.DataFrame): DataFrame containing antibiotic information.
+    - sofa_df (pd.DataFrame): DataFrame containing SOFA score information.
+
+    Returns:
+    - pd.DataFrame: Aggregated DataFrame containing sepsis onset candidate information.
+      The returned table contains the following columns:
+      - 'hadm_id': Patient ID.
+      - 'onset_datetime': Datetime of sepsis onset.
+      - 'onset_day': Day of sepsis onset.
+      - 'cx_index': Index of the culture event.
+      - 'abx_index': Index of the antibiotic event.
+      - 'is_infection': Flag indicating suspected infection.
+      - 'is_sepsis': Flag indicating sepsis (and also organ dysfunction).
+      - 'sofa_index_1': Index of the earlier SOFA score event.
+      - 'sofa_index_2': Index of the later SOFA score event.
+      This comprehensive table summarizes key data points needed to identify sepsis candidates.
+    """
+    aggregate_patient_candidates = []
+
+    # Iterate through all patients with qualifying culture events
+    for hadm_id in cx_df.hadm_id.unique():
+        # Get patient-specific information
+        cx = cx_df[cx_df.hadm_id == hadm_id]
+        abx = abx_df[abx_df.hadm_id == hadm_id]
+        sofa = sofa_df[sofa_df.hadm_id == hadm_id]
+
+        # Identify suspected infections
+        candidate_df = suspected_infections(cx, abx)
+
+        # Pinpoint instances of organ dysfunction if the patient is infected
+        if candidate_df.shape[0] != 0:
+            # isSepsis=1: if the patient is both infected and has organ dysfunction
+            candidate_df = pd.concat([candidate_df,
+                          pd.DataFrame(
+                              np.stack(candidate_df.onset_day.apply(lambda x: organ_dysfunction(x, sofa))),
+                              columns=['is_sepsis', 'sofa_index_1', 'sofa_index_2']
+                              )], axis=1)
+            aggregate_patient_candidates.append(candidate_df)  # Accumulate table even if not meeting the organ dysfunction criteria
+
+        # # Display debug information
+        # print("Patient:", hadm_id)
+        # display('cx_date', cx)
+        # display('abx_date', abx)
+        # index_li = np.unique(candidate_df[['sofa_index_1', 'sofa_index_2']].values.flatten())
+        # index_li = index_li[~np.isnan(index_li)]
+        # print("index_li:", index_li)
+        # display('sofa', sofa.loc[index_li, :])
+        # display('candidate', candidate_df)
+
+    # Combine all candidate DataFrames
+    aggregate_patient_candidates_df = pd.concat(aggregate_patient_candidates, ignore_index=True)
+
+    if save_path is not None:
+        aggregate_patient_candidates_df.to_csv(save_path)
+
+    return aggregate_patient_candidates_df
+
+
+###################################
+# scripts/early_sepsis_onset_detection_setup.py
+###################################
+
+def extract_night_data(df, filling_method=None, ffill_window_size=15):
+  """
+  Extracts and processes night-time data from the given DataFrame with raw data from the MIMIC-III dataset.
+
+  This function optionally filters missing records and aggregates hourly values.
+  At the end, it retains only data recorded during nighttime hours (22:00 to 06:00).
+
+  Parameters:
+  -----------
+  df : pandas.DataFrame
+      The input DataFrame containing raw input data with at least 'hadm_id', 'Day', 'Hour', and feature columns.
+
+  filling_method : str, optional
+      The method to use for filling missing values. Supported values are:
+      - 'f_and_b': Forward fill with a specified window size followed by backward fill within the night-time period itself (up to 06:00).
+      - 'forward': Forward fill with a specified window size.
+      If None (default), no filling is applied, and the returned DataFrame may contain null values.
+
+  ffill_window_size : int, optional (default=15)
+      The size of the window (in hours) before the beginning of the nighttime period (22:00).
+      This parameter is used only for forward filling; default is 15 hours, meaning data from 07:00 to 06:00 the next day will be used for forward filling.
+
+  Returns:
+  --------
+  pandas.DataFrame
+      A DataFrame containing the processed night-time data, with missing values filled (if specified)
+      and aggregated into 2D arrays representing hourly data for each patient.
+      If `filling_method` is None, the returned DataFrame may contain null values.
+
+  Notes:
+  ------
+  - The function assumes that the DataFrame includes a 'Day' column representing the hospital day since admission and an 'Hour' column representing the hour of the day.
+  - If `filling_method` is not None, the function will fill missing values.
+   """
+  # Filtering for nighttime hours
+  if filling_method==None:
+    # Extract nighttime data without filling
+    night_df = df[(df['Hour'] >= 22) | (df['Hour'] <= 6)].sort_values(['hadm_id', 'Day', 'Hour'])
+    print(f"Extracted nighttime data without filling: {night_df.shape[0]} samples for {night_df.hadm_id.nunique()} trauma patients")
+
+
+    # Assign Night number and adjust dates for overnight periods
+    night_df.loc[night_df['Hour']<=6, 'Day'] = (night_df.Day - 1)
+    night_df.rename(columns={'Day': 'Night'}, inplace=True)
+    night_df.loc[night_df['Hour']<=6, 'Date'] = (night_df.Date - timedelta(days=1))
+  else:
+    # Extend the time window based on the filling method
+    # (i.e. if ffill_window_size=15, then ffill_window is 7am- next day 6am)
+    window_s = 22-ffill_window_size
+    window_e = 6 # backward fill uses data within the nighttime period (before 06:00).
+    night_df = df[(df['Hour'] >= window_s) | (df['Hour'] <= window_e)].sort_values(['hadm_id', 'Day', 'Hour']) # with filling window
+    # night_df_only_night = df[(df['Hour'] >= 22) | (df['Hour'] <= 6)]#.sort_values(['hadm_id', 'Day', 'Hour'])
+    print(f"Extracted nighttime data with filling window: {night_df.shape[0]} samples for {night_df.hadm_id.nunique()} trauma patients")
+
+    # Unifying data group for overnight dates with filling windows
+    night_df.loc[night_df['Hour']<= window_e, 'Day'] = (night_df.Day - 1)
+    night_df.rename(columns={'Day': 'Night'}, inplace=True)
+    night_df.loc[night_df['Hour']<= window_e, 'Date'] = (night_df.Date - timedelta(days=1))
+
+  # Fill missing timestamps in the nighttime range
+  day_ids = ['subject_id', 'hadm_id','Date', 'Night']
+  hour_ids = day_ids + ['Hour']
+  night_time_list = [22, 23] + [i for i in range(7)]
+  night_hour = night_df.groupby(day_ids).apply(
+      lambda x: pd.DataFrame(night_time_list, columns=['Hour'])
+      ).reset_index(names= day_ids +['TimeIndex'])
+  full_night = night_df.merge(
+      night_hour, on=hour_ids,how='outer'
+      ).sort_values(['hadm_id', 'Night', 'TimeIndex'])
+  print(f"After filling in missing timestamps: {full_night.shape[0]} samples for {full_night.hadm_id.nunique()} trauma patients")
+
+  # Apply the filling method if specified
+  if filling_method!=None:
+    if (filling_method=='f_and_b'):
+      # Forward fill followed by backward fill
+      full_night = full_night.groupby(day_ids).apply(lambda group: group.ffill()).reset_index(drop=True)
+      full_night = full_night.groupby(day_ids).apply(lambda group: group.bfill()).reset_index(drop=True)
+      print(f"After forward and backward filling: {full_night.shape[0]} samples for {full_night.hadm_id.nunique()} trauma patients")
+
+    if (filling_method=='forward'):
+      # Forward fill only
+      full_night = full_night.groupby(day_ids).apply(lambda group: group.ffill()).reset_index(drop=True)
+      print(f"After forward filling: {full_night.shape[0]} samples for {full_night.hadm_id.nunique()} trauma patients")
+
+  # Aggregate values in the same hour into one value per feature
+  # day_ids = ['subject_id', 'hadm_id','Date', 'Night']
+  # hour_ids = day_ids + ['Hour']
+  night_AggInHour_df = full_night.groupby(hour_ids).mean().reset_index()
+  print(f"After aggregating one hour into one value: {night_AggInHour_df.shape[0]} samples for {night_AggInHour_df.hadm_id.nunique()} trauma patients")
+
+  if filling_method!=None:
+    # Drop rows with remaining NaN values
+    night_AggInHour_df.dropna(subset=night_AggInHour_df.columns, axis=0, how='any', inplace=True)
+    print(f"After dropping NaN values: {night_AggInHour_df.shape[0]} samples for {night_AggInHour_df.hadm_id.nunique()} trauma patients")
+    # Filter for rows between 22:00 and 06:00
+    night_AggInHour_df = night_AggInHour_df[(night_AggInHour_df['Hour'] >= 22) | (night_AggInHour_df['Hour'] <= 6)]
+    print(f"After removing filling window: {night_AggInHour_df.shape[0]} samples for {night_AggInHour_df.hadm_id.nunique()} trauma patients")
+
+    # Keep only nights that have all 9 timestamps
+    night_timestamp_count = night_AggInHour_df.groupby(day_ids).size().reset_index().rename({0:'num'}, axis=1)
+    full_night_timestamp = night_timestamp_count.loc[night_timestamp_count.num==9, day_ids]
+    night_AggInHour_df = night_AggInHour_df.merge(full_night_timestamp, on=day_ids)
+    print(f"After retaining complete nights: {night_AggInHour_df.shape[0]} samples for {night_AggInHour_df.hadm_id.nunique()} trauma patients")
+
+  return night_AggInHour_df.sort_values(['hadm_id', 'Night', 'TimeIndex'])
+
+
+def gen_2Dnight_ti(df):
+  """
+  Groups by patient and night, then aggregates the values into 2D arrays.
+  Each row represents one patient on one night.
+  Filters the nights to include only those from days 2 to 14
+  """
+  index_columns = ['subject_id', 'hadm_id', #'icustay_id',
+                   'Date', 'Night', 'Hour', 'TimeIndex']
+  df = df.sort_values(index_columns)
+
+  # Group by patient and night, then aggregate values into 2D arrays
+  ti = df.groupby(['subject_id', 'hadm_id','Date','Night']).apply(
+      lambda x: x.drop(columns=index_columns).values
+      ).reset_index()
+  ti.columns = ['subject_id', 'hadm_id', 'Date','Night', 'Temporal Features']
+  print(f"After aggregating one night into 2D time-series, {ti.shape[0]} samples for {ti['hadm_id'].nunique()} trauma patients.")
+
+  # Filter the nights to exclude the first 1 days
+  ti_after2D = ti[(ti.Night>=2)]
+  print(f"After filtering out the first night, {ti_after2D.shape[0]} samples for {ti_after2D['hadm_id'].nunique()} trauma patients.")
+  # Filter out nights after day 14
+  ti = ti_after2D[ti_after2D.Night<=14]
+  print(f"After filtering out nights beyond day 14, {ti.shape[0]} samples for {ti['hadm_id'].nunique()} trauma patients.")
+
+  return ti
+
+
+def assign_label2instance(ti_df, label_df):
+    """
+    Assigns labels (0/1) to nighttime instances based on sepsis onset timestamps.
+    Specifically, assigns a positive label if sepsis onset occurs within 24 hours after the night.
+    """
+    # Identify sepsis and non-sepsis patient identifiers based on labels
+    nonsepsis_ids = label_df.is_sepsis == 0
+    sepsis_ids = label_df.is_sepsis == 1
+    # print(f"Trauma Cohort: sepsis patients ({sum(sepsis_ids)}) + non-sepsis patients ({sum(nonsepsis_ids)}) = {label_df.shape[0]}")
+
+    # Extract data for non-sepsis patients & assign negative label; these data are ready
+    nonsepsis_patient_ti_df = ti_df[ti_df['hadm_id'].isin(label_df[nonsepsis_ids]['hadm_id'])]
+    nonsepsis_patient_ti_df = nonsepsis_patient_ti_df.assign(Label=0)
+    print(f"{nonsepsis_patient_ti_df.shape[0]} Negative instances for {sum(nonsepsis_ids)} non-sepsis patients")
+
+    # Extract data for sepsis patients
+    sepsis_patient_ti_df = ti_df[ti_df['hadm_id'].isin(label_df[sepsis_ids]['hadm_id'])]
+    print(f"{sepsis_patient_ti_df.shape[0]} instances for {sum(sepsis_ids)} sepsis patients")
+
+    sepsis_patient_df = sepsis_patient_ti_df.merge(label_df[['hadm_id', 'onset_datetime', 'onset_day']], on='hadm_id')
+
+    # Classify the relationship between recorded time and onset time
+    night_end_time = pd.to_datetime(sepsis_patient_df.Date) + pd.to_timedelta(1, unit='d') + pd.to_timedelta(6, unit='h')
+    time_diff = (pd.to_datetime(sepsis_patient_df['onset_datetime']) - night_end_time)
+    is_positive = (time_diff > pd.to_timedelta(0, unit='d')) & (time_diff <= pd.to_timedelta(1, unit='d'))
+    sepsis_patient_df['Label'] = np.where(is_positive, 1, 0)
+    # Drop instances after the onset time
+    after_onset = (time_diff > pd.to_timedelta(1, unit='d'))
+    sepsis_patient_df = sepsis_patient_df[~after_onset]
+    print(f"Dropped {after_onset.sum()} instances after sepsis onset")
+    print(f"\t {sepsis_patient_df.Label.value_counts()[1]} (1s) + {sepsis_patient_df.Label.value_counts()[0]} (0s)")
+
+    # Combine data from sepsis and non-sepsis patients
+    mimic_data_df = pd.concat([nonsepsis_patient_ti_df, sepsis_patient_df[nonsepsis_patient_ti_df.columns]])
+    print(f"Final Dataset: {mimic_data_df['Label'].value_counts()[1]}(1s) + {mimic_data_df['Label'].value_counts()[0]}(0s) = {mimic_data_df.shape[0]} (Patients={mimic_data_df['hadm_id'].nunique()})")
+
+    return mimic_data_df
@@ -0,0 +1,256 @@
+"""
+Stage-level benchmarks of the pipeline scripts.
+
+Runs each benchmarked stage (see BENCHMARKS) on synthetic inputs at several cohort sizes (benchmarks/inputs.py),
+records its wall time and peak memory, and checks its output against the reference implementation
+(benchmarks/reference.py). The run fails (exit code 1) when a stage
+    - returns a different table than the reference implementation,
+    - is slower than the reference implementation (or than a saved earlier run, see --compare) by more than --tolerance,
+    - uses more peak memory than the reference implementation (or an earlier run) by more than --memory-tolerance.
+
+Usage (from the repository root):
+    python -m benchmarks.run_benchmarks                                  # default sizes, all stages
+    python -m benchmarks.run_benchmarks --sizes 1570 15700 --repeat 5    # about the trauma cohort, and 10x
+    python -m benchmarks.run_benchmarks --stages consolidate_abx_orders sepsis_onset_candidates
+    python -m benchmarks.run_benchmarks --save before.json               # then, after a change:
+    python -m benchmarks.run_benchmarks --compare before.json
+"""
+import argparse
+import contextlib
+import datetime
+import gc
+import importlib
+import io
+import json
+import os
+import pickle
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from benchmarks import reference
+from benchmarks.inputs import load_stage_inputs, size_dir
+
+
+_LABELS = 'scripts.sepsis_onset_label_assignment'
+_SETUP = 'scripts.early_sepsis_onset_detection_setup'
+
+# Benchmarked stages: function of the pipeline (compared with the function of the same name in
+# benchmarks/reference.py), names of its positional inputs (see benchmarks/inputs.py) and keyword arguments
+BENCHMARKS = {
+    'consolidate_abx_orders': {'module': _LABELS, 'function': 'consolidate_abx_orders', 'inputs': ['abx_orders']},
+    'sepsis_onset_candidates': {'module': _LABELS, 'function': 'sepsis_onset_candidates', 'inputs': ['cx', 'abx', 'sofa']},
+    'extract_night_data[f_and_b]': {'module': _SETUP, 'function': 'extract_night_data', 'inputs': ['raw_vs'],
+                                    'kwargs': {'filling_method': 'f_and_b'}},
+    'extract_night_data[none]': {'module': _SETUP, 'function': 'extract_night_data', 'inputs': ['raw_vs'],
+                                 'kwargs': {'filling_method': None}},
+    'gen_2Dnight_ti[f_and_b]': {'module': _SETUP, 'function': 'gen_2Dnight_ti', 'inputs': ['night_f_and_b']},
+    'gen_2Dnight_ti[none]': {'module': _SETUP, 'function': 'gen_2Dnight_ti', 'inputs': ['night_none']},
+    'assign_label2instance[f_and_b]': {'module': _SETUP, 'function': 'assign_label2instance',
+                                       'inputs': ['night_ti_f_and_b', 'sepsis_label']},
+    'assign_label2instance[none]': {'module': _SETUP, 'function': 'assign_label2instance',
+                                    'inputs': ['night_ti_none', 'sepsis_label']},
+}
+DEFAULT_SIZES = [250, 500, 1000]
+DEFAULT_WORK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '_work')
+# Peak memory differences below this size are never regressions (allocator noise on the smallest inputs)
+_MIN_MEMORY_DELTA_MB = 1.0
+
+
+@contextlib.contextmanager
+def _quiet():
+    # The stages print progress messages and pandas warnings; keep them out of the timings and the report
+    with contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        yield
+
+def _copy_inputs(args):
+    # Every run gets its own copy of the inputs, in case a stage modifies them in place
+    return [arg.copy() if isinstance(arg, pd.DataFrame) else arg for arg in args]
+
+def measure(func, args, kwargs=None, repeat=3):
+    """
+    Runs `func(*args, **kwargs)` `repeat` times for the wall time, plus once under tracemalloc for the peak memory.
+
+    Returns:
+    - tuple: (output of the last run, dict with 'time_s' (fastest run), 'time_median_s' and 'peak_mb')
+    """
+    kwargs = kwargs or {}
+    times = []
+    for _ in range(repeat):
+        run_args = _copy_inputs(args)
+        gc.collect()
+        with _quiet():
+            start = time.perf_counter()
+            func(*run_args, **kwargs)
+            times.append(time.perf_counter() - start)
+    # Peak memory allocated by the stage (Python objects and NumPy buffers), output included
+    run_args = _copy_inputs(args)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        with _quiet():
+            output = func(*run_args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return output, {'time_s': min(times), 'time_median_s': statistics.median(times), 'peak_mb': peak / 2**20}
+
+def _is_array_column(series):
+    return series.dtype == object and len(series) > 0 and isinstance(series.iloc[0], np.ndarray)
+
+def compare_outputs(actual, expected):
+    """
+    Compares the output of a stage with the reference output: same columns, dtypes, index and values
+    (exact comparison; NaN equals NaN). Columns of arrays (e.g. 'Temporal Features') are compared array by array.
+
+    Returns:
+    - str or None: Description of the first difference, None if the outputs are identical.
+    """
+    try:
+        if not isinstance(actual, pd.DataFrame):
+            return f"expected a DataFrame, got {type(actual).__name__}"
+        array_columns = [column for column in expected.columns if _is_array_column(expected[column])]
+        pd.testing.assert_index_equal(actual.columns, expected.columns)
+        pd.testing.assert_frame_equal(actual.drop(columns=array_columns), expected.drop(columns=array_columns), check_exact=True)
+        for column in array_columns:
+            for i, (a, e) in enumerate(zip(actual[column], expected[column])):
+                if not isinstance(a, np.ndarray) or a.dtype != e.dtype or a.shape != e.shape or not np.array_equal(a, e, equal_nan=True):
+                    return f"column '{column}' differs at row {i}"
+    except AssertionError as e:
+        return ' '.join(str(e).split())[:300]
+    return None
+
+def _reference_result(name, args, kwargs, cache_dir, repeat, refresh):
+    # The reference implementation never changes: its output and measurements are computed once per input
+    path = os.path.join(cache_dir, f'{name}.pkl')
+    if os.path.exists(path) and not refresh:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    func = getattr(reference, BENCHMARKS[name]['function'])
+    output, metrics = measure(func, args, kwargs, repeat)
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(path, 'wb') as f:
+        pickle.dump((output, metrics), f)
+    return output, metrics
+
+def _check(record, baseline, prefix, tolerance, memory_tolerance, min_time_delta):
+    # Regressions of the current run against `baseline` measurements (reference implementation or earlier run)
+    problems = []
+    if record['time_s'] > tolerance * baseline['time_s'] and record['time_s'] - baseline['time_s'] > min_time_delta:
+        problems.append(f"{record['time_s'] / baseline['time_s']:.2f}x slower than {prefix}")
+    if record['peak_mb'] > memory_tolerance * baseline['peak_mb'] and record['peak_mb'] - baseline['peak_mb'] > _MIN_MEMORY_DELTA_MB:
+        problems.append(f"{record['peak_mb'] / baseline['peak_mb']:.2f}x more memory than {prefix}")
+    return problems
+
+def run_benchmarks(sizes=DEFAULT_SIZES, stages=None, repeat=3, seed=0, work_dir=DEFAULT_WORK_DIR,
+                   compare=None, tolerance=1.25, memory_tolerance=1.25, min_time_delta=0.1,
+                   rebuild=False, refresh_reference=False):
+    """
+    Benchmarks the pipeline stages against the reference implementations.
+
+    Args:
+    - sizes (list of int, optional): Numbers of synthetic admissions (cohort sizes) to run.
+    - stages (list of str, optional): Benchmarks to run (names of BENCHMARKS, or function names to run all their variants).
+    - repeat (int, optional): Timed runs per stage and size (the fastest one is reported).
+    - seed (int, optional): Seed of the synthetic data.
+    - work_dir (str, optional): Folder for the synthetic data, inputs and cached reference results.
+    - compare (list of dict, optional): Records of an earlier run (see --save), checked for regressions as well.
+    - tolerance (float, optional): Maximum allowed ratio of wall times (current / baseline).
+    - memory_tolerance (float, optional): Maximum allowed ratio of peak memory (current / baseline).
+    - min_time_delta (float, optional): Wall time differences below this many seconds are never regressions (timer noise).
+    - rebuild (bool, optional): Regenerate the synthetic data and inputs.
+    - refresh_reference (bool, optional): Re-measure the reference implementations (e.g. on another machine).
+
+    Returns:
+    - DataFrame: One row per benchmark and size, with the measurements, the speedup over the reference implementation
+                 and a 'status' column ('ok', or the list of detected problems).
+    """
+    names = [name for name in BENCHMARKS
+             if stages is None or name in stages or BENCHMARKS[name]['function'] in stages]
+    previous = {(r['benchmark'], r['n_admissions']): r for r in (compare or [])}
+    records = []
+    for n_admissions in sizes:
+        inputs = load_stage_inputs(work_dir, n_admissions, seed=seed, rebuild=rebuild)
+        cache_dir = os.path.join(size_dir(work_dir, n_admissions, seed), 'reference')
+        for name in names:
+            spec = BENCHMARKS[name]
+            args = [inputs[input_name] for input_name in spec['inputs']]
+            kwargs = spec.get('kwargs', {})
+            print(f"[n={n_admissions}] {name} ...", end=' ', flush=True)
+            # Looked up at run time, so the benchmark always measures the current code
+            func = getattr(importlib.import_module(spec['module']), spec['function'])
+            expected, ref_metrics = _reference_result(name, args, kwargs, cache_dir, repeat, refresh_reference or rebuild)
+            output, metrics = measure(func, args, kwargs, repeat)
+
+            record = {'benchmark': name, 'n_admissions': n_admissions, 'input_rows': int(len(args[0])),
+                      **metrics,
+                      'ref_time_s': ref_metrics['time_s'], 'ref_peak_mb': ref_metrics['peak_mb'],
+                      'speedup': ref_metrics['time_s'] / metrics['time_s'],
+                      'memory_ratio': metrics['peak_mb'] / ref_metrics['peak_mb']}
+            problems = []
+            difference = compare_outputs(output, expected)
+            if difference is not None:
+                problems.append(f"output differs from the reference: {difference}")
+            problems += _check(record, ref_metrics, 'the reference', tolerance, memory_tolerance, min_time_delta)
+            if (name, n_admissions) in previous:
+                problems += _check(record, previous[(name, n_admissions)], 'the compared run', tolerance, memory_tolerance, min_time_delta)
+            record['status'] = '; '.join(problems) if problems else 'ok'
+            print(f"{metrics['time_s']:.3f}s, {metrics['peak_mb']:.1f} MB, {record['speedup']:.2f}x -> {record['status']}")
+            records.append(record)
+    return pd.DataFrame(records)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='numbers of synthetic admissions')
+    parser.add_argument('--stages', nargs='+', default=None, help=f"benchmarks to run: {', '.join(BENCHMARKS)} (or function names)")
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per stage and size')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic data')
+    parser.add_argument('--work-dir', default=DEFAULT_WORK_DIR, help='folder for synthetic data, inputs and reference results')
+    parser.add_argument('--save', default=None, help='write the results of this run to a JSON file')
+    parser.add_argument('--compare', default=None, help='JSON results of an earlier run (--save) to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=1.25, help='maximum allowed wall time ratio')
+    parser.add_argument('--memory-tolerance', type=float, default=1.25, help='maximum allowed peak memory ratio')
+    parser.add_argument('--min-time-delta', type=float, default=0.1, help='wall time differences (s) ignored as noise')
+    parser.add_argument('--rebuild', action='store_true', help='regenerate the synthetic data and inputs')
+    parser.add_argument('--refresh-reference', action='store_true', help='re-measure the reference implementations')
+    args = parser.parse_args(argv)
+
+    compare = None
+    if args.compare is not None:
+        with open(args.compare) as f:
+            compare = json.load(f)['results']
+    results = run_benchmarks(sizes=args.sizes, stages=args.stages, repeat=args.repeat, seed=args.seed,
+                             work_dir=args.work_dir, compare=compare, tolerance=args.tolerance,
+                             memory_tolerance=args.memory_tolerance, min_time_delta=args.min_time_delta,
+                             rebuild=args.rebuild, refresh_reference=args.refresh_reference)
+
+    with pd.option_context('display.width', 200, 'display.max_colwidth', 80):
+        print()
+        print(results[['benchmark', 'n_admissions', 'input_rows', 'time_s', 'peak_mb',
+                       'ref_time_s', 'ref_peak_mb', 'speedup', 'status']].round(3).to_string(index=False))
+
+    if args.save is not None:
+        with open(args.save, 'w') as f:
+            json.dump({'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+                       'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__,
+                       'machine': platform.platform(), 'seed': args.seed,
+                       'results': results.to_dict(orient='records')}, f, indent=2)
+        print(f"Saved results to {args.save}")
+
+    failed = results[results.status != 'ok']
+    if len(failed):
+        print(f"\n{len(failed)} benchmark(s) failed")
+        return 1
+    print("\nAll benchmarks passed")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
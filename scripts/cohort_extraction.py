@@ -27,6 +27,7 @@ import matplotlib.pyplot as plt
 from datetime import date
 from src.data.data_fetcher import get_demographics_data, get_ventilation_data
 from src.data import data_utils#, sql2df, data_fetcher
+from src.data import query_scheduler
 
 """
 # Qulified ICD9 E-code
@@ -102,9 +103,18 @@ def extract_trauma_cohort_ids(project_path_obj, #Saved File Paths
              (Stern K, Qiu Q, Weykamp M, O’Keefe G, Brakenridge SC.
               Defining Posttraumatic Sepsis for Population-Level Research.
               JAMA Netw Open. 2023;6(1):e2251445. doi:10.1001/jamanetworkopen.2022.51445 )
+
+  The demographics, diagnoses and ventilation tables are independent, so they are extracted concurrently
+  (see src/data/query_scheduler.py).
   """
+  # Submit the independent extractions up front
+  scheduler = query_scheduler.get_scheduler()
+  demog_future = scheduler.submit(get_demographics_data, project_path_obj, project_id)
+  icd_future = scheduler.submit(select_ICDcode_df, project_path_obj, project_id)
+  vent_future = None if vent_threshold == None else scheduler.submit(get_ventilation_data, project_path_obj, project_id)
+
   # Get qualified patients' demographics: (with corresponding CHARTEVENTS data and at least 1 ICUStay_ID) 
-  demog_df = get_demographics_data(project_path_obj, project_id)
+  demog_df = demog_future.result()
   demog_df = demog_df[['subject_id', 'hadm_id', 'icustay_id',
                        'admission_age', 'admittime', 'dischtime',
                        'los_hospital_hours', 'los_hospital_days', 'hospital_expire_flag']]
@@ -112,7 +122,7 @@ def extract_trauma_cohort_ids(project_path_obj, #Saved File Paths
 
   # Selected according to E-codes
   # group by IDs and aggregate ICD9_CODE info because we want unique IDs
-  TRUM_df = select_ICDcode_df(project_path_obj, project_id).groupby(['SUBJECT_ID', 'HADM_ID'])['ICD9_CODE'].agg(set).reset_index()
+  TRUM_df = icd_future.result().groupby(['SUBJECT_ID', 'HADM_ID'])['ICD9_CODE'].agg(set).reset_index()
   TRUM_df = demog_df[demog_df['hadm_id'].isin(TRUM_df.HADM_ID)]
 
   # filter according to the age in range [18, 89]
@@ -127,7 +137,7 @@ def extract_trauma_cohort_ids(project_path_obj, #Saved File Paths
     trum_df = TRUM_df_los
   else:
     # get ventilation day table
-    vent_day_count = get_ventilation_data(project_path_obj, project_id)
+    vent_day_count = vent_future.result()
     # select according to Ventilation days >= vent_threshold (default is 3) for each patient
     TRUM_df_vent = TRUM_df_los.merge(vent_day_count, on='hadm_id', how='left')
     trum_vent_day_count = TRUM_df_vent[['hadm_id','date_count']].drop_duplicates()
@@ -156,7 +166,6 @@ def extract_trauma_cohort_ids(project_path_obj, #Saved File Paths
               (num_not_intubated, intubated_less_thr, vent_threshold))
     print("Final Cohort Size: %d" % trum_df.hadm_id.nunique())
   if is_saved:
-    print("Save to: ", project_path_obj.trauma_cohort_info_path)
-    trum_df.to_csv(project_path_obj.trauma_cohort_info_path)
+    print("Save to: ", project_path_obj.save_artifact('trauma_cohort_info', trum_df))
 
   return trum_df
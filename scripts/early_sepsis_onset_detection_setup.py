@@ -26,7 +26,7 @@ from sklearn.model_selection import StratifiedKFold
 
 
 
-from src.data import data_utils, sql2df
+from src.data import data_utils, sql2df, query_scheduler, artifact_store, hospital_time, instance_store, observation_windows
 from scripts.cohort_extraction import extract_trauma_cohort_ids
 from scripts.sepsis_onset_label_assignment import assign_sepsis_labels
 
@@ -40,16 +40,28 @@ The model leverages nighttime vital signs data to detect early sepsis onset with
 #This section details the extraction of nine vital sign features from the CHARTEVENTS table of the MIMIC-III dataset for trauma patients.
 def extract_trauma_vitalsign(project_path_obj, project_id,
                               trauma_ids,
-                              is_report=True):
+                              is_report=True,
+                              batch_size=500000,
+                              scope_to_cohort=True):
     """
     Extracts and merges vital signs and FiO2 data for trauma patients from the MIMIC-III dataset.
     The extracted features include: 'HeartRate', 'SysBP', 'DiasBP', 'MeanBP', 'RespRate', 'TempC', 'SpO2', 'Glucose', and 'FiO2'.
 
+    The pivoted tables cover every ICU stay in MIMIC-III, so they are read (or queried) in chunks of `batch_size` rows
+    and only the trauma patients' rows of each chunk are kept: peak memory is bounded by the batch size, not by the table size.
+    The two tables are independent and are read concurrently (see src/data/query_scheduler.py).
+    If the full tables have not been saved yet and `scope_to_cohort` is True, the queries are restricted to the trauma
+    patients' ICU stays inside the query engine. The cohort-only results are not saved to the `raw` folder, but as the
+    artifacts 'trauma_pivoted_vital' and 'trauma_pivoted_fio2' of the `processed` folder, keyed on the cohort's ICU stays
+    (see `artifact_store.cohort_key`), so later calls for the same cohort read them instead of querying again.
+
     Parameters:
         project_path_obj (object): Provides paths to processed data files.
         project_id (str): Project identifier for BigQuery database access.
         trauma_ids (DataFrame): DataFrame containing IDs and their corresponding hospital admission information of trauma patients.
         is_report (bool): Flag to enable printing of summary statistics for the extracted data.
+        batch_size (int): Number of rows of the pivoted tables processed at a time.
+        scope_to_cohort (bool): Query only the trauma patients' ICU stays instead of all of MIMIC-III.
 
     Returns:
         DataFrame: A DataFrame containing vital signs and FiO2 data for the specified trauma patients,
@@ -59,35 +71,58 @@ def extract_trauma_vitalsign(project_path_obj, project_id,
         - pivoted_vital.sql: Extracts general vital signs [View Script](https://github.com/MIT-LCP/mimic-code/blob/main/mimic-iii/concepts/pivot/pivoted_vital.sql)
         - pivoted_fio2.sql: Specifically extracts FiO2 levels [View Script](https://github.com/MIT-LCP/mimic-code/blob/main/mimic-iii/concepts/pivot/pivoted_fio2.sql)
     """
-    # Load vital signs data
-    path = project_path_obj.get_raw_data_file("pivoted_vital.csv")
-    if os.path.exists(path):
-        vital_df = pd.read_csv(path, index_col=0)
-    else:
-        query = """
+    params = {'icustay_ids': trauma_ids['icustay_id'] if scope_to_cohort else None}
+    scheduler = query_scheduler.get_scheduler()
+    # Cohort-only results are saved under a key of the cohort's ICU stays
+    scope_key = artifact_store.cohort_key(trauma_ids['icustay_id']) if scope_to_cohort else None
+
+    def saved_batches(name):
+        # Saved rows of the full table, or of the cohort's ICU stays (None if neither was saved)
+        if project_path_obj.artifact_exists(name):
+            return project_path_obj.iter_artifact_batches(name, batch_size)
+        if scope_key is not None and project_path_obj.artifact_exists(f'trauma_{name}', key=scope_key):
+            return project_path_obj.iter_artifact_batches(f'trauma_{name}', batch_size, key=scope_key)
+        return None
+
+    def save_batches(batches, name):
+        # Save the queried rows chunk by chunk (full table, or the cohort's rows under its key)
+        if scope_key is not None:
+            name = f'trauma_{name}'
+        return artifact_store.write_artifact_batches(batches, project_path_obj.get_artifact_path(name, key=scope_key), name)
+
+    def collect_trauma_rows(batches, name):
+        # Keep only the trauma patients' rows of each chunk (no chunk: no rows, with the columns of artifact `name`)
+        no_rows = artifact_store.apply_schema(pd.DataFrame(columns=list(artifact_store.ARTIFACT_SCHEMAS[name]['columns'])), name)
+        return pd.concat([trauma_ids.merge(chunk, on='icustay_id', how='inner') for chunk in batches]
+                         or [trauma_ids.iloc[:0].merge(no_rows, on='icustay_id', how='inner')], ignore_index=True)
+
+    # Load vital signs data (streamed, and saved chunk by chunk on the first run)
+    vital_batches = saved_batches('pivoted_vital')
+    if vital_batches is None:
+        query = f"""
         SELECT *
         FROM `physionet-data.mimiciii_derived.pivoted_vital`
+        {data_utils.id_filter('icustay_id', 'icustay_ids', params['icustay_ids'], prefix='WHERE')}
         ORDER BY icustay_id, charttime;
         """
-        vital_df = data_utils.run_query(query, project_id)
-        vital_df.to_csv(path)
+        vital_batches = save_batches(data_utils.run_query_batches(query, project_id, batch_size, params=params), 'pivoted_vital')
+    vital_future = scheduler.submit(collect_trauma_rows, vital_batches, 'pivoted_vital')
 
-    # Load FiO2 data
-    path = project_path_obj.get_raw_data_file("pivoted_fio2.csv")
-    if os.path.exists(path):
-        fio2_df = pd.read_csv(path, index_col=0)
-    else:
-        query = """
+    # Load FiO2 data (streamed, and saved chunk by chunk on the first run)
+    fio2_batches = saved_batches('pivoted_fio2')
+    if fio2_batches is None:
+        query = f"""
         SELECT *
         FROM `physionet-data.mimiciii_derived.pivoted_fio2`
+        {data_utils.id_filter('icustay_id', 'icustay_ids', params['icustay_ids'], prefix='WHERE')}
         """
-        fio2_df = data_utils.run_query(query, project_id)
-        fio2_df = fio2_df[~(fio2_df.fio2.isna())]
-        fio2_df.to_csv(path)
+        fio2_batches = data_utils.run_query_batches(query, project_id, batch_size, params=params)
+        fio2_batches = save_batches((chunk[~(chunk.fio2.isna())] for chunk in fio2_batches), 'pivoted_fio2')
+    fio2_future = scheduler.submit(collect_trauma_rows, fio2_batches, 'pivoted_fio2')
+    trauma_vital_df = vital_future.result()
+    trauma_fio2 = fio2_future.result()
 
-    # Merge trauma patients' IDs with FiO2 and vital signs data
-    trauma_fio2 = trauma_ids.merge(fio2_df, on='icustay_id', how='inner')
-    trauma_vital_df = trauma_ids.merge(vital_df, on='icustay_id', how='inner')
+    # Merge trauma patients' FiO2 and vital signs data
     raw_df = trauma_vital_df.merge(trauma_fio2, on=['subject_id', 'hadm_id', 'icustay_id', 'admittime', 'charttime'], how='outer')
     raw_df.rename(columns={'fio2': 'FiO2'}, inplace=True)
 
@@ -97,12 +132,12 @@ def extract_trauma_vitalsign(project_path_obj, project_id,
         print(f"Total samples after merging 2 tables: {raw_df.shape[0]} for {raw_df['hadm_id'].nunique()} trauma patients.")
 
 
-    # Prepare datetime and time variables
-    raw_df['admittime'] = pd.to_datetime(raw_df['admittime'])
-    raw_df['charttime'] = pd.to_datetime(raw_df['charttime'])
-    raw_df['Date'] = raw_df['charttime'].dt.date
-    raw_df['Day'] = (raw_df['charttime'].dt.date - raw_df['admittime'].dt.date).apply(lambda x: x.days) + 1
-    raw_df.loc[:,['Hour']] = raw_df.charttime.dt.hour
+    # Prepare datetime and time variables (see src/data/hospital_time.py); 'Date' is the calendar day (datetime.date)
+    raw_df['admittime'] = hospital_time.to_datetime64(raw_df['admittime'])
+    raw_df['charttime'] = hospital_time.to_datetime64(raw_df['charttime'])
+    raw_df['Date'] = hospital_time.to_date(raw_df['charttime'].values)
+    raw_df['Day'] = hospital_time.hospital_day(raw_df['charttime'].values, raw_df['admittime'].values)
+    raw_df['Hour'] = hospital_time.hour_of_day(raw_df['charttime'].values)
 
     return raw_df.sort_values(by=['icustay_id', 'charttime'])[
         ['subject_id', 'hadm_id', #'icustay_id',
@@ -114,6 +149,221 @@ def extract_trauma_vitalsign(project_path_obj, project_id,
 #raw_vs.head()
 
 
+## Hourly grid of the nighttime records
+#`extract_night_data` maps each record to integer coordinates (night, hour of the night) and aggregates the records into
+#a (nights × hours × features) float tensor, instead of completing, filling and averaging a DataFrame group by group.
+#Records are kept in the order the pandas implementation processed them (night hours 22:00 to 06:00, then the hours of
+#the filling window, then table order), and hourly means use the same compensated summation as `groupby().mean()`,
+#so the results are identical.
+NIGHT_HOURS = [22, 23] + [i for i in range(7)]
+NIGHT_IDS = ['subject_id', 'hadm_id', 'Date', 'Night']
+
+def night_slot(hours):
+    """
+    Position of each hour in the night (0 for 22:00, ..., 8 for 06:00), -1 for the hours outside the night.
+    """
+    slot_of_hour = np.full(24, -1)
+    slot_of_hour[NIGHT_HOURS] = np.arange(len(NIGHT_HOURS))
+    return slot_of_hour[hours]
+
+def night_record_grid(night_df, feature_columns):
+    """
+    Completes the nighttime records to an hourly grid: every night gets a record for each of its 9 hours
+    (an empty record for the hours without one).
+
+    Parameters:
+    - night_df (pd.DataFrame): Records with columns 'subject_id', 'hadm_id', 'Date', 'Night', 'Hour' and the feature columns.
+    - feature_columns (list of str): Feature columns.
+
+    Returns:
+    - tuple: (night_keys, record_night, record_hour, values, is_empty)
+      - night_keys (pd.DataFrame): 'subject_id', 'hadm_id', 'Date' and 'Night' of each night, sorted by these columns.
+      - record_night (np.array): Night of each record (row of `night_keys`).
+      - record_hour (np.array): Hour of each record.
+      - values (np.array): Feature values of each record (records × features), NaN for the empty records.
+      - is_empty (np.array): Flag of the empty records.
+      Records are sorted by night, then by hour from 22:00 to 06:00, then by the hours of the filling window
+      (07:00 to 21:00), then in table order.
+    """
+    record_night = night_df.groupby(NIGHT_IDS, sort=True).ngroup().to_numpy()
+    _, first_records = np.unique(record_night, return_index=True)
+    night_keys = night_df[NIGHT_IDS].iloc[first_records].reset_index(drop=True)
+    record_hour = night_df['Hour'].to_numpy().astype('int64')
+
+    # Position of each hour in the night (-1 for the filling window)
+    n_slots = len(NIGHT_HOURS)
+    record_slot = night_slot(record_hour)
+
+    # One empty record per night hour without records
+    is_night_hour = record_slot >= 0
+    is_recorded = np.zeros((len(night_keys), n_slots), dtype=bool)
+    is_recorded[record_night[is_night_hour], record_slot[is_night_hour]] = True
+    empty_night, empty_slot = np.nonzero(~is_recorded)
+
+    record_night = np.concatenate([record_night, empty_night])
+    record_hour = np.concatenate([record_hour, np.asarray(NIGHT_HOURS)[empty_slot]])
+    order_key = np.concatenate([np.where(is_night_hour, record_slot, n_slots + record_hour[:len(is_night_hour)]), empty_slot])
+    order = np.lexsort((order_key, record_night))
+    # Feature values written directly at their sorted positions
+    position = np.empty_like(order)
+    position[order] = np.arange(len(order))
+    values = np.empty((len(order), len(feature_columns)))
+    values[position[:len(night_df)]] = night_df[feature_columns].to_numpy(dtype='float64')
+    values[position[len(night_df):]] = np.nan
+    return night_keys, record_night[order], record_hour[order], values, order >= len(night_df)
+
+def _group_bounds(row_group):
+    # First row of each run of equal values and, for every row, the first and last row of its run
+    group_start = np.flatnonzero(np.r_[True, row_group[1:] != row_group[:-1]])
+    group_size = np.diff(np.append(group_start, len(row_group)))
+    return group_start, np.repeat(group_start, group_size), np.repeat(group_start + group_size - 1, group_size)
+
+def fill_within_groups(values, row_group, direction='forward'):
+    """
+    Forward (or backward) fills the NaN values of each column within groups of consecutive rows, by propagating the
+    index of the last (or next) row with a value: `df.groupby(row_group).ffill()` (or `bfill()`) on arrays.
+
+    Parameters:
+    - values (np.array): 2D float array (rows × columns).
+    - row_group (np.array): Group of each row; the rows of a group are consecutive.
+    - direction (str, optional): 'forward' (default) or 'backward'.
+
+    Returns:
+    - np.array: Filled copy of `values`.
+    """
+    _, first_row, last_row = _group_bounds(row_group)
+    rows = np.arange(len(values))[:, None]
+    has_value = ~np.isnan(values)
+    if direction == 'forward':
+        source = np.maximum.accumulate(np.where(has_value, rows, -1), axis=0)
+        is_filled = source >= first_row[:, None]
+    elif direction == 'backward':
+        source = np.minimum.accumulate(np.where(has_value, rows, len(values))[::-1], axis=0)[::-1]
+        is_filled = source <= last_row[:, None]
+    else:
+        raise ValueError(f"Unknown fill direction: {direction}. Expected 'forward' or 'backward'.")
+    filled = np.take_along_axis(values, np.where(is_filled, source, 0), axis=0)
+    filled[~is_filled] = np.nan
+    return filled
+
+def group_means(values, group_start):
+    """
+    Means of the non-NaN values of each column over groups of consecutive rows (NaN for a group without values).
+    Values are summed in row order with the compensated (Kahan) summation of `groupby().mean()`: one vectorized step
+    per row rank within the groups.
+
+    Parameters:
+    - values (np.array): 2D float array (rows × columns).
+    - group_start (np.array): First row of each group.
+
+    Returns:
+    - np.array: Means (groups × columns).
+    """
+    group_size = np.diff(np.append(group_start, len(values)))
+    # Groups by decreasing size: the groups with a k-th row are the first ones
+    by_size = np.argsort(-group_size, kind='stable')
+    sorted_size, sorted_start = group_size[by_size], group_start[by_size]
+    totals = np.zeros((len(group_start), values.shape[1]))
+    compensation = np.zeros_like(totals)
+    counts = np.zeros_like(totals)
+    for k in range(sorted_size[0] if len(sorted_size) else 0):
+        n_groups = np.searchsorted(-sorted_size, -k, side='left')
+        value = values[sorted_start[:n_groups] + k]
+        has_value = ~np.isnan(value)
+        total, comp = totals[:n_groups], compensation[:n_groups]
+        y = value - comp
+        t = total + y
+        new_comp = t - total - y
+        new_comp[np.isnan(new_comp)] = 0
+        totals[:n_groups] = np.where(has_value, t, total)
+        compensation[:n_groups] = np.where(has_value, new_comp, comp)
+        counts[:n_groups] += has_value
+    means = np.full_like(totals, np.nan)
+    means[by_size] = np.divide(totals, counts, out=np.full_like(totals, np.nan), where=counts > 0)
+    return means
+
+def night_tensor_frame(night_keys, night_values, feature_columns):
+    """
+    Long format of a night tensor: one row per night and hour (hours in increasing order), with the night keys,
+    'Hour', the feature columns and 'TimeIndex' (position of the hour in the night, 0 for 22:00).
+    """
+    n_nights, n_slots = night_values.shape[:2]
+    hour_order = np.argsort(NIGHT_HOURS)
+    night_df = night_keys.iloc[np.repeat(np.arange(n_nights), n_slots)].reset_index(drop=True)
+    night_df['Hour'] = np.tile(np.asarray(NIGHT_HOURS, dtype='int64')[hour_order], n_nights)
+    features = pd.DataFrame(night_values[:, hour_order].reshape(-1, len(feature_columns)), columns=feature_columns)
+    night_df = pd.concat([night_df, features], axis=1)
+    night_df['TimeIndex'] = np.tile(hour_order.astype('float64'), n_nights)
+    return night_df
+
+
+def hourly_night_tensor(night_keys, record_night, record_hour, values, is_empty, filling_method=None):
+    """
+    Aggregates the records of a night record grid (see `night_record_grid`) into a (nights × hours × features) tensor,
+    after filling missing values within each night if `filling_method` is given ('f_and_b' or 'forward', as in
+    `extract_night_data`).
+
+    Returns:
+    - tuple: (night_keys, night_values), the nights (rows of `night_keys`) and their hourly values:
+      - without filling: the nights with records in the night hours, NaN for the missing values
+        (the records of a filling window are not used, so one grid can serve both datasets);
+      - with filling: the nights without missing values after filling.
+    """
+    if filling_method is None:
+        # Night hours only, of the nights with records in them (the records of a filling window are not used)
+        is_night_hour = night_slot(record_hour) >= 0
+        has_records = np.zeros(len(night_keys), dtype=bool)
+        has_records[record_night[is_night_hour & ~is_empty]] = True
+        if not (is_night_hour.all() and has_records.all()):
+            is_kept = is_night_hour & has_records[record_night]
+            record_night = (np.cumsum(has_records) - 1)[record_night[is_kept]]
+            record_hour, values = record_hour[is_kept], values[is_kept]
+            night_keys = night_keys[has_records].reset_index(drop=True)
+
+    # Fill missing timestamps in the nighttime range
+    n_patients = night_keys.hadm_id.nunique()
+    print(f"After filling in missing timestamps: {len(values)} samples for {n_patients} trauma patients")
+
+    # Apply the filling method if specified (within each night, along the hours)
+    if filling_method is not None:
+        if filling_method == 'f_and_b':
+            # Forward fill followed by backward fill
+            values = fill_within_groups(values, record_night, 'forward')
+            values = fill_within_groups(values, record_night, 'backward')
+            print(f"After forward and backward filling: {len(values)} samples for {n_patients} trauma patients")
+
+        if filling_method == 'forward':
+            # Forward fill only
+            values = fill_within_groups(values, record_night, 'forward')
+            print(f"After forward filling: {len(values)} samples for {n_patients} trauma patients")
+
+    # Aggregate values in the same hour into one value per feature
+    hour_start, _, _ = _group_bounds(record_night * 24 + record_hour)
+    hourly_values = group_means(values, hour_start)
+    hour_night, hour_slot = record_night[hour_start], night_slot(record_hour[hour_start])
+    print(f"After aggregating one hour into one value: {len(hour_start)} samples for {n_patients} trauma patients")
+
+    # Scatter the night hours into a (nights × hours × features) tensor
+    is_night_hour = hour_slot >= 0
+    night_values = np.full((len(night_keys), len(NIGHT_HOURS), values.shape[1]), np.nan)
+    night_values[hour_night[is_night_hour], hour_slot[is_night_hour]] = hourly_values[is_night_hour]
+
+    if filling_method is not None:
+        # Drop hours with remaining NaN values
+        hour_hadm_ids = night_keys.hadm_id.to_numpy()[hour_night]
+        is_complete_hour = ~np.isnan(hourly_values).any(axis=1)
+        print(f"After dropping NaN values: {is_complete_hour.sum()} samples for {pd.unique(hour_hadm_ids[is_complete_hour]).size} trauma patients")
+        # Filter for hours between 22:00 and 06:00
+        is_complete_hour &= is_night_hour
+        print(f"After removing filling window: {is_complete_hour.sum()} samples for {pd.unique(hour_hadm_ids[is_complete_hour]).size} trauma patients")
+
+        # Keep only nights that have all 9 timestamps
+        is_complete_night = ~np.isnan(night_values).any(axis=(1, 2))
+        night_keys, night_values = night_keys[is_complete_night].reset_index(drop=True), night_values[is_complete_night]
+        print(f"After retaining complete nights: {night_values.shape[0] * len(NIGHT_HOURS)} samples for {night_keys.hadm_id.nunique()} trauma patients")
+
+    return night_keys, night_values
+
 ### 1.2 Extract and Process Nighttime Data
 #This section describes the process of aggregating and preparing nighttime data for analysis.
 #The function performs the following tasks:
@@ -155,7 +405,29 @@ def extract_night_data(df, filling_method=None, ffill_window_size=15):
   ------
   - The function assumes that the DataFrame includes a 'Day' column representing the hospital day since admission and an 'Hour' column representing the hour of the day.
   - If `filling_method` is not None, the function will fill missing values.
+  - Records are mapped to integer (night, hour) coordinates and averaged into a (nights × hours × features) tensor
+    (see `night_record_grid`, `fill_within_groups` and `group_means`); the output is identical to the former
+    group-by-group pandas implementation (`benchmarks/reference.py`).
    """
+  night_df = select_night_records(df, filling_method=filling_method, ffill_window_size=ffill_window_size)
+
+  # Fill missing timestamps, fill missing values and aggregate values in the same hour (see `hourly_night_tensor`)
+  feature_columns = list(night_df.columns.drop(NIGHT_IDS + ['Hour']))
+  night_keys, night_values = hourly_night_tensor(*night_record_grid(night_df, feature_columns), filling_method=filling_method)
+  night_AggInHour_df = night_tensor_frame(night_keys, night_values, feature_columns)
+  return night_AggInHour_df.sort_values(['hadm_id', 'Night', 'TimeIndex'])
+# # Example usage
+## Extract night-time data with missing values retained
+#data_w_null = extract_night_data(raw_vs, filling_method=None)
+## Extract night-time data with missing values filled using forward and backward filling
+#data_wo_null = extract_night_data(raw_vs, filling_method='f_and_b')
+
+def select_night_records(df, filling_method=None, ffill_window_size=15):
+  """
+  Selects the records of the nighttime hours (22:00 to 06:00), extended by the filling window before 22:00 if
+  `filling_method` is not None, and assigns them their night ('Night', the hospital day of the evening) and the date
+  of the evening ('Date'). See `extract_night_data` for the parameters.
+  """
   # Filtering for nighttime hours
   if filling_method==None:
     # Extract nighttime data without filling
@@ -164,7 +436,7 @@ def extract_night_data(df, filling_method=None, ffill_window_size=15):
 
 
     # Assign Night number and adjust dates for overnight periods
-    night_df.loc[night_df['Hour']<=6, 'Day'] = (night_df.Day - 1)
+    night_df['Day'] = hospital_time.night_index(night_df['Day'], night_df['Hour'], last_hour=6)
     night_df.rename(columns={'Day': 'Night'}, inplace=True)
     night_df.loc[night_df['Hour']<=6, 'Date'] = (night_df.Date - timedelta(days=1))
   else:
@@ -177,92 +449,74 @@ def extract_night_data(df, filling_method=None, ffill_window_size=15):
     print(f"Extracted nighttime data with filling window: {night_df.shape[0]} samples for {night_df.hadm_id.nunique()} trauma patients")
 
     # Unifying data group for overnight dates with filling windows
-    night_df.loc[night_df['Hour']<= window_e, 'Day'] = (night_df.Day - 1)
+    night_df['Day'] = hospital_time.night_index(night_df['Day'], night_df['Hour'], last_hour=window_e)
     night_df.rename(columns={'Day': 'Night'}, inplace=True)
     night_df.loc[night_df['Hour']<= window_e, 'Date'] = (night_df.Date - timedelta(days=1))
-
-  # Fill missing timestamps in the nighttime range
-  day_ids = ['subject_id', 'hadm_id','Date', 'Night']
-  hour_ids = day_ids + ['Hour']
-  night_time_list = [22, 23] + [i for i in range(7)]
-  night_hour = night_df.groupby(day_ids).apply(
-      lambda x: pd.DataFrame(night_time_list, columns=['Hour'])
-      ).reset_index(names= day_ids +['TimeIndex'])
-  full_night = night_df.merge(
-      night_hour, on=hour_ids,how='outer'
-      ).sort_values(['hadm_id', 'Night', 'TimeIndex'])
-  print(f"After filling in missing timestamps: {full_night.shape[0]} samples for {full_night.hadm_id.nunique()} trauma patients")
-
-  # Apply the filling method if specified
-  if filling_method!=None:
-    if (filling_method=='f_and_b'):
-      # Forward fill followed by backward fill
-      full_night = full_night.groupby(day_ids).apply(lambda group: group.ffill()).reset_index(drop=True)
-      full_night = full_night.groupby(day_ids).apply(lambda group: group.bfill()).reset_index(drop=True)
-      print(f"After forward and backward filling: {full_night.shape[0]} samples for {full_night.hadm_id.nunique()} trauma patients")
-
-    if (filling_method=='forward'):
-      # Forward fill only
-      full_night = full_night.groupby(day_ids).apply(lambda group: group.ffill()).reset_index(drop=True)
-      print(f"After forward filling: {full_night.shape[0]} samples for {full_night.hadm_id.nunique()} trauma patients")
-
-  # Aggregate values in the same hour into one value per feature
-  # day_ids = ['subject_id', 'hadm_id','Date', 'Night']
-  # hour_ids = day_ids + ['Hour']
-  night_AggInHour_df = full_night.groupby(hour_ids).mean().reset_index()
-  print(f"After aggregating one hour into one value: {night_AggInHour_df.shape[0]} samples for {night_AggInHour_df.hadm_id.nunique()} trauma patients")
-
-  if filling_method!=None:
-    # Drop rows with remaining NaN values
-    night_AggInHour_df.dropna(subset=night_AggInHour_df.columns, axis=0, how='any', inplace=True)
-    print(f"After dropping NaN values: {night_AggInHour_df.shape[0]} samples for {night_AggInHour_df.hadm_id.nunique()} trauma patients")
-    # Filter for rows between 22:00 and 06:00
-    night_AggInHour_df = night_AggInHour_df[(night_AggInHour_df['Hour'] >= 22) | (night_AggInHour_df['Hour'] <= 6)]
-    print(f"After removing filling window: {night_AggInHour_df.shape[0]} samples for {night_AggInHour_df.hadm_id.nunique()} trauma patients")
-
-    # Keep only nights that have all 9 timestamps
-    night_timestamp_count = night_AggInHour_df.groupby(day_ids).size().reset_index().rename({0:'num'}, axis=1)
-    full_night_timestamp = night_timestamp_count.loc[night_timestamp_count.num==9, day_ids]
-    night_AggInHour_df = night_AggInHour_df.merge(full_night_timestamp, on=day_ids)
-    print(f"After retaining complete nights: {night_AggInHour_df.shape[0]} samples for {night_AggInHour_df.hadm_id.nunique()} trauma patients")
-
-  return night_AggInHour_df.sort_values(['hadm_id', 'Night', 'TimeIndex'])
-# # Example usage
-## Extract night-time data with missing values retained
-#data_w_null = extract_night_data(raw_vs, filling_method=None)
-## Extract night-time data with missing values filled using forward and backward filling
-#data_wo_null = extract_night_data(raw_vs, filling_method='f_and_b')
+  return night_df
 
 ### 1.3 Convert to 2D Time-Series Data
 #The final step converts the records into a 2D time-series format by grouping the data by night and aggregating 1D chart records. It then filters the nights to include only those from days 2 to 14, focusing on the critical period for early sepsis detection.
-def gen_2Dnight_ti(df):
+def gen_2Dnight_ti(df, as_arrays=False):
   """
   Groups by patient and night, then aggregates the values into 2D arrays.
   Each row represents one patient on one night.
   Filters the nights to include only those from days 2 to 14
+
+  The records of a night are consecutive once sorted, so the feature columns are reshaped into one contiguous
+  (nights × timestamps × features) array; the 'Temporal Features' entries are views of its rows.
+  With `as_arrays=True`, returns the index table ('subject_id', 'hadm_id', 'Date', 'Night') and the array instead
+  (see src/data/instance_store.py).
   """
   index_columns = ['subject_id', 'hadm_id', #'icustay_id',
                    'Date', 'Night', 'Hour', 'TimeIndex']
   df = df.sort_values(index_columns)
 
   # Group by patient and night, then aggregate values into 2D arrays
-  ti = df.groupby(['subject_id', 'hadm_id','Date','Night']).apply(
-      lambda x: x.drop(columns=index_columns).values
-      ).reset_index()
-  ti.columns = ['subject_id', 'hadm_id', 'Date','Night', 'Temporal Features']
+  is_first = ~df.duplicated(NIGHT_IDS).to_numpy()
+  first_rows = np.flatnonzero(is_first)
+  night_sizes = np.diff(np.append(first_rows, len(df)))
+  values = np.ascontiguousarray(df.drop(columns=index_columns).to_numpy())
+  ti = df.loc[is_first, NIGHT_IDS].reset_index(drop=True)
+  if len(first_rows) and (night_sizes == night_sizes[0]).all():
+    values = values.reshape(len(first_rows), night_sizes[0], values.shape[1])
+  elif as_arrays:
+    raise ValueError("Nights with different numbers of timestamps cannot be stacked into one array.")
+  else:
+    values = np.split(values, first_rows[1:])
   print(f"After aggregating one night into 2D time-series, {ti.shape[0]} samples for {ti['hadm_id'].nunique()} trauma patients.")
 
-  # Filter the nights to exclude the first 1 days
-  ti_after2D = ti[(ti.Night>=2)]
-  print(f"After filtering out the first night, {ti_after2D.shape[0]} samples for {ti_after2D['hadm_id'].nunique()} trauma patients.")
-  # Filter out nights after day 14
-  ti = ti_after2D[ti_after2D.Night<=14]
-  print(f"After filtering out nights beyond day 14, {ti.shape[0]} samples for {ti['hadm_id'].nunique()} trauma patients.")
-
-  return ti
+  # Filter the nights to days 2 to 14
+  kept_rows = night_range_rows(ti)
+  if as_arrays:
+    return ti.iloc[kept_rows].reset_index(drop=True), values[kept_rows]
+  ti = instance_store.instance_frame(ti, values)
+  return ti.iloc[kept_rows]
 # night_ti = gen_2Dnight_ti(night_data)
 # night_ti.head()
 
+def night_range_rows(ti):
+    """
+    Rows of the nighttime instances `ti` (one row per night) from days 2 to 14.
+    """
+    # Filter the nights to exclude the first 1 days
+    is_kept = (ti.Night>=2).to_numpy()
+    print(f"After filtering out the first night, {is_kept.sum()} samples for {ti.loc[is_kept, 'hadm_id'].nunique()} trauma patients.")
+    # Filter out nights after day 14
+    is_kept &= (ti.Night<=14).to_numpy()
+    print(f"After filtering out nights beyond day 14, {is_kept.sum()} samples for {ti.loc[is_kept, 'hadm_id'].nunique()} trauma patients.")
+    return np.flatnonzero(is_kept)
+
+def night_tensor_instances(night_keys, night_values):
+    """
+    Nighttime instances of a night tensor (see `hourly_night_tensor`), as `gen_2Dnight_ti(..., as_arrays=True)` builds
+    them from the long format of the tensor: the index table ('subject_id', 'hadm_id', 'Date', 'Night') and the
+    (nights × timestamps × features) array, timestamps in increasing order of the hour, nights from days 2 to 14.
+    """
+    values = np.ascontiguousarray(night_values[:, np.argsort(NIGHT_HOURS)])
+    print(f"After aggregating one night into 2D time-series, {len(night_keys)} samples for {night_keys['hadm_id'].nunique()} trauma patients.")
+    kept_rows = night_range_rows(night_keys)
+    return night_keys.iloc[kept_rows].reset_index(drop=True), values[kept_rows]
+
 """
 # 2. Instance Construction
 This section involves labeling nighttime instances based on the sepsis onset data of each patient (HADM_ID). A nighttime instance is labeled 1 if **sepsis occurs within 24 hours after the nighttime instance**; otherwise, it is labeled 0. That means all nighttime instances of non-sepsis patients are assigned a negative label (0). For sepsis patients, only one nighttime instance receives a positive label (1), while the rest before the onset are labeled negative and the ones after onset are not of interest of early sepsis detection.
@@ -320,9 +574,65 @@ def assign_label2instance(ti_df, label_df):
 # mimic_data_df = assign_label2instance(data_w_null, sepsis_label_df)
 # mimic_data_df.head()
 
+def assign_label2window(window_df, label_df, horizon_hours=24):
+    """
+    Assigns labels (0/1) to observation windows (see src/data/observation_windows.py) based on sepsis onset timestamps,
+    as `assign_label2instance` does for the nighttime instances, for any prediction horizon: a window is positive if
+    sepsis onset occurs within `horizon_hours` hours after its last hour (excluding hour 0).
+
+    As in `assign_label2instance`, windows of patients without a sepsis label are not kept, and the windows of sepsis
+    patients ending more than `horizon_hours` hours before the onset are dropped. The other windows keep their order
+    and columns (e.g. 'window', their position in the strided view of the windows).
+
+    Parameters:
+    - window_df (pd.DataFrame): Windows with 'hadm_id', 'Date' and 'Hour' (calendar day and hour of their last hour).
+    - label_df (pd.DataFrame): Sepsis labels with 'hadm_id', 'is_sepsis' and 'onset_datetime'.
+    - horizon_hours (int, optional): Prediction horizon in hours (default: 24).
+
+    Returns:
+    - pd.DataFrame: The labeled windows, with a 'Label' column.
+    """
+    label_df = label_df[label_df.is_sepsis.isin([0, 1])].drop_duplicates('hadm_id').set_index('hadm_id')
+    window_df = window_df[window_df['hadm_id'].isin(label_df.index)]
+    patient_df = label_df.loc[window_df['hadm_id']]
+    is_sepsis = (patient_df['is_sepsis'] == 1).to_numpy()
+    print(f"{(~is_sepsis).sum()} Negative windows for {(label_df.is_sepsis == 0).sum()} non-sepsis patients")
+    print(f"{is_sepsis.sum()} windows for {(label_df.is_sepsis == 1).sum()} sepsis patients")
+
+    # Time from the last hour of each window to the onset
+    window_end_time = hospital_time.to_datetime64(window_df['Date']) + window_df['Hour'].to_numpy() * np.timedelta64(1, 'h')
+    time_diff = hospital_time.to_datetime64(patient_df['onset_datetime']) - window_end_time
+    horizon = np.timedelta64(horizon_hours, 'h')
+    is_positive = is_sepsis & (time_diff > np.timedelta64(0, 'h')) & (time_diff <= horizon)
+    # Drop windows further than the horizon from the onset
+    is_dropped = is_sepsis & (time_diff > horizon)
+    print(f"Dropped {is_dropped.sum()} windows more than {horizon_hours} hours before sepsis onset")
+
+    window_df = window_df[~is_dropped].assign(Label=is_positive[~is_dropped].astype('int64'))
+    print(f"Final Dataset: {(window_df.Label == 1).sum()}(1s) + {(window_df.Label == 0).sum()}(0s) = {window_df.shape[0]} (Patients={window_df['hadm_id'].nunique()})")
+    return window_df
+
 """
 # Integration and Execution Instance Construction
 """
+def submit_sepsis_labels(project_path_obj, project_id):
+    """
+    Submits the loading of the sepsis labels and onset timestamps to the query scheduler (see
+    src/data/query_scheduler.py), or their generation from the raw data if they were not saved yet.
+
+    Returns:
+    - concurrent.futures.Future: Future of the sepsis label DataFrame.
+    """
+    # More detailed explanations and applications can be found in `notebooks/Sepsis_Onset_Label_Assignment.ipynb`.
+    if project_path_obj.artifact_exists('sepsis_label'):
+        # If the file exists, load it (typed artifact)
+        return query_scheduler.get_scheduler().submit(project_path_obj.load_artifact, 'sepsis_label')
+    # If the file does not exist, generate the sepsis labels by querying the raw data
+    return query_scheduler.get_scheduler().submit(assign_sepsis_labels,
+                                                  project_path_obj,  # Pass object containing file paths
+                                                  project_id         # Provide the project ID for database access
+    )
+
 def instance_construction(project_path_obj, project_id, trum_cohort_info_df, is_fill=True, is_report=True):
     """
     Extracts and processes night-time data from the trauma cohort based on specified parameters.
@@ -344,7 +654,15 @@ def instance_construction(project_path_obj, project_id, trum_cohort_info_df, is_
     --------
     pandas.DataFrame
         A DataFrame containing processed night-time data, with missing values filled or retained as specified.
+
+    Notes:
+    ------
+    The sepsis labels do not depend on the vital signs, so they are loaded (or generated) concurrently
+    with the vital sign extraction (see src/data/query_scheduler.py).
     """
+    # Load (or generate) sepsis patient labels and corresponding onset timestamps, concurrently
+    label_future = submit_sepsis_labels(project_path_obj, project_id)
+
     # Extract raw vital sign data
     raw_vs = extract_trauma_vitalsign(project_path_obj, project_id, trum_cohort_info_df, is_report=is_report)
 
@@ -359,22 +677,108 @@ def instance_construction(project_path_obj, project_id, trum_cohort_info_df, is_
     # Generate 2D night-time instances
     night_ti = gen_2Dnight_ti(night_data)
 
-    # Load sepsis patient labels and corresponding onset timestamps
-    # More detailed explanations and applications can be found in `notebooks/Sepsis_Onset_Label_Assignment.ipynb`.
-    sepsis_label_path = project_path_obj.sepsis_label_path  # Define the path to sepsis labels
-    if os.path.exists(sepsis_label_path):
-        # If the file exists, load it from the specified path
-        sepsis_label_df = pd.read_csv(sepsis_label_path, index_col=0)
-    else:
-        # If the file does not exist, generate the sepsis labels by querying the raw data
-        sepsis_label_df = assign_sepsis_labels(project_path_obj,  # Pass object containing file paths
-                                               project_id         # Provide the project ID for database access
-        )
+    # Wait for the sepsis labels
+    sepsis_label_df = label_future.result()
 
     # Assigns labels (0/1) to nighttime instances based on sepsis onset timestamps.
     mimic_data_df = assign_label2instance(night_ti, sepsis_label_df)
     return mimic_data_df
 
+def paired_instance_construction(project_path_obj, project_id, trum_cohort_info_df, is_report=True, ffill_window_size=15):
+    """
+    Builds the nighttime instances with NaN values retained and with NaN values filled (forward and backward filling)
+    in one pass: the vital signs are extracted once and their records are mapped once onto the hourly grid of the
+    nights including the filling window (see `night_record_grid`); both tensors are derived from this grid
+    (see `hourly_night_tensor`; the unfilled one uses only the night hours). The N tensor (NaN values retained) is
+    identical to the one of `instance_construction` with `is_fill=False`. The S instances (NaN values filled) are kept
+    only for the nights that are also in N, matched on their night keys (`NIGHT_IDS`) rather than by row position as
+    the former `dataset_construction` did, so the S dataset differs from the one of earlier versions.
+
+    Parameters:
+    - project_path_obj (ProjectPaths): Object that provides access to project paths.
+    - project_id (str): Project identifier for BigQuery database access.
+    - trum_cohort_info_df (pd.DataFrame): Trauma cohort information.
+    - is_report (bool, optional): If True, generates a report. Default is True.
+    - ffill_window_size (int, optional): Number of hours before 22:00 used for forward filling. Default is 15.
+
+    Returns:
+    - tuple: (data_with_nan, data_wo_nan), the labeled instances as in `instance_construction`. The filled instances
+      are restricted to the nights (subject_id, hadm_id, Date, Night) that also have an instance with NaN values.
+    """
+    # Load (or generate) sepsis patient labels and corresponding onset timestamps, concurrently
+    label_future = submit_sepsis_labels(project_path_obj, project_id)
+
+    # Extract raw vital sign data once, then the nighttime records with the filling window
+    raw_vs = extract_trauma_vitalsign(project_path_obj, project_id, trum_cohort_info_df, is_report=is_report)
+    night_df = select_night_records(raw_vs, filling_method='f_and_b', ffill_window_size=ffill_window_size)
+    feature_columns = list(night_df.columns.drop(NIGHT_IDS + ['Hour']))
+    night_grid = night_record_grid(night_df, feature_columns)
+
+    # Derive both datasets from the same grid
+    sepsis_label_df = None
+    datasets = []
+    for name, filling_method in [('N Dataset (with NaN values)', None), ('S Dataset (without NaN values)', 'f_and_b')]:
+        print(f"\nGenerating {name}...")
+        ti, values = night_tensor_instances(*hourly_night_tensor(*night_grid, filling_method=filling_method))
+
+        # Wait for the sepsis labels
+        if sepsis_label_df is None:
+            sepsis_label_df = label_future.result()
+
+        # Assigns labels (0/1) to nighttime instances, keeping track of their rows in `values`
+        labeled_ti = assign_label2instance(ti.assign(instance=np.arange(len(ti))), sepsis_label_df)
+        datasets.append(instance_store.instance_frame(labeled_ti.drop(columns='instance'), values[labeled_ti['instance'].to_numpy()]))
+    data_with_nan, data_wo_nan = datasets
+
+    # Retain only the filled instances of the nights that are also in `data_with_nan` (to ensure consistency)
+    is_shared = pd.MultiIndex.from_frame(data_wo_nan[NIGHT_IDS]).isin(pd.MultiIndex.from_frame(data_with_nan[NIGHT_IDS]))
+    print(f"Retained {is_shared.sum()} of {len(data_wo_nan)} instances without NaN values for nights with NaN values retained")
+    return data_with_nan, data_wo_nan[is_shared]
+
+def window_instance_construction(project_path_obj, project_id, trum_cohort_info_df, lookback=9, stride=1, offset=0,
+                                 horizon_hours=24, ffill_hours=None, min_observed_hours=1, complete=False, is_report=True):
+    """
+    Builds labeled sliding observation windows of the vital signs, e.g. for hourly rolling predictions, instead of the
+    nighttime instances (see src/data/observation_windows.py): windows of `lookback` hours ending every `stride` hours,
+    labeled for a prediction horizon of `horizon_hours` hours (see `assign_label2window`).
+    With lookback=9, stride=24 and offset=6, the windows are the nights from 22:00 to 06:00 (in time order).
+
+    Parameters:
+    - project_path_obj (ProjectPaths): Object that provides access to project paths.
+    - project_id (str): Project identifier for BigQuery database access.
+    - trum_cohort_info_df (pd.DataFrame): Trauma cohort information.
+    - lookback (int, optional): Number of hours of a window (default: 9).
+    - stride (int, optional): Hours between the ends of consecutive windows (default: 1).
+    - offset (int, optional): Windows end at the hours h (since midnight of the day of admission) with
+      (h - offset) % stride == 0 (default: 0).
+    - horizon_hours (int, optional): Prediction horizon in hours (default: 24).
+    - ffill_hours (int, optional): Forward fill missing hourly values from at most this many hours before
+      (default: no filling).
+    - min_observed_hours (int, optional): Minimum number of hours of a window with at least one value (default: 1).
+    - complete (bool, optional): If True, keeps only the windows without NaN values (default: False).
+    - is_report (bool, optional): If True, generates a report. Default is True.
+
+    Returns:
+    - tuple: (window_df, windows), the labeled windows and the strided view of every window of the hourly grid
+      (windows × lookback × features); the features of the labeled windows are `windows[window_df['window']]`.
+    """
+    # Load (or generate) sepsis patient labels and corresponding onset timestamps, concurrently
+    label_future = submit_sepsis_labels(project_path_obj, project_id)
+
+    # Extract raw vital sign data, then the windows of the hourly grid of each admission
+    raw_vs = extract_trauma_vitalsign(project_path_obj, project_id, trum_cohort_info_df, is_report=is_report)
+    window_df, windows = observation_windows.observation_windows(
+        raw_vs, lookback, stride=stride, offset=offset, ffill_hours=ffill_hours,
+        min_observed_hours=min_observed_hours, complete=complete)
+    print(f"Extracted {len(window_df)} windows of {lookback} hours for {window_df.hadm_id.nunique()} trauma patients")
+
+    # Assigns labels (0/1) to the windows based on sepsis onset timestamps
+    window_df = assign_label2window(window_df, label_future.result(), horizon_hours=horizon_hours)
+    return window_df, windows
+# # Example usage: windows of the last 12 hours every hour, labeled for a 6-hour horizon
+# window_df, windows = window_instance_construction(project_path_obj, PROJECT_ID, trauma_cohort_info_df, lookback=12, horizon_hours=6, ffill_hours=4)
+# X = windows[window_df['window']]
+
 """
 # 3. Data Split
 The function ensures a fair and structured data split for evaluation, using a **5-fold stratified split** (by default):  
@@ -454,7 +858,7 @@ def stratified_patient_split(patient_df, n_splits=5, random_state=42, is_report=
 # patient_df = stratified_patient_split(patient_df, n_splits=5, random_state=42, is_saved=False)
 
 
-def dataset_construction(project_path_obj, project_id, is_report=True, is_saved=True):
+def dataset_construction(project_path_obj, project_id, is_report=True, is_saved=True, folds=None):
     """
     Constructs and saves two datasets:
     - One with NaN values retained.
@@ -466,6 +870,10 @@ def dataset_construction(project_path_obj, project_id, is_report=True, is_saved=
     - Dataset: Indicates whether this instance belongs to the training or test set.
 
     Each row represents a nighttime instance, associated with patient identifiers (`subject_id`, `hadm_id`) and a timestamp (`Night`).
+    The datasets are saved as instance sets, one shard per fold (an index table and one contiguous (instances × 9 × 9)
+    feature array each) with a manifest, see src/data/instance_store.py. Loading opens only the requested folds, with
+    memory mapping (e.g. `project_path_obj.load_dataset(project_path_obj.dataset_wo_nan_path, folds=[0])`).
+    Datasets pickled by earlier versions are converted on first load.
 
     Parameters:
     -----------
@@ -477,6 +885,8 @@ def dataset_construction(project_path_obj, project_id, is_report=True, is_saved=
         If True, generates and prints dataset statistics.
     is_saved : bool, optional (default=True)
         If True, saves the generated datasets.
+    folds : list of int, optional (default=None)
+        Folds to return (default: all). When the datasets exist, only the shards of these folds are read.
 
     Returns:
     --------
@@ -486,21 +896,21 @@ def dataset_construction(project_path_obj, project_id, is_report=True, is_saved=
     """
 
     # Check if both datasets already exist
-    if os.path.exists(project_path_obj.dataset_with_nan_path) and os.path.exists(project_path_obj.dataset_wo_nan_path):
+    if project_path_obj.dataset_exists(project_path_obj.dataset_with_nan_path) and project_path_obj.dataset_exists(project_path_obj.dataset_wo_nan_path):
         print("Both datasets already exist. Skipping dataset construction and loading existing files.")
 
-        # Load the datasets
-        data_with_nan_df = pd.read_pickle(project_path_obj.dataset_with_nan_path)
-        data_wo_nan_df = pd.read_pickle(project_path_obj.dataset_wo_nan_path)
+        # Load the requested folds of the datasets (a single fold is memory-mapped; 'Temporal Features' entries are views)
+        data_with_nan_df = instance_store.instance_frame(*project_path_obj.load_dataset(project_path_obj.dataset_with_nan_path, folds=folds))
+        data_wo_nan_df = instance_store.instance_frame(*project_path_obj.load_dataset(project_path_obj.dataset_wo_nan_path, folds=folds))
 
     else:
         print("Generating datasets...")
 
         # Load Trauma Cohort
         # Detailed explanations of the cohort extraction process can be found in `notebooks/cohort_extraction.ipynb`.
-        if os.path.exists(project_path_obj.trauma_cohort_info_path):
-            # Load the existing file
-            trauma_ids = pd.read_csv(project_path_obj.trauma_cohort_info_path, index_col=0)
+        if project_path_obj.artifact_exists('trauma_cohort_info'):
+            # Load the existing file (only the columns used below)
+            trauma_ids = project_path_obj.load_artifact('trauma_cohort_info', columns=['subject_id', 'hadm_id', 'icustay_id', 'admittime'])
         else:
             # File does not exist, extract cohort IDs and generate statistics report
             trauma_ids = extract_trauma_cohort_ids(project_path_obj, project_id, is_report=False, is_saved=True)
@@ -511,26 +921,24 @@ def dataset_construction(project_path_obj, project_id, is_report=True, is_saved=
         # Load patient fold assignment
         patient_df = pd.read_csv(project_path_obj.fold_patient_info_path, index_col=0, dtype=int)
 
-        # Generate dataset with NaN values
-        print("\nGenerating N Dataset (with NaN values)...")
-        data_with_nan = instance_construction(project_path_obj, project_id, trauma_cohort_info_df, is_fill=False, is_report=is_report)
+        # Generate the datasets with and without NaN values from one extraction of the vital signs
+        # (the instances without NaN values are aligned to the ones with NaN values by their night)
+        data_with_nan, data_wo_nan = paired_instance_construction(project_path_obj, project_id, trauma_cohort_info_df, is_report=is_report)
         # Assign fold ID
         data_with_nan_df = data_with_nan.merge(patient_df, on='subject_id', how='left')
-
-        # Generate dataset without NaN values
-        print("Generating S Dataset (without NaN values)...")
-        data_wo_nan = instance_construction(project_path_obj, project_id, trauma_cohort_info_df, is_fill=True, is_report=is_report)
-        # Retain only the instances in `data_wo_nan` that are also present in `data_with_nan` (to ensure consistency)
-        data_wo_nan = data_wo_nan[data_wo_nan.index.isin(data_with_nan.index)]
-        # Assign fold ID
         data_wo_nan_df = data_wo_nan.merge(patient_df, on='subject_id', how='left')
 
-        # Save datasets if required
+        # Save datasets if required (one shard per fold, see src/data/instance_store.py)
         if is_saved:
             print(f"Saving datasets to {project_path_obj.dataset_with_nan_path}...")
-            data_with_nan_df.to_pickle(project_path_obj.dataset_with_nan_path)
+            project_path_obj.save_dataset(project_path_obj.dataset_with_nan_path, *instance_store.instance_arrays(data_with_nan_df))
             print(f"Saving datasets to {project_path_obj.dataset_wo_nan_path}...")
-            data_wo_nan_df.to_pickle(project_path_obj.dataset_wo_nan_path)
+            project_path_obj.save_dataset(project_path_obj.dataset_wo_nan_path, *instance_store.instance_arrays(data_wo_nan_df))
+
+        # Keep the requested folds
+        if folds is not None:
+            data_with_nan_df = data_with_nan_df[data_with_nan_df.Fold.isin(folds)]
+            data_wo_nan_df = data_wo_nan_df[data_wo_nan_df.Fold.isin(folds)]
 
     # Calculate statistics per fold
     if is_report:
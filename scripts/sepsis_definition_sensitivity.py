@@ -0,0 +1,267 @@
+"""
+# Sensitivity of the Post-Traumatic Sepsis Definition
+
+The sepsis labels of `scripts/sepsis_onset_label_assignment.py` follow one set of Sepsis-3 parameters
+(Section 3.2 of our paper): a culture and an antibiotic start within 2 days of each other, a 2-point SOFA increase
+within 3 days of the culture, antibiotics given for at least 4 days (or until discharge) and not started on the
+first hospital day. This script labels the cohort under a grid of such definitions at once, to measure how the
+infection and sepsis labels and the onset times depend on each parameter.
+
+The cultures, antibiotic events and SOFA scores are sorted once; every definition is then evaluated on the shared arrays
+(prefix counts of the qualifying antibiotics over binary-searched windows, and one running-minimum scan of each SOFA window
+per window size), instead of rerunning the label pipeline per setting. With the default parameters the labels are the
+ones of `assign_sepsis_labels`.
+"""
+
+"""Importing libraries."""
+import itertools
+import numpy as np
+import pandas as pd
+
+from src.data import hospital_time
+from scripts.sepsis_onset_label_assignment import (preprocess_data, consolidate_abx_orders, patient_offsets,
+                                                   sofa_arrays, sofa_window_positions)
+
+"""
+# 1. Definition Parameters
+"""
+
+# Parameters of the definition used by the label pipeline
+DEFAULT_DEFINITION = {
+    'cx_abx_window': 2,     # max. days between a culture and an antibiotic start (`suspected_infections`)
+    'sofa_window': 3,       # days before/after the culture searched for a SOFA increase (`organ_dysfunction`)
+    'min_sofa_rise': 2,     # min. SOFA increase, in points (`first_sofa_rise`)
+    'min_abx_duration': 4,  # min. days of antibiotics, unless given until discharge (`filter_duration_criteria`)
+    'min_abx_day': 2,       # first hospital day an antibiotic event may start on (`preprocess_abx_data`)
+}
+
+def sepsis_definition_grid(**parameter_values):
+    """
+    Builds a grid of sepsis definitions: every combination of the given parameter values.
+
+    Parameters:
+    - parameter_values (int or list of int): Values of the parameters of `DEFAULT_DEFINITION`, e.g.
+      `sepsis_definition_grid(cx_abx_window=[1, 2, 3], min_sofa_rise=[2, 3])`. Parameters that are not given keep
+      their default value.
+
+    Returns:
+    - pd.DataFrame: One row per definition (index 'definition'), one column per parameter.
+    """
+    unknown = set(parameter_values) - set(DEFAULT_DEFINITION)
+    if unknown:
+        raise ValueError(f"Unknown definition parameters: {sorted(unknown)}. Expected some of {list(DEFAULT_DEFINITION)}.")
+    values = [np.atleast_1d(parameter_values.get(name, default)).tolist() for name, default in DEFAULT_DEFINITION.items()]
+    definitions = pd.DataFrame(list(itertools.product(*values)), columns=list(DEFAULT_DEFINITION))
+    definitions.index.name = 'definition'
+    return definitions
+# Example usage:
+# definitions = sepsis_definition_grid(cx_abx_window=[1, 2, 3], sofa_window=[2, 3], min_sofa_rise=[2, 3])
+
+"""
+# 2. Labels of Every Definition
+"""
+
+def abx_event_days(abx_event_df):
+    """
+    Hospital day, duration and discharge flag of consolidated antibiotic events (as `preprocess_abx_data` computes them
+    before filtering on the first-day and duration criteria).
+
+    Parameters:
+    - abx_event_df (pd.DataFrame): Antibiotic events returned by `consolidate_abx_orders`
+      (columns 'hadm_id', 'adm_date', 'disch_date', 'startdate', 'enddate').
+
+    Returns:
+    - tuple: (abx_day, duration in days, given until discharge) as NumPy arrays (abx_day and duration are NaN
+      where a date is missing).
+    """
+    abx_day = hospital_time.hospital_day(abx_event_df.startdate, abx_event_df.adm_date)
+    duration = hospital_time.days_between(abx_event_df.enddate, abx_event_df.startdate) + 1
+    until_discharge = hospital_time.to_datetime64(abx_event_df.enddate) >= hospital_time.to_datetime64(abx_event_df.disch_date)
+    return abx_day, duration, until_discharge
+
+def max_sofa_rise(sofa_values):
+    """
+    Largest increase of a SOFA score over an earlier score of the window (-inf with fewer than 2 scores):
+    `first_sofa_rise(sofa_values, min_rise)` finds a pair exactly when this is at least `min_rise`.
+    """
+    if sofa_values.size < 2:
+        return -np.inf
+    return (sofa_values[1:] - np.minimum.accumulate(sofa_values)[:-1]).max()
+
+def sepsis_label_grid(trum_cohort_info_df, cx_df, abx_event_df, sofa_df, definitions=None):
+    """
+    Assigns infection and sepsis labels, with their onset, to every patient of the cohort under each definition of a grid.
+
+    The arrays are shared by all definitions:
+    - Cultures are grouped by patient, and the antibiotic events sorted by (hadm_id, abx_day). For each culture window
+      size, the bounds of the antibiotic starts within the window are found once with a binary search; for each
+      (first day, duration) filter, a prefix count of the qualifying events gives the number of them within any window.
+    - For each SOFA window size, the largest SOFA increase within the window of every suspected infection is computed
+      with one running-minimum scan (`max_sofa_rise`), which answers every `min_sofa_rise` threshold.
+
+    As in `sepsis_onset_candidates`, the organ dysfunction criteria of the k-th suspected infection of a patient are
+    reported on the row of the patient's k-th culture (the candidate rows are joined on the position of the culture
+    among the patient's cultures), so that the default definition reproduces the labels of `assign_sepsis_labels`.
+
+    Parameters:
+    - trum_cohort_info_df (pd.DataFrame): Trauma cohort with column 'hadm_id'.
+    - cx_df (pd.DataFrame): Blood culture events with columns 'hadm_id', 'cx_datetime' and 'cx_day' (see `preprocess_data`).
+    - abx_event_df (pd.DataFrame): Antibiotic events before the first-day and duration filters (see `consolidate_abx_orders`).
+    - sofa_df (pd.DataFrame): SOFA scores with columns 'hadm_id', 'sofa_day' and 'sofa_24hours'.
+    - definitions (pd.DataFrame, optional): Definitions to evaluate, one per row (see `sepsis_definition_grid`);
+      missing parameter columns take their default value. Default is the default definition only.
+
+    Returns:
+    - pd.DataFrame: One row per (hadm_id, definition) with columns:
+      - 'is_infection': Flag indicating suspected infection.
+      - 'is_sepsis': Flag indicating sepsis.
+      - 'onset_datetime', 'onset_day': Onset of sepsis (earliest qualifying culture), NaN if no sepsis.
+      e.g. `labels.is_sepsis.unstack('definition')` gives one column of sepsis labels per definition.
+    """
+    if definitions is None:
+        definitions = sepsis_definition_grid()
+    definitions = pd.DataFrame(definitions).copy()
+    for name, default in DEFAULT_DEFINITION.items():
+        if name not in definitions:
+            definitions[name] = default
+    definitions = definitions[list(DEFAULT_DEFINITION)].astype('int64')
+
+    # Cultures grouped by patient (patients in order of first appearance, cultures in table order)
+    patient_rank, hadm_ids = pd.factorize(cx_df['hadm_id'])
+    cx_order = np.argsort(patient_rank, kind='stable')
+    cx_patient = patient_rank[cx_order]
+    cx_days = cx_df['cx_day'].to_numpy()[cx_order]
+    # Position of each culture among the cultures of its patient
+    cx_position = cx_df.groupby('hadm_id', sort=False).cumcount().to_numpy()[cx_order]
+    n_cx, n_patients = len(cx_order), len(hadm_ids)
+
+    # Antibiotic events of these patients, sorted by (hadm_id, abx_day)
+    abx_day, abx_duration, abx_until_discharge = abx_event_days(abx_event_df)
+    abx_patient = pd.Index(hadm_ids).get_indexer(abx_event_df['hadm_id'])
+    is_kept = (abx_patient >= 0) & ~np.isnan(abx_day)  # events without a start date never qualify
+    abx_patient, abx_day = abx_patient[is_kept], abx_day[is_kept].astype('int64')
+    abx_duration, abx_until_discharge = abx_duration[is_kept], abx_until_discharge[is_kept]
+    print(f"Evaluating {len(definitions)} sepsis definitions on {n_cx} cultures, {len(abx_day)} antibiotic events "
+          f"and {len(sofa_df)} SOFA scores of {n_patients} patients.")
+
+    # Encode (patient, day) as one sortable integer key; each patient gets a range of `span` days
+    max_window = int(definitions.cx_abx_window.max())
+    if n_cx > 0 and len(abx_day) > 0:
+        first_day = min(cx_days.min() - max_window, abx_day.min())
+        span = max(cx_days.max() + max_window, abx_day.max()) - first_day + 1
+    else:
+        first_day, span = 0, 1
+    abx_keys = abx_patient * span + (abx_day - first_day)
+    abx_order = np.argsort(abx_keys, kind='stable')
+    sorted_keys = abx_keys[abx_order]
+
+    # Antibiotic starts within [cx_day - window, cx_day + window] of each culture, for each window size
+    abx_windows = {}
+    for window in definitions.cx_abx_window.unique():
+        abx_windows[window] = (np.searchsorted(sorted_keys, cx_patient * span + (cx_days - window - first_day), side='left'),
+                               np.searchsorted(sorted_keys, cx_patient * span + (cx_days + window - first_day), side='right'))
+    # Running count of the qualifying antibiotic events (in sorted order), for each (first day, duration) filter
+    abx_counts = {}
+    for min_abx_day, min_abx_duration in definitions[['min_abx_day', 'min_abx_duration']].drop_duplicates().itertuples(index=False):
+        is_qualifying = (abx_day >= min_abx_day) & ((abx_duration >= min_abx_duration) | abx_until_discharge)
+        abx_counts[min_abx_day, min_abx_duration] = np.concatenate([[0], np.cumsum(is_qualifying[abx_order])])
+    # Suspected infections: cultures with at least one qualifying antibiotic start within the window
+    infection_keys = definitions[['cx_abx_window', 'min_abx_day', 'min_abx_duration']].drop_duplicates()
+    is_infection = {}
+    for window, min_abx_day, min_abx_duration in infection_keys.itertuples(index=False):
+        window_start, window_end = abx_windows[window]
+        counts = abx_counts[min_abx_day, min_abx_duration]
+        is_infection[window, min_abx_day, min_abx_duration] = counts[window_end] > counts[window_start]
+
+    # Largest SOFA increase around every culture that is a suspected infection under some definition, per window size
+    sofa_sorted_df, sofa_start, sofa_end = patient_offsets(sofa_df, hadm_ids)
+    sofa_days, sofa_values, _ = sofa_arrays(sofa_sorted_df)
+    sofa_windows = definitions.sofa_window.unique()
+    sofa_rise = {window: np.full(n_cx, -np.inf) for window in sofa_windows}
+    is_candidate = np.logical_or.reduce(list(is_infection.values())) if is_infection else np.zeros(n_cx, dtype=bool)
+    candidates = np.nonzero(is_candidate)[0]
+    candidate_start = np.searchsorted(cx_patient[candidates], np.arange(n_patients + 1))
+    for patient in np.unique(cx_patient[candidates]):
+        patient_days = sofa_days[sofa_start[patient]:sofa_end[patient]]
+        patient_values = sofa_values[sofa_start[patient]:sofa_end[patient]]
+        is_sorted = bool(np.all(patient_days[1:] >= patient_days[:-1]))
+        for cx in candidates[candidate_start[patient]:candidate_start[patient + 1]]:
+            for window in sofa_windows:
+                window_values = patient_values[sofa_window_positions(patient_days, cx_days[cx], is_sorted, window=window)]
+                if window_values.dtype != 'int64':
+                    # Only the scores within the window are converted (as in `organ_dysfunction`)
+                    window_values = pd.Series(window_values).astype('int64').to_numpy()
+                sofa_rise[window][cx] = max_sofa_rise(window_values)
+
+    # Cohort patients, sorted as in the sepsis label table; -1 for patients without cultures
+    cohort_hadm_ids = np.sort(trum_cohort_info_df['hadm_id'].unique())
+    cohort_patient = pd.Index(hadm_ids).get_indexer(cohort_hadm_ids)
+    has_cx = cohort_patient >= 0
+    cx_datetime = cx_df['cx_datetime'].iloc[cx_order].reset_index(drop=True)
+    cx_day = cx_df['cx_day'].iloc[cx_order].reset_index(drop=True)
+
+    labels = []
+    for definition, params in definitions.iterrows():
+        rows = np.nonzero(is_infection[params.cx_abx_window, params.min_abx_day, params.min_abx_duration])[0]
+        row_patient = cx_patient[rows]
+        n_infections = np.bincount(row_patient, minlength=n_patients)
+        first_infection = np.searchsorted(row_patient, np.arange(n_patients))
+        # Organ dysfunction of the k-th suspected infection of the patient, reported on the row of its k-th culture
+        # (no result for cultures at positions beyond the number of suspected infections)
+        has_result = cx_position[rows] < n_infections[row_patient]
+        source = rows[first_infection[row_patient[has_result]] + cx_position[rows][has_result]]
+        is_sepsis_row = np.zeros(len(rows), dtype=bool)
+        is_sepsis_row[has_result] = sofa_rise[params.sofa_window][source] >= params.min_sofa_rise
+
+        # Onset: earliest (in culture order) suspected infection flagged with organ dysfunction
+        sepsis_patients, first_sepsis = np.unique(row_patient[is_sepsis_row], return_index=True)
+        onset_row = np.full(n_patients, -1)
+        onset_row[sepsis_patients] = rows[is_sepsis_row][first_sepsis]
+        cohort_onset = np.where(has_cx, onset_row[cohort_patient], -1)
+
+        labels.append(pd.DataFrame({
+            'hadm_id': cohort_hadm_ids,
+            'definition': definition,
+            'is_infection': np.where(has_cx, n_infections[cohort_patient] > 0, False).astype(int),
+            'is_sepsis': (cohort_onset >= 0).astype(int),
+            'onset_datetime': cx_datetime.reindex(cohort_onset).to_numpy(),
+            'onset_day': cx_day.reindex(cohort_onset).to_numpy(dtype='float64', na_value=np.nan),
+        }))
+
+    label_grid = pd.concat(labels, ignore_index=True).sort_values(['hadm_id', 'definition'], kind='stable')
+    return label_grid.set_index(['hadm_id', 'definition'])
+# Example usage:
+# label_grid = sepsis_label_grid(trum_cohort_info_df, cx_df, abx_event_df, sofa_df, definitions)
+
+"""
+# Assign Sepsis Labels Under a Grid of Definitions
+"""
+
+def assign_sepsis_label_grid(project_path_obj, project_id, definitions=None):
+    """
+    Labels the trauma cohort under every definition of a grid (see `sepsis_label_grid`), from the preprocessed
+    feature tables of the label pipeline.
+
+    Parameters:
+    - project_path_obj (Path or str): The project path object or string representing the base path for the project files.
+    - project_id (str): The project ID used to query raw data (only needed if the feature tables were not saved yet).
+    - definitions (pd.DataFrame, optional): Definitions to evaluate (see `sepsis_definition_grid`).
+
+    Returns:
+    - pd.DataFrame: Labels and onset of every patient under every definition.
+    """
+    trum_cohort_info_df, cx_df, _, sofa_df = preprocess_data(project_path_obj, project_id)
+
+    # Antibiotic events before the first-day and duration filters (the qualifying order entries are saved by `preprocess_data`)
+    abx_df = project_path_obj.load_artifact('trauma_abx_order').drop_duplicates(['hadm_id', 'startdate', 'enddate', 'drug'])
+    abx_event_df = consolidate_abx_orders(abx_df)
+
+    label_grid = sepsis_label_grid(trum_cohort_info_df, cx_df, abx_event_df, sofa_df, definitions)
+    summary = label_grid.groupby('definition')[['is_infection', 'is_sepsis']].sum()
+    if definitions is not None:
+        summary = pd.DataFrame(definitions).join(summary)
+    print(summary.to_string())
+    return label_grid
+# Example usage:
+# definitions = sepsis_definition_grid(cx_abx_window=[1, 2, 3], min_sofa_rise=[2, 3])
+# label_grid = assign_sepsis_label_grid(project_path_obj, PROJECT_ID, definitions)
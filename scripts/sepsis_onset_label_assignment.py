@@ -27,7 +27,8 @@ import time
 from datetime import datetime
 from matplotlib import pyplot as plt
 
-from src.data import data_utils, sql2df, data_fetcher
+from src.data import data_utils, sql2df, data_fetcher, query_scheduler, artifact_store, sofa_engine, hospital_time
+from src.data.query_backend import LocalMimicBackend
 from scripts.cohort_extraction import extract_trauma_cohort_ids
 
 """# 1. Pre-processing
@@ -45,39 +46,44 @@ def extract_blood_cx_events(project_id, trum_cohort_info_df, saved_path=None):
     """
     This function extracts blood culture events for trauma patients from the MicrobiologyEvents table,
     filtering events that occur at or after 72 hospital hours since admission.
+    Only the trauma patients' admissions are queried (the hadm_id filter is applied inside the query engine).
 
     Parameters:
     project_id (str): The BigQuery project ID to query the MIMIC-III v1.4 raw data.
     trum_cohort_info_df (DataFrame): DataFrame containing the hospital admission IDs (hadm_id) of trauma patients along with their corresponding admission information.
-    saved_path (str, optional): Path to save the resulting DataFrame as a CSV file. If None, the DataFrame is not saved.
+    saved_path (str, optional): Path to save the resulting DataFrame as the 'trauma_blood_cx_events' artifact (Parquet). If None, the DataFrame is not saved.
 
     Returns:
     DataFrame: DataFrame containing the selected columns ('hadm_id', 'cx_datetime', 'cx_hour') for the blood culture events.
     """
     # Query to extract BLOOD culture events from the MicrobiologyEvents file (will missing charttime values with chartdate)
-    blood_cx_df = data_utils.run_query("""
+    hadm_ids = trum_cohort_info_df['hadm_id']
+    blood_cx_df = data_utils.run_query(f"""
         SELECT subject_id, hadm_id, COALESCE(charttime, chartdate) AS charttime
         FROM `physionet-data.mimiciii_clinical.microbiologyevents`
         WHERE spec_itemid = 70012 -- BLOOD CULTURE
         AND hadm_id IS NOT NULL
+        {data_utils.id_filter('hadm_id', 'hadm_ids', hadm_ids)}
         ORDER BY hadm_id, charttime;
-        """, project_id)
+        """, project_id, params={'hadm_ids': hadm_ids})
 
     # Merge with trauma cohort information DataFrame on 'hadm_id'
     trum_blood_cx_df = trum_cohort_info_df.merge(blood_cx_df, on='hadm_id')
 
-    # Extract date & time and calculate hours since admission for each culture event
-    trum_blood_cx_df['cx_datetime'] = pd.to_datetime(trum_blood_cx_df['charttime'])
-    trum_blood_cx_df['cx_date'] = pd.to_datetime(trum_blood_cx_df['charttime']).dt.date
-    trum_blood_cx_df['cx_hour'] = (trum_blood_cx_df['cx_datetime'] - trum_blood_cx_df['admittime']).dt.round("h") // np.timedelta64(1, 'h')
-    trum_blood_cx_df['cx_day'] = (trum_blood_cx_df['cx_date'] - trum_blood_cx_df['admittime'].dt.date).apply(lambda x: x.days) + 1
+    # Extract date & time and calculate hours since admission for each culture event (see src/data/hospital_time.py)
+    cx_datetime = hospital_time.to_datetime64(trum_blood_cx_df['charttime'])
+    admittime = hospital_time.to_datetime64(trum_blood_cx_df['admittime'])
+    trum_blood_cx_df['cx_datetime'] = cx_datetime
+    trum_blood_cx_df['cx_date'] = hospital_time.to_date(cx_datetime)
+    trum_blood_cx_df['cx_hour'] = hospital_time.hospital_hour(cx_datetime, admittime)
+    trum_blood_cx_df['cx_day'] = hospital_time.hospital_day(cx_datetime, admittime)
 
     # Filter to capture entries occurring at or after 72 hospital hours
     trum_blood_cx_df = trum_blood_cx_df[trum_blood_cx_df['cx_hour'] >= 72].sort_values(['hadm_id', 'cx_datetime']).reset_index(drop=True)
 
     # Save the result to a CSV file if requested
     if saved_path is not None:
-        trum_blood_cx_df.to_csv(saved_path)
+        artifact_store.write_artifact(trum_blood_cx_df, saved_path, 'trauma_blood_cx_events')
         print(f"Saved trauma blood culture events to {saved_path}")
 
     print(f"TOTAL {trum_blood_cx_df.shape[0]} trauma blood culture events for {trum_blood_cx_df['hadm_id'].nunique()} trauma patients")
@@ -86,7 +92,7 @@ def extract_blood_cx_events(project_id, trum_cohort_info_df, saved_path=None):
     return trum_blood_cx_df[['hadm_id', 'cx_datetime', 'cx_day']]
 # Example usage:
 # trum_blood_cx_df = extract_blood_cx_events(PROJECT_ID, trum_cohort_info_df,
-#                                           #  saved_path=project_path_obj.get_processed_data_file('trauma_blood_cx_events.csv')
+#                                           #  saved_path=project_path_obj.get_artifact_path('trauma_blood_cx_events')
 #                                            )
 # # trum_blood_cx_df
 
@@ -112,6 +118,7 @@ def select_relevant_abx_data(project_id,
           cefazolin, and optionally exclude ampicillin-sulbactam and erythromycin.
     3. Get two qualified oral antibiotics: vancomycin and linezolid.
     4. Extract antibiotics specifically for trauma cohort.
+       (The prescriptions query itself is already restricted to the trauma cohort's admissions.)
 
     Parameters:
     project_id (str): The BigQuery project ID to query the MIMIC-III v1.4 raw data.
@@ -121,7 +128,7 @@ def select_relevant_abx_data(project_id,
     DataFrame: DataFrame containing the cleaned and qualified antibiotics for trauma patients.
     """
     # 1. Extract and clean antibiotics related to post-trauma sepsis from the Prescriptions table
-    abx_df = sql2df.abx_sql2df(project_id)
+    abx_df = sql2df.abx_sql2df(project_id, hadm_ids=trum_cohort_info_df['hadm_id'])
     # Standardize drug name format
     # Convert drug names to lower case
     abx_df.drug = abx_df.drug.apply(str.lower)
@@ -183,22 +190,6 @@ def select_relevant_abx_data(project_id,
 
 ### 2. Consolidate Order Entries into Events
 #After extracting relevant antibiotics, we clean and aggregate fragmented data into coherent events by removing entries with invalid times and combining overlapping or continuous orders into single events based on gaps in administration.
-def assign_abx_seq(df):
-  """
-  This function groups antibiotic orders into sequences,
-  where each sequence represents a contiguous period of antibiotic administration,
-  The sequence ID is assigned to all orders within a single event.
-  A new event is identified based on the `newAbx` column, which marks the beginning of a new sequence.
-  """
-  newAbx_index = df[df.newAbx==1].index
-  n=newAbx_index.size
-  for seq, row_ind in enumerate(newAbx_index,1):
-    if (seq)==n:
-      df.loc[row_ind:df.index[-1],'Abx_seq'] = seq
-    else:
-      df.loc[row_ind:newAbx_index[seq], 'Abx_seq'] = seq
-    # print(seq, row_ind)
-  return df
 def consolidate_abx_orders(abx_df):
   """
   This function consolidates antibiotic order entries into distinct antibiotic events.
@@ -211,6 +202,9 @@ def consolidate_abx_orders(abx_df):
     - Identify the starting points for each antibiotic event based on gaps in administration.
       Specifically, a new event is defined when the same drug is not administered on the previous day.
     - Aggregate overlapping or continuous segmented orders into a single event.
+
+  The orders are sorted once; every step after that is a vectorized pass over the sorted table
+  (a new-event mask, its cumulative sum as event ID, and one grouped min/max).
   """
   # 1. Clean up records: time period & drug name format
   # Remove invalid records where end date is earlier than start date
@@ -219,29 +213,34 @@ def consolidate_abx_orders(abx_df):
   clean_abx_df = abx_df[~noise_data]
   print(f"Drop %d noise abx records s.t. startdate>enddate"%(before_drop_noise-clean_abx_df.shape[0]))
 
-  # 2. Assign newAbx: identify the starting points
+  # 2. Assign newAbx: identify the starting points (compared with the previous order in the sorted table)
   new_abx_df = clean_abx_df.sort_values(['hadm_id', 'drug','startdate',	'enddate'])
-  new_abx_df['newAbx'] = np.nan #init
-  new_abx_df.iloc[0,-1] = 1 # assign newAbx label for first row
-  prev_df = new_abx_df.shift(periods=1)
-  prev_df.iloc[0] = new_abx_df.iloc[0]
-  new_abx_df.loc[new_abx_df.hadm_id != prev_df.hadm_id, 'newAbx'] = 1 # new pacient
-  new_abx_df.loc[new_abx_df.drug !=prev_df.drug, 'newAbx'] = 1 # new drug
-  diff_day =(new_abx_df.startdate - prev_df.enddate).apply(lambda x: x.days)
-  new_abx_df.loc[diff_day>1, 'newAbx'] = 1 # same drug not administered on previous day
-  # Group: assigns sequence IDs to antibiotic orders based on identified new orders.
-  new_abx_df = new_abx_df.groupby('hadm_id').apply(assign_abx_seq).reset_index(drop=True)
-  # Aggregate:
-  new_abx_df = new_abx_df.groupby(['hadm_id', 'Abx_seq']).agg({
+  hadm_ids = new_abx_df.hadm_id.to_numpy()
+  drugs = new_abx_df.drug.to_numpy()
+  diff_day = hospital_time.days_between(new_abx_df.startdate.iloc[1:], new_abx_df.enddate.iloc[:-1])
+  new_abx = np.ones(new_abx_df.shape[0], dtype=bool) # the first row starts an event
+  new_abx[1:] = ((hadm_ids[1:] != hadm_ids[:-1])  # new pacient
+                 | (drugs[1:] != drugs[:-1])        # new drug
+                 | (diff_day > 1))                  # same drug not administered on previous day
+
+  # Group: event IDs are the running count of new orders (global, then numbered from 1 within each patient)
+  event_id = np.cumsum(new_abx)
+  first_orders = new_abx_df[new_abx]
+  abx_seq = first_orders.groupby('hadm_id', sort=False).cumcount().to_numpy() + 1
+  # Aggregate: keep the widest range
+  event_range = new_abx_df[['startdate', 'enddate']].groupby(event_id, sort=True).agg({'startdate': 'min', 'enddate': 'max'})
+
+  new_abx_df = pd.DataFrame({
+      'hadm_id': first_orders.hadm_id.to_numpy(),
+      'Abx_seq': abx_seq.astype(float),
       # keep the 1st records
-
-      'adm_date': lambda x: x.iloc[0],
-      'disch_date': lambda x: x.iloc[0],
-      'drug': lambda x: x.iloc[0],
+      'adm_date': first_orders.adm_date.to_numpy(),
+      'disch_date': first_orders.disch_date.to_numpy(),
+      'drug': first_orders.drug.to_numpy(),
       # keep the widest range
-      'startdate': "min",
-      'enddate': "max",
-  }).reset_index()
+      'startdate': event_range.startdate.to_numpy(),
+      'enddate': event_range.enddate.to_numpy(),
+  })
 
   return new_abx_df
 
@@ -266,10 +265,11 @@ def filter_duration_criteria(new_abx_df):
   pd.DataFrame: DataFrame with antibiotic events that meet the duration criteria.
   """
   # Calculate the duration of each antibiotic event in days
-  diff_day = (new_abx_df.enddate - new_abx_df.startdate).apply(lambda x: x.days) + 1
+  diff_day = hospital_time.days_between(new_abx_df.enddate, new_abx_df.startdate) + 1
   # Check each drug event for duration criteria
   new_abx_df.loc[diff_day >= 4, 'duration_criteria'] = 1 # At least 4 days
-  new_abx_df.loc[new_abx_df.enddate >= new_abx_df.disch_date, 'duration_criteria'] = 1 # Until discharge
+  until_discharge = hospital_time.to_datetime64(new_abx_df.enddate) >= hospital_time.to_datetime64(new_abx_df.disch_date)
+  new_abx_df.loc[until_discharge, 'duration_criteria'] = 1 # Until discharge
   # Only include antibiotic events that fit the duration criteria
   new_abx_df = new_abx_df[new_abx_df.duration_criteria ==1]
   return new_abx_df
@@ -292,17 +292,17 @@ def preprocess_abx_data(project_path_obj,
   * administered for at least four consecutive days, or until death or discharge, whichever occurs first.
   """
   # 1.Extract/Load qualify antibiotics order entries for truama cohort
-  abx_path = project_path_obj.trauma_abxOrder_path
-  if os.path.exists(abx_path):
-      abx_df = pd.read_csv(abx_path, index_col=0)
+  if project_path_obj.artifact_exists('trauma_abx_order'):
+      # typed artifact: dates are loaded as dates, no parsing needed
+      abx_df = project_path_obj.load_artifact('trauma_abx_order')
   else:
       abx_df = select_relevant_abx_data(project_id, trum_cohort_info_df)
-      abx_df.to_csv(abx_path)
-  # extract timestemp for order entries
-  abx_df['startdate'] =  pd.to_datetime(abx_df['startdate']).dt.date
-  abx_df['enddate'] =  pd.to_datetime(abx_df['enddate']).dt.date
-  abx_df['adm_date'] = pd.to_datetime(abx_df['adm_date']).dt.date
-  abx_df['disch_date'] = pd.to_datetime(abx_df['disch_date']).dt.date
+      # extract timestemp for order entries
+      abx_df['startdate'] =  pd.to_datetime(abx_df['startdate']).dt.date
+      abx_df['enddate'] =  pd.to_datetime(abx_df['enddate']).dt.date
+      abx_df['adm_date'] = pd.to_datetime(abx_df['adm_date']).dt.date
+      abx_df['disch_date'] = pd.to_datetime(abx_df['disch_date']).dt.date
+      project_path_obj.save_artifact('trauma_abx_order', abx_df)
   abx_df = abx_df.drop_duplicates(['hadm_id', 'startdate', 'enddate', 'drug'])
   num_qualifying_antibiotic = abx_df.shape[0]
   print("#of qualifying antibiotic order entries: ", num_qualifying_antibiotic)
@@ -313,7 +313,7 @@ def preprocess_abx_data(project_path_obj,
 
   # 3.Exclude abx started on the 1st hosipital day
   # Compute anti_day=i: the ith hosipital day that take this antibiotics
-  new_abx_df['abx_day'] = (new_abx_df.startdate - new_abx_df.adm_date).apply(lambda x: x.days) + 1
+  new_abx_df['abx_day'] = hospital_time.hospital_day(new_abx_df.startdate, new_abx_df.adm_date)
   # fillter
   new_abx_df = new_abx_df[new_abx_df.abx_day > 1]
   new_abx_df['abx_day'] = new_abx_df.abx_day.astype(int)
@@ -328,9 +328,8 @@ def preprocess_abx_data(project_path_obj,
   new_abx_df.index += 1
 
   # save
-  newAbx_path = project_path_obj.trauma_abxEvent_path
+  newAbx_path = project_path_obj.save_artifact('trauma_abx_event', new_abx_df)
   print(f"Saved clean, well-organized, and qualified antibiotic events to {newAbx_path}")
-  new_abx_df.to_csv(newAbx_path)
   return new_abx_df
 # Example usage:
 # new_abx_df = preprocess_abx_data(project_path_obj, PROJECT_ID, trum_cohort_info_df)
@@ -340,19 +339,24 @@ def preprocess_abx_data(project_path_obj,
 - Calculate a modified SOFA score, excluding GCS and Urine Output (UO), to define sepsis onset.
 - Generate an hourly row for all trauma cohort patients in the ICU for continuous assessment.
 """
-def calculate_sofa_score(project_path_obj, project_id, trum_cohort_info_df, saved_path=None):
+def calculate_sofa_score(project_path_obj, project_id, trum_cohort_info_df, saved_path=None, engine=None):
     """
     Calculate the modified SOFA (Sequential Organ Failure Assessment) score for trauma patients in the ICU.
 
     This function computes a modified SOFA score for every hour of the ICU stay for trauma patients,
     excluding the Glasgow Comma Scale (GCS) and Urine Output (UO) from the standard score calculation.
+    If the SOFA table of all MIMIC-III patients ('sofa_score.csv') is not available, the query is restricted
+    to the trauma cohort's admissions, which avoids computing hourly scores for every ICU stay.
 
     Parameters:
     - project_id (str): The project ID used to query ICU data.
     - trum_cohort_info_df (DataFrame): DataFrame containing trauma patient information with columns:
         - 'hadm_id': Hospital admission ID
         - 'admittime': Admission time
-    - saved_path (str, optional): Path to save the resulting SOFA score DataFrame as a CSV file. If None, the DataFrame is not saved.
+    - saved_path (str, optional): Path to save the resulting SOFA score DataFrame as the 'trauma_sofa_score' artifact (Parquet). If None, the DataFrame is not saved.
+    - engine (str, optional): 'sql' runs the SOFA query (`sql2df.SOFA_calculate`) in the query engine,
+        'local' computes the same table with the vectorized engine (`sofa_engine.SOFA_calculate_local`).
+        Defaults to 'local' when the query backend is a local copy of MIMIC-III (LocalMimicBackend), 'sql' otherwise.
 
     Returns:
     - DataFrame: The DataFrame containing modified SOFA scores
@@ -362,29 +366,97 @@ def calculate_sofa_score(project_path_obj, project_id, trum_cohort_info_df, save
     if os.path.exists(sofa_path):
       sofa_score_df = pd.read_csv(sofa_path, index_col=0)
     else:
-      sofa_score_df = sql2df.SOFA_calculate(project_id, saved_path=None)[['hadm_id', 'icustay_id', 'hr', 'starttime', 'endtime', 'sofa_24hours']]
-      sofa_score_df.to_csv(sofa_path)
+      if engine is None:
+        engine = 'local' if isinstance(data_utils.get_query_backend(), LocalMimicBackend) else 'sql'
+      SOFA_calculate = sofa_engine.SOFA_calculate_local if engine == 'local' else sql2df.SOFA_calculate
+      # Cohort-scoped result: not saved as 'sofa_score.csv' (which holds all MIMIC-III patients)
+      sofa_score_df = SOFA_calculate(project_id, saved_path=None,
+                                     hadm_ids=trum_cohort_info_df['hadm_id'])[SOFA_COLUMNS]
 
-    # Merge SOFA score DataFrame with trauma cohort information
-    trum_sofa_df = sofa_score_df.merge(trum_cohort_info_df[['hadm_id', 'adm_date']], on='hadm_id')
+    # Merge SOFA score DataFrame with trauma cohort information & calculate sofa_day
+    trum_sofa_df = add_sofa_day(sofa_score_df, trum_cohort_info_df)
 
     # Print the total number of SOFA samples and unique hospital admissions
     print(f"Total {trum_sofa_df.shape[0]} SOFA samples for {trum_sofa_df.hadm_id.nunique()} trauma patients.")
 
-    # Calculate sofa_day
-    trum_sofa_df['sofa_date'] = pd.to_datetime(trum_sofa_df['starttime']).dt.date
-    # trum_sofa_df['adm_date'] = pd.to_datetime(trum_sofa_df['admittime']).dt.date
-    trum_sofa_df['sofa_day'] = (trum_sofa_df['sofa_date'] - trum_sofa_df['adm_date']).apply(lambda x: x.days) + 1
-
     # Save the DataFrame if a path is provided
     if saved_path is not None:
         print(f"Saved SOFA score for trauma patients to {saved_path}.")
-        trum_sofa_df.to_csv(saved_path)
+        artifact_store.write_artifact(trum_sofa_df, saved_path, 'trauma_sofa_score')
+        # Last hour computed for each ICU stay, used by `update_sofa_score`
+        project_path_obj.save_artifact('trauma_sofa_watermark', sofa_engine.sofa_watermarks(trum_sofa_df))
 
     return trum_sofa_df
 # Example usage:
 # sofa_df = calculate_sofa_score(project_path_obj, PROJECT_ID, trum_cohort_info_df, saved_path=None)
 
+SOFA_COLUMNS = ['hadm_id', 'icustay_id', 'hr', 'starttime', 'endtime', 'sofa_24hours']
+
+def add_sofa_day(sofa_score_df, trum_cohort_info_df):
+    """
+    Merges the SOFA scores with the trauma cohort information and calculates sofa_day (the hospital day of each score).
+    """
+    # Merge SOFA score DataFrame with trauma cohort information
+    trum_sofa_df = sofa_score_df.merge(trum_cohort_info_df[['hadm_id', 'adm_date']], on='hadm_id')
+    # Calculate sofa_day (see src/data/hospital_time.py)
+    starttime = hospital_time.to_datetime64(trum_sofa_df['starttime'])
+    trum_sofa_df['sofa_date'] = hospital_time.to_date(starttime)
+    trum_sofa_df['sofa_day'] = hospital_time.hospital_day(starttime, trum_sofa_df['adm_date'])
+    return trum_sofa_df
+
+def update_sofa_score(project_path_obj, project_id, trum_cohort_info_df, updated_hadm_ids, engine=None):
+    """
+    Incrementally updates the stored trauma SOFA table (the 'trauma_sofa_score' artifact) when new data
+    (e.g. newly appended ICU hours) arrived for a few hospital admissions, instead of recomputing the whole cohort.
+
+    A watermark, the last hour computed, is stored for every ICU stay ('trauma_sofa_watermark' artifact).
+    For the ICU stays of the updated admissions only the hours from (watermark - 24h) onward are recomputed,
+    because `sofa_24hours` is a 24-hour trailing window. The local engine reads the input tables of these ICU stays
+    from watermark - 48h onward only, to complete these windows (see `sofa_engine.load_sofa_tables`); the SQL engine
+    recomputes the updated admissions in full and keeps the same hours. New ICU stays are computed entirely.
+    The recomputed rows replace the stored ones and the watermarks are advanced.
+
+    Parameters:
+    - project_path_obj (object): An object that provides paths for saving and loading files.
+    - project_id (str): The project ID used to query ICU data.
+    - trum_cohort_info_df (DataFrame): DataFrame containing trauma patient information with columns 'hadm_id' and 'adm_date'.
+    - updated_hadm_ids (list-like): Hospital admissions with new data.
+    - engine (str, optional): 'sql' or 'local', see `calculate_sofa_score`.
+
+    Returns:
+    - DataFrame: The updated SOFA table of the trauma cohort.
+    """
+    sofa_df = project_path_obj.load_artifact('trauma_sofa_score')
+    if project_path_obj.artifact_exists('trauma_sofa_watermark'):
+        watermarks = project_path_obj.load_artifact('trauma_sofa_watermark')
+    else:
+        watermarks = sofa_engine.sofa_watermarks(sofa_df)
+
+    # ICU stays to update and their first hour to recompute
+    updated_hadm_ids = data_utils.normalize_query_params({'hadm_ids': updated_hadm_ids})['hadm_ids']
+    updated_cohort_df = trum_cohort_info_df[trum_cohort_info_df['hadm_id'].isin(updated_hadm_ids)]
+    from_hours = sofa_engine.recompute_from_hours(watermarks, sofa_df.loc[sofa_df['hadm_id'].isin(updated_hadm_ids), 'icustay_id'])
+
+    # Recompute the updated hours
+    if engine is None:
+        engine = 'local' if isinstance(data_utils.get_query_backend(), LocalMimicBackend) else 'sql'
+    if engine == 'local':
+        update_df = sofa_engine.SOFA_calculate_local(project_id, hadm_ids=updated_hadm_ids, from_hours=from_hours)
+    else:
+        update_df = sql2df.SOFA_calculate(project_id, hadm_ids=updated_hadm_ids)
+        first_hr = update_df['icustay_id'].map(from_hours)
+        update_df = update_df[first_hr.isna() | (update_df['hr'] >= first_hr)]
+    update_df = add_sofa_day(update_df[SOFA_COLUMNS], updated_cohort_df)
+    print(f"Recomputed {update_df.shape[0]} SOFA samples for {update_df.hadm_id.nunique()} updated trauma patients.")
+
+    # Merge into the stored table & advance the watermarks
+    sofa_df = sofa_engine.merge_sofa_update(sofa_df, update_df, from_hours)
+    print(f"Saved SOFA score for trauma patients to {project_path_obj.save_artifact('trauma_sofa_score', sofa_df)}.")
+    project_path_obj.save_artifact('trauma_sofa_watermark', sofa_engine.sofa_watermarks(sofa_df))
+    return sofa_df
+# Example usage:
+# sofa_df = update_sofa_score(project_path_obj, PROJECT_ID, trum_cohort_info_df, updated_hadm_ids=[100001, 100002])
+
 """
 ## Integration and Execution Preprocess Table
 Preprocess data from four primary tables:
@@ -413,14 +485,16 @@ def preprocess_data(project_path_obj, project_id):
             - **Prophylaxis**: Antibiotics used exclusively for surgical prophylaxis are excluded.
             - **Duration**: The antibiotic must be administered for at least four consecutive days, or until death or discharge, whichever occurs first.
     - sofa_df (DataFrame): DataFrame containing modified SOFA scores for every hour of the ICU stay.
+
+    The blood culture, antibiotic and SOFA extractions are independent once the cohort is known,
+    so the missing ones are submitted concurrently (see src/data/query_scheduler.py).
     """
     # Load or extract trauma cohort information
     # (Detailed explanations of the cohort extraction process and other relevant details can be found in 'notebooks/Cohort_Extraction.ipynb'.)
     print("--------------Trauma Cohort Information--------------")
-    trauma_cohort_info_path = project_path_obj.trauma_cohort_info_path
-    if os.path.exists(trauma_cohort_info_path):
+    if project_path_obj.artifact_exists('trauma_cohort_info'):
         print("Loading trauma cohort information...")
-        trum_ids = pd.read_csv(trauma_cohort_info_path, index_col=0)
+        trum_ids = project_path_obj.load_artifact('trauma_cohort_info')
         print(f"Loaded {trum_ids.hadm_id.nunique()} trauma patients.\n")
 
     else:
@@ -441,19 +515,29 @@ def preprocess_data(project_path_obj, project_id):
     trum_cohort_info_df['adm_date'] = trum_cohort_info_df['admittime'].dt.date
     trum_cohort_info_df['disch_date'] = pd.to_datetime(trum_cohort_info_df['dischtime']).dt.date
 
+    # Submit the missing (independent) extractions up front, so they run concurrently
+    scheduler = query_scheduler.get_scheduler()
+    cx_path = project_path_obj.get_artifact_path('trauma_blood_cx_events')
+    sofa_path = project_path_obj.get_artifact_path('trauma_sofa_score')
+    start_time = time.time()
+    cx_future = None if project_path_obj.artifact_exists('trauma_blood_cx_events') else \
+        scheduler.submit(extract_blood_cx_events, project_id, trum_cohort_info_df, saved_path=cx_path)
+    abx_future = None if project_path_obj.artifact_exists('trauma_abx_event') else \
+        scheduler.submit(preprocess_abx_data, project_path_obj, project_id, trum_cohort_info_df)
+    sofa_future = None if project_path_obj.artifact_exists('trauma_sofa_score') else \
+        scheduler.submit(calculate_sofa_score, project_path_obj, project_id, trum_cohort_info_df, saved_path=sofa_path)
+
     # Load or extract blood culture events
     print("--------------Blood Culture Events-------------------")
-    cx_path = project_path_obj.get_processed_data_file('trauma_blood_cx_events.csv')
-    if os.path.exists(cx_path):
+    if cx_future is None:
         print("Loading blood culture events...")
-        cx_df = pd.read_csv(cx_path, index_col=0)
+        cx_df = project_path_obj.load_artifact('trauma_blood_cx_events', columns=['hadm_id', 'cx_datetime', 'cx_day'])
         num_records = cx_df.shape[0]
         num_patients = cx_df['hadm_id'].nunique()
         print(f"Loaded {num_records} records for {num_patients} unique patients.")
     else:
         print("Extracting blood culture events...")
-        start_time = time.time()
-        cx_df = extract_blood_cx_events(project_id, trum_cohort_info_df, saved_path=cx_path)
+        cx_df = cx_future.result()
         end_time = time.time()
         print(f"Extraction completed in {end_time - start_time:.2f} seconds.")
     # Extract relevant features & drop duplicates
@@ -462,17 +546,15 @@ def preprocess_data(project_path_obj, project_id):
 
     # Load or extract antibiotic events
     print("--------------Antibiotic Events----------------------")
-    abx_path = project_path_obj.trauma_abxEvent_path
-    if os.path.exists(abx_path):
+    if abx_future is None:
         print("Loading antibiotic events...")
-        abx_df = pd.read_csv(abx_path, index_col=0)
+        abx_df = project_path_obj.load_artifact('trauma_abx_event', columns=['hadm_id', 'startdate', 'abx_day'])
         num_records = abx_df.shape[0]
         num_patients = abx_df['hadm_id'].nunique()
         print(f"Loaded {num_records} records for {num_patients} unique patients.")
     else:
         print("Extracting antibiotic events...")
-        start_time = time.time()
-        abx_df = preprocess_abx_data(project_path_obj, project_id, trum_cohort_info_df)
+        abx_df = abx_future.result()
         end_time = time.time()
         print(f"Extraction completed in {end_time - start_time:.2f} seconds.")
     # Extract relevant features & drop duplicates
@@ -481,17 +563,15 @@ def preprocess_data(project_path_obj, project_id):
 
     # Load or calculate SOFA scores
     print("--------------SOFA Scores----------------------------")
-    sofa_path = project_path_obj.get_processed_data_file('trauma_sofa_score.csv')
-    if os.path.exists(sofa_path):
+    if sofa_future is None:
         print("Loading SOFA scores...")
-        sofa_df = pd.read_csv(sofa_path, index_col=0)
+        sofa_df = project_path_obj.load_artifact('trauma_sofa_score')
         num_records = sofa_df.shape[0]
         num_patients = sofa_df['hadm_id'].nunique()
         print(f"Loaded {num_records} records for {num_patients} unique patients.")
     else:
         print("Calculating SOFA scores...")
-        start_time = time.time()
-        sofa_df = calculate_sofa_score(project_path_obj, project_id, trum_cohort_info_df, saved_path=sofa_path)
+        sofa_df = sofa_future.result()
         end_time = time.time()
         print(f"Calculation completed in {end_time - start_time:.2f} seconds.")
     # Extract relevant features & drop duplicates
@@ -514,9 +594,14 @@ def suspected_infections(cx_df, abx_df):
     """
     Identifies suspected infections by locating body tissue cultures that have been ordered within a 5-day window of antibiotic initiation.
 
+    Works on one patient or on the whole cohort at once: cultures and antibiotic events are matched with a range join
+    on (hadm_id, day) instead of a per-patient culture x antibiotic difference matrix. The antibiotic events are sorted
+    by (hadm_id, abx_day), the events within [cx_day - 2, cx_day + 2] of each culture are located with a binary search,
+    and the first of them in table order (i.e. the one the per-patient version picked) is kept.
+
     Parameters:
-    - cx_df (pd.DataFrame): DataFrame containing culture information for one patient with columns 'hadm_id', 'cx_datetime', and 'cx_day'.
-    - abx_df (pd.DataFrame): DataFrame containing antibiotic initiation information for one patient with columns 'hadm_id' 'abx_date' and 'abx_day'.
+    - cx_df (pd.DataFrame): DataFrame containing culture information with columns 'hadm_id', 'cx_datetime', and 'cx_day'.
+    - abx_df (pd.DataFrame): DataFrame containing antibiotic initiation information with columns 'hadm_id' and 'abx_day'.
 
     Returns:
     - pd.DataFrame: A DataFrame with information about suspected infections including:
@@ -524,47 +609,152 @@ def suspected_infections(cx_df, abx_df):
       - 'onset_datetime': Timestamp of the suspected infections.
       - 'onset_day': Day of the suspected infections.
       - 'cx_index': Index of the culture that meet suspected infection criteria.
-      - 'cx_datetime': Datetime of the qualifying culture.
-      - 'cx_day': Day of the qualifying culture.
       - 'abx_index': Index of the earliest antibiotic that meet suspected infection criteria.
-      - 'abx_date': Date of the earliest qualifying antibiotic.
-      - 'abx_day': Day of the earliest qualifying antibiotic.
       - 'is_infection': Flag indicating if meets the infection criteria.
+      Rows are grouped by patient (in order of first appearance in `cx_df`) and follow the culture order within a patient.
+      The index is the position of the culture among the cultures of its patient.
     """
-    # Extract day from DataFrames
-    cx_dates = cx_df.cx_day.values
-    abx_dates = abx_df.abx_day.values
+    cx_hadm_ids = cx_df['hadm_id'].to_numpy()
+    cx_days = cx_df['cx_day'].to_numpy()
+    abx_hadm_ids = abx_df['hadm_id'].to_numpy()
+    abx_days = abx_df['abx_day'].to_numpy()
+    is_infection = np.zeros(len(cx_df), dtype=bool)
+    first_abx = np.zeros(0, dtype='int64')
+
+    if len(cx_df) > 0 and len(abx_df) > 0:
+        # Encode (hadm_id, day) as one sortable integer key; each patient gets a range of `span` days
+        patient_codes, _ = pd.factorize(np.concatenate([cx_hadm_ids, abx_hadm_ids]))
+        cx_codes, abx_codes = patient_codes[:len(cx_df)], patient_codes[len(cx_df):]
+        first_day = min(cx_days.min() - 2, abx_days.min())
+        span = max(cx_days.max() + 2, abx_days.max()) - first_day + 1
+        abx_keys = abx_codes * span + (abx_days - first_day)
+
+        # Sort antibiotic events by (hadm_id, abx_day) and find the ones within the 5-day window [-2, 2] of each culture
+        order = np.argsort(abx_keys, kind='stable')
+        sorted_keys = abx_keys[order]
+        window_start = np.searchsorted(sorted_keys, cx_codes * span + (cx_days - 2 - first_day), side='left')
+        window_end = np.searchsorted(sorted_keys, cx_codes * span + (cx_days + 2 - first_day), side='right')
+        is_infection = window_end > window_start
+
+        # Only Keep the earliest qualifying antibiotic (first in table order) for each culture:
+        # minimum table position over each window [start, end), via a reduction over the interleaved bounds
+        if is_infection.any():
+            bounds = np.stack([window_start[is_infection], window_end[is_infection]], axis=1).ravel()
+            first_abx = np.minimum.reduceat(np.append(order, 0), bounds)[::2]
+
+    # Position of each culture among the cultures of its patient, and patients in order of first appearance
+    cx_position = cx_df.groupby('hadm_id', sort=False).cumcount().to_numpy()
+    patient_rank, _ = pd.factorize(cx_hadm_ids)
+    rows = np.nonzero(is_infection)[0]
+    row_order = np.argsort(patient_rank[rows], kind='stable')
+    rows, first_abx = rows[row_order], first_abx[row_order]
 
-    # Compute pairwise differences between culture days and antibiotic days
-    differences = np.abs(np.subtract.outer(cx_dates, abx_dates))  # Shape (#of cx, #of abx)
+    # Use culture timestamp as suspected onset time
+    candidate_df = pd.DataFrame({
+        'hadm_id': cx_df['hadm_id'].values[rows],
+        'onset_datetime': cx_df['cx_datetime'].values[rows],
+        'onset_day': cx_df['cx_day'].values[rows],
+        'cx_index': cx_df.index.values[rows],
+        'abx_index': abx_df.index.values[first_abx],
+    }, index=pd.Index(cx_position[rows]))
+    candidate_df['is_infection'] = 1
+    return candidate_df
 
-    # Determine which antibiotics fall within the 5-day window [-2, 2] of each culture
-    in_5_day_window = np.where(differences <= 2, 1, 0)
+def first_sofa_rise(sofa_values, min_rise=2):
+    """
+    Finds the first pair of SOFA scores (in time order) where the later score exceeds an earlier one by at least `min_rise` points.
 
-    # Create a DataFrame to store results
-    candidate_df = cx_df.reset_index().rename({'index':"cx_index"},axis=1)[['hadm_id', 'cx_index', 'cx_datetime','cx_day']].copy()
-    candidate_df['num_abx'] = np.sum(in_5_day_window, axis=1)  # Number of qualifying antibiotics
-    candidate_df['abx_index_li'] = [abx_df.index.values[np.nonzero(in_5_day_window[i])[0]] for i in range(candidate_df.shape[0])]  # Save indices of qualifying antibiotics
-    # candidate_df['abx_index_li'] = candidate_df['abx_index_li'].apply(lambda x: x[x != 0])  # Drop indices where criteria not met
+    The pair is the one the pairwise difference matrix `np.tril(np.subtract.outer(v, v), -1) >= min_rise` yields first in
+    row-major order: the earliest later score `i` with `v[i] - min(v[:i]) >= min_rise` (running minimum), and the earliest
+    earlier score `j < i` with `v[j] <= v[i] - min_rise`. O(k) instead of O(k^2) for a window of k scores.
 
-    # Filter cultures that meet the suspected infection criteria
-    candidate_df = candidate_df[candidate_df['num_abx'] > 0]
-    candidate_df['is_infection'] = 1
+    Parameters:
+    - sofa_values (np.array): SOFA scores (int64) in time order.
+    - min_rise (int, optional): Minimum increase (default: 2 points).
+
+    Returns:
+    - tuple or None: (earlier position, later position) in `sofa_values`, None if no increase of `min_rise` points.
+    """
+    if sofa_values.size < 2:
+        return None
+    running_min = np.minimum.accumulate(sofa_values)
+    is_rise = (sofa_values[1:] - running_min[:-1]) >= min_rise
+    if not is_rise.any():
+        return None
+    later = int(np.argmax(is_rise)) + 1
+    earlier = int(np.argmax(sofa_values[:later] <= sofa_values[later] - min_rise))
+    return earlier, later
+
+def sofa_window_positions(sofa_days, day, is_sorted, window=3):
+    """
+    Positions of the SOFA scores recorded within `window` days of `day` (both ends included).
+    If `sofa_days` is sorted, the window is a slice whose bounds come from `np.searchsorted`;
+    otherwise the matching positions are selected with a mask (same rows, same order).
+    """
+    if is_sorted:
+        return slice(np.searchsorted(sofa_days, day - window, side='left'),
+                     np.searchsorted(sofa_days, day + window, side='right'))
+    return np.nonzero((sofa_days >= day - window) & (sofa_days <= day + window))[0]
 
-    # Only Keep the earliest qualifying antibiotic info for each culture
-    candidate_df['abx_index'] = candidate_df.abx_index_li.apply(lambda x: x[0])
-    candidate_df['abx_date'] = candidate_df.abx_index_li.apply(lambda x: abx_df.loc[x[0],'startdate'])
-    candidate_df['abx_day'] = candidate_df.abx_index_li.apply(lambda x: abx_df.loc[x[0],'abx_day'])
+def sofa_arrays(sofa):
+    """
+    Columns of a SOFA table read by the organ dysfunction search, as NumPy arrays (e.g. to be sliced or memory-mapped).
+
+    Returns:
+    - tuple: (sofa_day, sofa_24hours, index labels). 'sofa_24hours' is int64, or float64 (NaN for missing scores)
+      if the column is not int64; the index labels are float64 when the original implementation returned them as floats.
+    """
+    sofa_days = sofa['sofa_day'].to_numpy()
+    sofa_values = sofa['sofa_24hours']
+    if sofa_values.dtype == 'int64':
+        sofa_values = sofa_values.to_numpy()
+    else:
+        sofa_values = sofa_values.to_numpy(dtype='float64', na_value=np.nan)
+    sofa_index = sofa.index.to_numpy()
+    if len(sofa) > 0:
+        # The original implementation read the indices from a row of the window table (`.iloc[i].sofa_index`),
+        # which holds floats when every column of the table is numeric with at least one float column
+        row_df = sofa.iloc[:1].reset_index()
+        row_df['sofa_24hours'] = np.zeros(1, dtype='int64')
+        if row_df.iloc[0].dtype.kind == 'f':
+            sofa_index = sofa_index.astype('float64')
+    return sofa_days, sofa_values, sofa_index
+
+def organ_dysfunction_arrays(days, sofa_days, sofa_values, sofa_index):
+    """
+    Evaluates `organ_dysfunction` for several days of the same patient, from the arrays returned by `sofa_arrays`.
+
+    Returns:
+    - np.array: One row per day, with the three elements returned by `organ_dysfunction`
+      (int64 if every day shows an increase, float64 otherwise, as with `np.stack` of the `organ_dysfunction` results).
+    """
+    is_sorted = bool(np.all(sofa_days[1:] >= sofa_days[:-1]))
+    is_int64 = sofa_values.dtype == 'int64'
+
+    results = []
+    for day in days:
+        positions = sofa_window_positions(sofa_days, day, is_sorted)
+        if is_int64:
+            window_values = sofa_values[positions]
+        else:
+            # Only the scores within the window are converted (as in the original implementation)
+            window_values = pd.Series(sofa_values[positions]).astype('int64').to_numpy()
+        pair = first_sofa_rise(window_values)
+        if pair is None:
+            # SOFA score increased less than 2 points
+            results.append(np.array([0, np.nan, np.nan]))
+        else:
+            # Only return the first pair where the increase is observed
+            window_index = sofa_index[positions]
+            results.append(np.array([1, window_index[pair[0]], window_index[pair[1]]]))
+    return np.stack(results)
+
+def organ_dysfunction_days(days, sofa):
+    """
+    Evaluates `organ_dysfunction` for several days of the same patient, reading the patient's SOFA columns only once.
+    """
+    return organ_dysfunction_arrays(days, *sofa_arrays(sofa))
 
-    # Use culture timestamp as suspected onset time
-    candidate_df['onset_datetime'] = candidate_df['cx_datetime']
-    candidate_df['onset_day'] = candidate_df['cx_day']
-
-    return candidate_df[['hadm_id', 'onset_datetime', 'onset_day',
-                         'cx_index', #'cx_datetime', 'cx_day',
-                         'abx_index',#'abx_date', 'abx_day',
-                         'is_infection']]
-                        
 def organ_dysfunction(day, sofa):
     """
     Pinpoints organ dysfunction by examining changes in the modified version of the SOFA score.
@@ -582,30 +772,11 @@ def organ_dysfunction(day, sofa):
 
     Notes:
     - The function checks for SOFA score increases only within the specified 7-day window.
-    - If multiple increases are found, only the first pair is returned.
-    """
-    # Filter SOFA scores within the 7-day window around the specified day
-    sofa_7day_window_df = sofa[sofa.sofa_day.between(day - 3, day + 3, inclusive='both')].reset_index().rename({'index': 'sofa_index'}, axis=1)
-    if sofa_7day_window_df['sofa_24hours'].dtype != 'int64':
-        sofa_7day_window_df['sofa_24hours'] = sofa_7day_window_df['sofa_24hours'].astype('int64')
-    sofa_7day_window_values = sofa_7day_window_df.sofa_24hours.values
-
-    # Compute pairwise differences between SOFA scores
-    diff = np.subtract.outer(sofa_7day_window_values, sofa_7day_window_values)
-    increase = np.tril(diff, -1)  # only keep the Si-Sj, s.t i>j
-    later_time, earlier_time = (increase > 1).nonzero()
-
-    if later_time.size == 0:
-        # SOFA score increased less than 2 points
-        is_sofa_inc_at_least_2 = 0
-        later_index, earlier_index = np.nan, np.nan
-    else:
-        is_sofa_inc_at_least_2 = 1
-        # Only return the first pair where the increase is observed
-        later_index = sofa_7day_window_df.iloc[later_time[0]].sofa_index
-        earlier_index = sofa_7day_window_df.iloc[earlier_time[0]].sofa_index
-
-    return np.array([is_sofa_inc_at_least_2, earlier_index, later_index])
+    - If multiple increases are found, only the first pair is returned (see `first_sofa_rise`).
+    - The window bounds are found with a binary search on 'sofa_day' (sorted in time order for each ICU stay),
+      and the increase with a running minimum, in time linear in the size of the window.
+    """
+    return organ_dysfunction_days([day], sofa)[0]
 
 """
 ## Sepsis Onset Candidates
@@ -617,7 +788,109 @@ Onset timestamp candidates meet the following criteria:
 The returned table provides detailed information on sepsis onset candidates, including the patient ID (`hadm_id`) and the sepsis flag with its corresponding onset timestamp (`onset_datetime`, `onset_day`) if sepsis is identified. It also includes the infection flag (`is_infection`) and its associated indices for culture (`cx_index`) and antibiotic events (`abx_index`) that contributed to identifying the infection. Additionally, the sepsis flag, which indicates organ dysfunction, is accompanied by two indices of the SOFA score events (`sofa_index_1` and `sofa_index_2`) used to locate the organ dysfunction.
 """
 
-def sepsis_onset_candidates(cx_df, abx_df, sofa_df, save_path=None):
+def patient_offsets(df, hadm_ids):
+    """
+    Builds a CSR-style index of the rows of each patient, so that a patient's rows are a slice instead of a scan
+    of the whole table (`df[df.hadm_id == hadm_id]` for every patient is O(patients x rows)).
+
+    Parameters:
+    - df (pd.DataFrame): DataFrame with a 'hadm_id' column.
+    - hadm_ids (array-like): Patients to index.
+
+    Returns:
+    - tuple: (sorted_df, start, end), where `sorted_df` is `df` sorted by 'hadm_id' (stable sort: the rows of a patient
+      keep their original order and index) and `sorted_df.iloc[start[i]:end[i]]` are the rows of patient `hadm_ids[i]`
+      (an empty slice if the patient has no rows).
+    """
+    # The preprocessed tables are usually sorted by patient already: no copy is needed then
+    sorted_df = df if df['hadm_id'].is_monotonic_increasing else df.sort_values('hadm_id', kind='stable')
+    sorted_hadm_ids = sorted_df['hadm_id'].values
+    start = np.searchsorted(sorted_hadm_ids, hadm_ids, side='left')
+    end = np.searchsorted(sorted_hadm_ids, hadm_ids, side='right')
+    return sorted_df, start, end
+
+def patient_candidates(infection_df, infection_start, infection_end, sofa_days, sofa_values, sofa_index, sofa_start, sofa_end):
+    """
+    Adds the organ dysfunction criteria to the suspected infections of a range of patients.
+
+    Parameters:
+    - infection_df (pd.DataFrame): Suspected infections (see `suspected_infections`), grouped by patient.
+    - infection_start, infection_end (np.array): Offsets of each patient's rows in `infection_df`.
+    - sofa_days, sofa_values, sofa_index (np.array): SOFA columns (see `sofa_arrays`), grouped by patient.
+    - sofa_start, sofa_end (np.array): Offsets of each patient's rows in the SOFA columns.
+
+    Returns:
+    - pd.DataFrame: Candidate rows of these patients (see `sepsis_onset_candidates`).
+    """
+    aggregate_patient_candidates = []
+
+    for i in range(len(infection_start)):
+        # Get patient-specific information (slices of the sorted tables, same rows and order as filtering on hadm_id)
+        candidate_df = infection_df.iloc[infection_start[i]:infection_end[i]]
+        patient_sofa = slice(sofa_start[i], sofa_end[i])
+
+        # Pinpoint instances of organ dysfunction (the patient is infected)
+        # isSepsis=1: if the patient is both infected and has organ dysfunction
+        candidate_df = pd.concat([candidate_df,
+                      pd.DataFrame(
+                          organ_dysfunction_arrays(candidate_df.onset_day.values,
+                                                   sofa_days[patient_sofa], sofa_values[patient_sofa], sofa_index[patient_sofa]),
+                          columns=['is_sepsis', 'sofa_index_1', 'sofa_index_2']
+                          )], axis=1)
+        aggregate_patient_candidates.append(candidate_df)  # Accumulate table even if not meeting the organ dysfunction criteria
+
+    # Combine all candidate DataFrames
+    return pd.concat(aggregate_patient_candidates, ignore_index=True)
+
+_SOFA_ARRAY_NAMES = ['sofa_day', 'sofa_24hours', 'sofa_index']
+CANDIDATE_COLUMNS = ['hadm_id', 'onset_datetime', 'onset_day', 'cx_index', 'abx_index', 'is_infection',
+                     'is_sepsis', 'sofa_index_1', 'sofa_index_2']
+
+def _patient_candidates_shard(infection_df, infection_start, infection_end, sofa_dir, sofa_start, sofa_end):
+    # Runs in a worker process: the SOFA columns are memory-mapped from `sofa_dir` (only the pages of this shard's
+    # patients are read; nothing is copied or pickled), the shard's suspected infections are passed in
+    sofa_columns = [np.load(os.path.join(sofa_dir, f'{name}.npy'), mmap_mode='r') for name in _SOFA_ARRAY_NAMES]
+    return patient_candidates(infection_df, infection_start, infection_end, *sofa_columns, sofa_start, sofa_end)
+
+def sharded_patient_candidates(infection_df, infection_start, infection_end, sofa_columns, sofa_start, sofa_end,
+                               n_workers, shards_per_worker=4):
+    """
+    Runs `patient_candidates` over shards of patients in a process pool.
+
+    The SOFA columns are written once as .npy files to a temporary folder and memory-mapped by the workers;
+    each shard (a contiguous range of patients) only receives its own suspected infections and offsets.
+    The shard results are concatenated in shard order, so the result does not depend on the number of workers.
+
+    Parameters:
+    - n_workers (int): Number of worker processes.
+    - shards_per_worker (int, optional): Shards per worker (smaller shards balance the load between workers).
+    - Other parameters: see `patient_candidates` (`sofa_columns` are the arrays returned by `sofa_arrays`).
+
+    Returns:
+    - pd.DataFrame: Same table as `patient_candidates` on all the patients.
+    """
+    import multiprocessing
+    import tempfile
+    from concurrent.futures import ProcessPoolExecutor
+
+    n_shards = min(len(infection_start), n_workers * shards_per_worker)
+    shards = np.array_split(np.arange(len(infection_start)), n_shards)
+    with tempfile.TemporaryDirectory(prefix='sofa_shards_') as sofa_dir:
+        for name, column in zip(_SOFA_ARRAY_NAMES, sofa_columns):
+            np.save(os.path.join(sofa_dir, f'{name}.npy'), column)
+        # Spawned (not forked) workers: the query scheduler's threads may be running in the parent process
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = []
+            for patients in shards:
+                first_row, last_row = infection_start[patients[0]], infection_end[patients[-1]]
+                futures.append(executor.submit(_patient_candidates_shard,
+                                               infection_df.iloc[first_row:last_row],
+                                               infection_start[patients] - first_row, infection_end[patients] - first_row,
+                                               sofa_dir, sofa_start[patients], sofa_end[patients]))
+            shard_candidates = [future.result() for future in futures]
+    return pd.concat(shard_candidates, ignore_index=True)
+
+def sepsis_onset_candidates(cx_df, abx_df, sofa_df, save_path=None, n_workers=1):
     """
     Aggregates sepsis onset candidate information by analyzing culture, antibiotic, and SOFA score data for each patient.
     - Identifies suspected infections.
@@ -627,6 +900,8 @@ def sepsis_onset_candidates(cx_df, abx_df, sofa_df, save_path=None):
     - cx_df (pd.DataFrame): DataFrame containing culture information.
     - abx_df (pd.DataFrame): DataFrame containing antibiotic information.
     - sofa_df (pd.DataFrame): DataFrame containing SOFA score information.
+    - n_workers (int, optional): Number of processes checking the organ dysfunction criteria of patient shards
+      (see `sharded_patient_candidates`). Default is 1 (no process pool); the result does not depend on it.
 
     Returns:
     - pd.DataFrame: Aggregated DataFrame containing sepsis onset candidate information.
@@ -642,40 +917,28 @@ def sepsis_onset_candidates(cx_df, abx_df, sofa_df, save_path=None):
       - 'sofa_index_2': Index of the later SOFA score event.
       This comprehensive table summarizes key data points needed to identify sepsis candidates.
     """
-    aggregate_patient_candidates = []
-
-    # Iterate through all patients with qualifying culture events
-    for hadm_id in cx_df.hadm_id.unique():
-        # Get patient-specific information
-        cx = cx_df[cx_df.hadm_id == hadm_id]
-        abx = abx_df[abx_df.hadm_id == hadm_id]
-        sofa = sofa_df[sofa_df.hadm_id == hadm_id]
-
-        # Identify suspected infections
-        candidate_df = suspected_infections(cx, abx)
-
-        # Pinpoint instances of organ dysfunction if the patient is infected
-        if candidate_df.shape[0] != 0:
-            # isSepsis=1: if the patient is both infected and has organ dysfunction
-            candidate_df = pd.concat([candidate_df,
-                          pd.DataFrame(
-                              np.stack(candidate_df.onset_day.apply(lambda x: organ_dysfunction(x, sofa))),
-                              columns=['is_sepsis', 'sofa_index_1', 'sofa_index_2']
-                              )], axis=1)
-            aggregate_patient_candidates.append(candidate_df)  # Accumulate table even if not meeting the organ dysfunction criteria
-
-        # # Display debug information
-        # print("Patient:", hadm_id)
-        # display('cx_date', cx)
-        # display('abx_date', abx)
-        # index_li = np.unique(candidate_df[['sofa_index_1', 'sofa_index_2']].values.flatten())
-        # index_li = index_li[~np.isnan(index_li)]
-        # print("index_li:", index_li)
-        # display('sofa', sofa.loc[index_li, :])
-        # display('candidate', candidate_df)
-
-    # Combine all candidate DataFrames
-    aggregate_patient_candidates_df = pd.concat(aggregate_patient_candidates, ignore_index=True)
+    # Identify suspected infections of the whole cohort at once (rows grouped by patient)
+    infection_df = suspected_infections(cx_df, abx_df)
+    if infection_df.empty:
+        # No suspected infection (e.g. when only a few admissions are updated, see `update_sepsis_labels`)
+        return infection_df.reindex(columns=CANDIDATE_COLUMNS).reset_index(drop=True)
+
+    # Sort the SOFA table once by patient, with the offsets of every patient's rows (see `patient_offsets`)
+    hadm_ids = infection_df.hadm_id.unique()
+    sofa_sorted_df, sofa_start, sofa_end = patient_offsets(sofa_df, hadm_ids)
+    sofa_columns = sofa_arrays(sofa_sorted_df)
+    # Offsets of each patient's suspected infections
+    infection_start = np.searchsorted(pd.Index(hadm_ids).get_indexer(infection_df.hadm_id), np.arange(len(hadm_ids)))
+    infection_end = np.append(infection_start[1:], len(infection_df))
+
+    # Pinpoint instances of organ dysfunction for all patients with suspected infections
+    # (object columns, e.g. non-numeric index labels, cannot be memory-mapped: such tables are processed in this process)
+    if n_workers > 1 and len(hadm_ids) > 1 and all(column.dtype != object for column in sofa_columns):
+        aggregate_patient_candidates_df = sharded_patient_candidates(
+            infection_df, infection_start, infection_end, sofa_columns, sofa_start, sofa_end, n_workers)
+    else:
+        aggregate_patient_candidates_df = patient_candidates(
+            infection_df, infection_start, infection_end, *sofa_columns, sofa_start, sofa_end)
 
     if save_path is not None:
         aggregate_patient_candidates_df.to_csv(save_path)
@@ -742,7 +1005,7 @@ def generate_sepsis_label_info(trum_cohort_info_df, candidates_df, is_report=Fal
 This section serves as the core of the project, integrating and executing the functions defined in previous sections. It will first load or generate the four preprocessed feature tables: cohort info, antibiotics (abx), cultures (cx), and SOFA scores. These tables are then used to identify patients who meet the sepsis criteria. If a patient meets the infection criteria, then the infection and sepsis flags, along with indices linking to the feature tables supporting these flags, will be treated as sepsis candidate information and saved in a candidate table. This candidate table, together with the trauma cohort, will be used to generate the sepsis label. The final label table will have one row per patient. If a patient has a positive sepsis flag, the table will also include indices linking to the feature tables to pinpoint the sepsis event. Note that a single patient may have multiple candidates that meet the sepsis criteria; however, we will only retain the earliest timestamp.
 """
 
-def assign_sepsis_labels(project_path_obj, project_id):
+def assign_sepsis_labels(project_path_obj, project_id, n_workers=1):
     """
     Assigns sepsis labels to each patient in the cohort by executing the full data processing and analysis pipeline.
     This function integrates and runs all steps from data preprocessing to generating sepsis labels.
@@ -750,6 +1013,8 @@ def assign_sepsis_labels(project_path_obj, project_id):
     Parameters:
     - project_path_obj (Path or str): The project path object or string representing the base path for the project files.
     - PROJECT_ID (str): The project ID for accessing BigQuery or other project-specific resources.
+    - n_workers (int, optional): Number of processes used to evaluate the sepsis onset candidates
+      (patient shards, see `sepsis_onset_candidates`). Default is 1.
 
     Returns:
     - pd.DataFrame: A DataFrame containing sepsis label information including infection and sepsis flags, as well as sepsis onset details.
@@ -764,15 +1029,144 @@ def assign_sepsis_labels(project_path_obj, project_id):
     print("\n╔══════════════════════════════════╗")
     print("║      Assigning Sepsis Labels     ║")
     print("╚══════════════════════════════════╝")
-    candidates_df = sepsis_onset_candidates(cx_df, abx_df, sofa_df)
+    candidates_df = sepsis_onset_candidates(cx_df, abx_df, sofa_df, n_workers=n_workers)
 
     # Generate sepsis label information
     sepsis_label_df = generate_sepsis_label_info(trum_cohort_info_df, candidates_df, is_report=True)
 
     # Saved
     print(f"Saving sepsis label information at {project_path_obj.sepsis_label_path}")
-    sepsis_label_df.to_csv(project_path_obj.sepsis_label_path)
+    project_path_obj.save_artifact('sepsis_label', sepsis_label_df)
+    # Candidates and input digests, so that later updates only recompute the changed admissions (see `update_sepsis_labels`)
+    project_path_obj.save_artifact('sepsis_candidates', candidate_table(candidates_df))
+    project_path_obj.save_artifact('sepsis_label_inputs', label_input_digests(trum_cohort_info_df, cx_df, abx_df, sofa_df))
 
     return sepsis_label_df
 # Example usage:
 # sepsis_label_df = assign_sepsis_labels(project_path_obj, PROJECT_ID)
+
+"""
+# Update Sepsis Labels
+When admissions join the cohort, or cultures, antibiotics or SOFA scores of some admissions arrive late (once the feature tables are updated, e.g. by `update_sofa_score`), only the candidates of the admissions whose inputs changed are recomputed. Every label assignment saves a digest of each admission's inputs; the next update compares them with the current inputs, recomputes the candidates and labels of the changed admissions with the same criteria (`sepsis_onset_candidates` and `generate_sepsis_label_info`), and upserts them into the stored candidate and label tables.
+
+The candidate and label tables refer to rows of the feature tables by index. When rows are inserted for an admission, the indices of the following admissions may move (e.g. the antibiotic events are re-indexed after sorting): the indices of an unchanged admission are shifted by the move of its first row.
+"""
+
+# Columns of the feature tables read by `sepsis_onset_candidates`, and the candidate columns holding their indices
+LABEL_INPUT_COLUMNS = {'cx': ['cx_datetime', 'cx_day'], 'abx': ['abx_day'], 'sofa': ['sofa_day', 'sofa_24hours']}
+CANDIDATE_INDEX_COLUMNS = {'cx_index': 'cx', 'abx_index': 'abx', 'sofa_index_1': 'sofa', 'sofa_index_2': 'sofa'}
+
+def candidate_table(candidates_df):
+    """
+    Stored form of the sepsis onset candidates: the rows of each admission, sorted by 'hadm_id'.
+    Rows without an admission (organ dysfunction results that `sepsis_onset_candidates` could not join to a culture)
+    are left out; `generate_sepsis_label_info` ignores them.
+    """
+    candidates_df = candidates_df.dropna(subset=['hadm_id'])[CANDIDATE_COLUMNS]
+    return candidates_df.sort_values('hadm_id', kind='stable').reset_index(drop=True)
+
+def label_input_digests(trum_cohort_info_df, cx_df, abx_df, sofa_df):
+    """
+    Fingerprints the label inputs of each admission (of the cohort or of the feature tables). For each feature table:
+    - '<table>_digest': hash of the admission's rows (the columns read by `sepsis_onset_candidates`, the row order, and the
+      index labels relative to the admission's first row).
+    - '<table>_first_index': index label of the admission's first row.
+    Admissions with the same digests have the same candidates, up to a shift of the indices by the move of the first row.
+
+    Returns:
+    - pd.DataFrame: One row per admission ('hadm_id'); digests and first indices are missing for the tables without rows
+      of the admission.
+    """
+    digests = []
+    for table, df in zip(['cx', 'abx', 'sofa'], [cx_df, abx_df, sofa_df]):
+        hadm_ids = df['hadm_id'].to_numpy()
+        index = df.index.to_numpy()
+        first_index = pd.Series(index).groupby(hadm_ids).transform('first').to_numpy()
+        rows = df[LABEL_INPUT_COLUMNS[table]].reset_index(drop=True)
+        rows['position'] = df.groupby('hadm_id', sort=False).cumcount().to_numpy()
+        rows['relative_index'] = index - first_index
+        # Sum of the row hashes (wrapping around); the row position makes it depend on the row order
+        row_digests = pd.util.hash_pandas_object(rows, index=False).to_numpy().view('int64')
+        grouped = pd.DataFrame({'digest': row_digests, 'first_index': index}).groupby(hadm_ids)
+        digests.append(pd.DataFrame({f'{table}_digest': grouped['digest'].sum(),
+                                     f'{table}_first_index': grouped['first_index'].first()}).astype('Int64'))
+    hadm_ids = np.unique(np.concatenate([trum_cohort_info_df['hadm_id'].unique(), cx_df['hadm_id'].unique(),
+                                         abx_df['hadm_id'].unique(), sofa_df['hadm_id'].unique()]))
+    digest_df = pd.concat(digests, axis=1).reindex(hadm_ids)
+    digest_df.index.name = 'hadm_id'
+    return digest_df.reset_index()
+
+def update_sepsis_labels(project_path_obj, project_id, n_workers=1):
+    """
+    Updates the stored sepsis labels for the admissions whose inputs changed since the last label assignment
+    (new admissions of the cohort, new or updated cultures, antibiotic events or SOFA scores).
+    Without stored candidates and input digests (e.g. labels assigned by an earlier version), all the labels are assigned.
+
+    Parameters:
+    - project_path_obj (Path or str): The project path object or string representing the base path for the project files.
+    - project_id (str): The project ID for accessing BigQuery or other project-specific resources.
+    - n_workers (int, optional): Number of processes used to evaluate the sepsis onset candidates (see `sepsis_onset_candidates`).
+
+    Returns:
+    - pd.DataFrame: The updated sepsis label table, as returned by `assign_sepsis_labels` on the same inputs.
+    """
+    if not all(project_path_obj.artifact_exists(name) for name in ['sepsis_label', 'sepsis_candidates', 'sepsis_label_inputs']):
+        print("No stored sepsis candidates and input digests: assigning all the labels.")
+        return assign_sepsis_labels(project_path_obj, project_id, n_workers=n_workers)
+
+    trum_cohort_info_df, cx_df, abx_df, sofa_df = preprocess_data(project_path_obj, project_id)
+
+    # Compare the input digests with the ones of the last label assignment
+    digest_df = label_input_digests(trum_cohort_info_df, cx_df, abx_df, sofa_df)
+    current = digest_df.set_index('hadm_id')
+    previous = project_path_obj.load_artifact('sepsis_label_inputs').set_index('hadm_id')
+    is_new = ~current.index.isin(previous.index)
+    previous = previous.reindex(current.index)
+    is_changed = is_new.copy()
+    for column in ['cx_digest', 'abx_digest', 'sofa_digest']:
+        is_same = (current[column] == previous[column]).fillna(False) | (current[column].isna() & previous[column].isna())
+        is_changed |= ~is_same.to_numpy()
+    # Move of the first row of each unchanged admission in each table
+    shifts = pd.DataFrame({table: (current[f'{table}_first_index'] - previous[f'{table}_first_index']).fillna(0)
+                           for table in ['cx', 'abx', 'sofa']}, index=current.index)
+    is_shifted = ~is_changed & (shifts != 0).any(axis=1).to_numpy()
+    changed_ids, affected_ids = current.index[is_changed], current.index[is_changed | is_shifted]
+
+    print("\n╔══════════════════════════════════╗")
+    print("║      Updating Sepsis Labels      ║")
+    print("╚══════════════════════════════════╝")
+    print(f"{is_changed.sum()} admissions with changed inputs ({is_new.sum()} new), "
+          f"{is_shifted.sum()} with moved feature table indices, out of {len(current)}.")
+
+    # Candidates: recompute the changed admissions, shift the indices of the moved ones
+    candidates_df = project_path_obj.load_artifact('sepsis_candidates')
+    candidates_df = candidates_df[candidates_df.hadm_id.isin(current.index) & ~candidates_df.hadm_id.isin(changed_ids)].copy()
+    for column, table in CANDIDATE_INDEX_COLUMNS.items():
+        candidates_df[column] = candidates_df[column] + candidates_df.hadm_id.map(shifts[table]).astype('int64')
+    changed_candidates_df = sepsis_onset_candidates(cx_df[cx_df.hadm_id.isin(changed_ids)],
+                                                    abx_df[abx_df.hadm_id.isin(changed_ids)],
+                                                    sofa_df[sofa_df.hadm_id.isin(changed_ids)], n_workers=n_workers)
+    candidates_df = candidate_table(pd.concat([candidates_df, artifact_store.apply_schema(
+        candidate_table(changed_candidates_df), 'sepsis_candidates')], ignore_index=True))
+
+    # Labels: regenerate the rows of the changed and moved admissions
+    sepsis_label_df = project_path_obj.load_artifact('sepsis_label')
+    is_kept = sepsis_label_df.hadm_id.isin(trum_cohort_info_df.hadm_id) & ~sepsis_label_df.hadm_id.isin(affected_ids)
+    sepsis_label_df = sepsis_label_df[is_kept]
+    affected_label_df = generate_sepsis_label_info(trum_cohort_info_df[trum_cohort_info_df.hadm_id.isin(affected_ids)],
+                                                   candidates_df[candidates_df.hadm_id.isin(affected_ids)])
+    sepsis_label_df = pd.concat([sepsis_label_df, artifact_store.apply_schema(affected_label_df, 'sepsis_label')])
+    sepsis_label_df = sepsis_label_df.sort_values('hadm_id').reset_index(drop=True)
+    print(f"Number of infections: {sepsis_label_df.is_infection.sum()}")
+    print(f"Number of sepsis cases: {sepsis_label_df.is_sepsis.sum()}")
+
+    # Saved
+    print(f"Saving sepsis label information at {project_path_obj.sepsis_label_path}")
+    project_path_obj.save_artifact('sepsis_label', sepsis_label_df)
+    project_path_obj.save_artifact('sepsis_candidates', candidates_df)
+    project_path_obj.save_artifact('sepsis_label_inputs', digest_df)
+
+    return sepsis_label_df
+# Example usage:
+# sofa_df = update_sofa_score(project_path_obj, PROJECT_ID, trum_cohort_info_df, updated_hadm_ids=[100001, 100002])
+# sepsis_label_df = update_sepsis_labels(project_path_obj, PROJECT_ID)
@@ -0,0 +1,175 @@
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+
+###################################
+# Typed artifact layer used by `ProjectPaths`
+###################################
+# Intermediate tables (cohort, antibiotics, SOFA, labels, vital signs, ...) are stored as Parquet files
+# with a fixed schema per artifact: IDs are integers, timestamps are datetime64, calendar days are dates
+# and low-cardinality text columns are categoricals. Loading an artifact therefore needs no parsing
+# (no `pd.to_datetime` on every load) and can read only the requested columns.
+#
+# Column types:
+#   'int64'     integer (stored as nullable 'Int64' if the column has missing values)
+#   'Int64'     nullable integer
+#   'float64'   float
+#   'bool'      boolean
+#   'datetime'  timestamp (datetime64)
+#   'date'      calendar day (Parquet date32, loaded as `datetime.date` objects)
+#   'category'  categorical text
+#   'str'       free text (kept as Python strings)
+# Columns not listed in a schema are stored with their pandas dtype.
+# Artifacts flagged 'streamed' cover every ICU stay of MIMIC-III; they are written and read in chunks
+# and their row index is not stored.
+# Artifacts restricted to a cohort are saved under a key of the cohort's IDs (`<name>_<key>.parquet`, see `cohort_key`),
+# so a different cohort never reads another cohort's rows.
+
+_ID = 'int64'
+_DEMOGRAPHICS = {
+    'subject_id': _ID, 'hadm_id': _ID, 'icustay_id': _ID,
+    'gender': 'category', 'dod': 'datetime',
+    'admittime': 'datetime', 'dischtime': 'datetime',
+    'los_hospital_days': 'int64', 'los_hospital_hours': 'int64', 'admission_age': 'int64',
+    'ethnicity': 'category', 'ethnicity_grouped': 'category',
+    'hospital_expire_flag': 'int64', 'hospstay_seq': 'int64', 'first_hosp_stay': 'bool',
+    'intime': 'datetime', 'outtime': 'datetime',
+    'los_icu_days': 'Int64', 'los_icu_hours': 'Int64', 'icustay_seq': 'int64', 'first_icu_stay': 'bool',
+}
+
+ARTIFACT_SCHEMAS = {
+    # raw folder: all MIMIC-III patients
+    'demographics': {'folder': 'raw', 'columns': _DEMOGRAPHICS},
+    'pivoted_vital': {'folder': 'raw', 'streamed': True, 'columns': {
+        'icustay_id': _ID, 'charttime': 'datetime',
+        'HeartRate': 'float64', 'SysBP': 'float64', 'DiasBP': 'float64', 'MeanBP': 'float64',
+        'RespRate': 'float64', 'TempC': 'float64', 'SpO2': 'float64', 'Glucose': 'float64'}},
+    'pivoted_fio2': {'folder': 'raw', 'streamed': True, 'columns': {
+        'icustay_id': _ID, 'charttime': 'datetime', 'fio2': 'float64'}},
+    # processed folder: the rows of the pivoted tables for the ICU stays of one cohort (saved with a `cohort_key`)
+    'trauma_pivoted_vital': {'folder': 'processed', 'streamed': True, 'columns': {
+        'icustay_id': _ID, 'charttime': 'datetime',
+        'HeartRate': 'float64', 'SysBP': 'float64', 'DiasBP': 'float64', 'MeanBP': 'float64',
+        'RespRate': 'float64', 'TempC': 'float64', 'SpO2': 'float64', 'Glucose': 'float64'}},
+    'trauma_pivoted_fio2': {'folder': 'processed', 'streamed': True, 'columns': {
+        'icustay_id': _ID, 'charttime': 'datetime', 'fio2': 'float64'}},
+    # processed folder
+    'MVday': {'folder': 'processed', 'columns': {'hadm_id': _ID, 'date_count': 'int64'}},
+    'trauma_cohort_info': {'folder': 'processed', 'columns': {**_DEMOGRAPHICS, 'date_count': 'Int64'}},
+    'trauma_blood_cx_events': {'folder': 'processed', 'columns': {
+        'hadm_id': _ID, 'subject_id': _ID,
+        'admittime': 'datetime', 'dischtime': 'datetime', 'hospital_expire_flag': 'int64',
+        'adm_date': 'date', 'disch_date': 'date',
+        'charttime': 'datetime', 'cx_datetime': 'datetime', 'cx_date': 'date',
+        'cx_hour': 'int64', 'cx_day': 'int64'}},
+    'trauma_abx_order': {'folder': 'processed', 'columns': {
+        'hadm_id': _ID, 'adm_date': 'date', 'disch_date': 'date',
+        'startdate': 'date', 'enddate': 'date',
+        'gsn': 'str', 'drug': 'str', 'drug_name_generic': 'category', 'route': 'category'}},
+    'trauma_abx_event': {'folder': 'processed', 'columns': {
+        'hadm_id': _ID, 'Abx_seq': 'int64', 'adm_date': 'date', 'disch_date': 'date', 'drug': 'str',
+        'startdate': 'date', 'enddate': 'date', 'abx_day': 'int64', 'duration_criteria': 'int64'}},
+    'trauma_sofa_score': {'folder': 'processed', 'columns': {
+        'hadm_id': _ID, 'icustay_id': _ID, 'hr': 'int64',
+        'starttime': 'datetime', 'endtime': 'datetime', 'sofa_24hours': 'int64',
+        'adm_date': 'date', 'sofa_date': 'date', 'sofa_day': 'int64'}},
+    'trauma_sofa_watermark': {'folder': 'processed', 'columns': {'icustay_id': _ID, 'watermark_hr': 'int64'}},
+    'sepsis_label': {'folder': 'processed', 'columns': {
+        'hadm_id': _ID, 'is_infection': 'int64', 'is_sepsis': 'int64',
+        'onset_datetime': 'datetime', 'onset_day': 'Int64',
+        'cx_index': 'Int64', 'abx_index': 'Int64', 'sofa_index_1': 'Int64', 'sofa_index_2': 'Int64'}},
+    'sepsis_candidates': {'folder': 'processed', 'columns': {
+        'hadm_id': _ID, 'onset_datetime': 'datetime', 'onset_day': 'Int64',
+        'cx_index': 'Int64', 'abx_index': 'Int64', 'is_infection': 'Int64', 'is_sepsis': 'float64',
+        'sofa_index_1': 'Int64', 'sofa_index_2': 'Int64'}},
+    # Per-admission digests of the label inputs at the last label assignment (see `update_sepsis_labels`)
+    'sepsis_label_inputs': {'folder': 'processed', 'columns': {
+        'hadm_id': _ID, 'cx_digest': 'Int64', 'abx_digest': 'Int64', 'sofa_digest': 'Int64',
+        'cx_first_index': 'Int64', 'abx_first_index': 'Int64', 'sofa_first_index': 'Int64'}},
+    # dataset folder: index tables of the instance sets (see src/data/instance_store.py)
+    'night_instances': {'folder': 'dataset', 'columns': {
+        'subject_id': _ID, 'hadm_id': _ID, 'Date': 'date', 'Night': 'int64', 'Label': 'int64', 'Fold': 'int64'}},
+}
+
+
+def cohort_key(ids):
+    """
+    Key of a cohort for the artifacts restricted to it: the first 16 hex digits of the SHA-256 of its sorted unique IDs
+    (e.g. ICU stays).
+    """
+    ids = np.unique(np.asarray(ids, dtype='int64'))
+    return hashlib.sha256(ids.tobytes()).hexdigest()[:16]
+
+def _cast_column(series, column_type):
+    if column_type == 'int64':
+        return series.astype('Int64' if series.isna().any() else 'int64')
+    if column_type == 'Int64':
+        return pd.to_numeric(series).astype('Int64')
+    if column_type == 'datetime':
+        return pd.to_datetime(series)
+    if column_type == 'date':
+        return pd.to_datetime(series).dt.date
+    if column_type == 'str':
+        return series.where(series.isna(), series.astype(str))
+    return series.astype(column_type)
+
+def apply_schema(df, name):
+    """
+    Casts the columns of `df` to the types declared for artifact `name` (columns not in the schema are left unchanged).
+    """
+    columns = ARTIFACT_SCHEMAS[name]['columns']
+    df = df.copy()
+    for column in df.columns.intersection(list(columns)):
+        df[column] = _cast_column(df[column], columns[column])
+    return df
+
+def write_artifact(df, path, name):
+    """
+    Saves `df` as artifact `name` (typed Parquet file). The index is stored as well, as with `to_csv`.
+    """
+    tmp_path = f'{path}.tmp'
+    apply_schema(df, name).to_parquet(tmp_path, index=True)
+    os.replace(tmp_path, path)
+
+def read_artifact(path, columns=None):
+    """
+    Loads an artifact; `columns` restricts the load to these columns (the index is always restored).
+    """
+    return pd.read_parquet(path, columns=columns)
+
+def iter_artifact_batches(path, batch_size, columns=None):
+    """
+    Yields an artifact as DataFrame chunks of at most `batch_size` rows.
+    """
+    import pyarrow.parquet as pq
+    parquet_file = pq.ParquetFile(path)
+    for batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns):
+        yield batch.to_pandas()
+
+def write_artifact_batches(batches, path, name):
+    """
+    Passes DataFrame chunks through while writing them to artifact `name`.
+    The file is only created once every chunk has been consumed, so an interrupted run leaves no partial artifact.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    tmp_path = f'{path}.tmp'
+    writer = None
+    try:
+        for chunk in batches:
+            table = pa.Table.from_pandas(apply_schema(chunk, name), preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(tmp_path, table.schema)
+            writer.write_table(table.cast(writer.schema))
+            yield chunk
+    except BaseException:
+        if writer is not None:
+            writer.close()
+            os.remove(tmp_path)
+        raise
+    if writer is not None:
+        writer.close()
+        os.replace(tmp_path, path)
@@ -6,7 +6,7 @@ from .sql2df import demog_sql2df, ventilation_day_processed
 
 def get_demographics_data(project_path_obj, project_id):
     """
-    Load the demographics data from a CSV file if it exists, otherwise query it using BigQuery.
+    Load the demographics data from the 'demographics' artifact if it exists, otherwise query it using BigQuery.
     More detailed information about the demographics table can be found in the src.sql2df.demog_sql2df function.
 
     Args:
@@ -16,20 +16,20 @@ def get_demographics_data(project_path_obj, project_id):
     Returns:
     - demog_df: A DataFrame containing the demographics data.
     """
-    # Check if the file exists
-    demog_path = project_path_obj.get_raw_data_file('demographics.csv')
-    if os.path.exists(demog_path):
-        # Load the CSV file into a DataFrame
-        demog_df = pd.read_csv(demog_path, index_col=0)
+    # Check if the artifact exists
+    if project_path_obj.artifact_exists('demographics'):
+        # Load the typed artifact (no parsing)
+        demog_df = project_path_obj.load_artifact('demographics')
     else:
         # Query demographics information by using BigQuery
-        demog_df = demog_sql2df(project_id, saved_path=demog_path)
+        demog_df = demog_sql2df(project_id)
+        print("File saved at:", project_path_obj.save_artifact('demographics', demog_df))
     
     return demog_df
 
 def get_ventilation_data(project_path_obj, project_id):
     """
-    Load the ventilation day data from a CSV file if it exists, otherwise query it using BigQuery.
+    Load the ventilation day data from the 'MVday' artifact if it exists, otherwise query it using BigQuery.
 
     Args:
     - project_path_obj: An object that provides the path to the raw data file.
@@ -40,14 +40,12 @@ def get_ventilation_data(project_path_obj, project_id):
                 This data represents the number of days the patient (HADM_ID) was receiving ventilation events, 
                 regardless of how many hours in that day the patient received ventilation.
     """
-    # Get the path to the ventilation day CSV file
-    vent_path = project_path_obj.get_processed_data_file('MVday.csv')
-    
-    if os.path.exists(vent_path):
-        # Load the CSV file into a DataFrame
-        vent_df = pd.read_csv(vent_path, index_col=0)
+    if project_path_obj.artifact_exists('MVday'):
+        # Load the typed artifact (no parsing)
+        vent_df = project_path_obj.load_artifact('MVday')
     else:
         # Query ventilation day data using BigQuery
-        vent_df = ventilation_day_processed(project_id, vent_type=['MechVent'], saved_path=vent_path)
+        vent_df = ventilation_day_processed(project_id, vent_type=['MechVent'])
+        print("Saved mechanical ventilation day at", project_path_obj.save_artifact('MVday', vent_df))
     
     return vent_df
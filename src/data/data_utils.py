@@ -1,26 +1,171 @@
 import os
+import time
 
 import numpy as np
 import pandas as pd
 
+from .query_backend import BigQueryBackend
+from .query_profiler import result_bytes
+
+# Backend executing every query of the pipeline (see src/data/query_backend.py).
+# BigQuery is the default; use `set_query_backend` to run against a local copy of MIMIC-III.
+_query_backend = BigQueryBackend()
+# Optional on-disk result cache (see src/data/query_cache.py); disabled when None.
+_query_cache = None
+# Optional per-query instrumentation (see src/data/query_profiler.py); disabled when None.
+_query_profiler = None
+
+def set_query_backend(backend):
+  """
+  Sets the backend used by `run_query`.
+
+  Args:
+  - backend: A query backend, e.g. query_backend.BigQueryBackend() or query_backend.LocalMimicBackend(data_dir).
+             If None, the default BigQuery backend is restored.
+  """
+  global _query_backend
+  _query_backend = backend if backend is not None else BigQueryBackend()
+
+def get_query_backend():
+  return _query_backend
+
+def set_query_cache(cache):
+  """
+  Enables (or disables, if None) transparent caching of `run_query` results.
+
+  Args:
+  - cache: A query_cache.QueryCache, e.g. QueryCache(project_path_obj.query_cache_path).
+  """
+  global _query_cache
+  _query_cache = cache
+
+def get_query_cache():
+  return _query_cache
+
+def set_query_profiler(profiler):
+  """
+  Enables (or disables, if None) the per-query records (call site, wall time, rows, result size, scanned bytes).
+
+  Args:
+  - profiler: A query_profiler.QueryProfiler, e.g. QueryProfiler(log_path='query_log.jsonl').
+  """
+  global _query_profiler
+  _query_profiler = profiler
+
+def get_query_profiler():
+  return _query_profiler
+
+def normalize_query_params(params):
+  """
+  Converts query parameter values into plain Python ints: ID collections become sorted lists of unique IDs
+  (e.g. a pandas Series of hadm_id), scalars become ints. Parameters set to None are dropped.
+  """
+  normalized = {}
+  for name, value in (params or {}).items():
+    if value is None:
+      continue
+    if np.ndim(value) == 0:
+      normalized[name] = int(value)
+    else:
+      normalized[name] = sorted({int(v) for v in pd.unique(np.asarray(value).ravel()) if pd.notna(v)})
+  return normalized
+
+def id_filter(column, param_name, ids, prefix='AND'):
+  """
+  Returns the SQL condition restricting `column` to the IDs bound to the query parameter `@param_name`,
+  or an empty string if `ids` is None (i.e. the query is not scoped).
+  e.g. id_filter('ce.hadm_id', 'hadm_ids', ids) -> "AND ce.hadm_id IN UNNEST(@hadm_ids)"
+  """
+  if ids is None:
+    return ''
+  return f"{prefix} {column} IN UNNEST(@{param_name})"
 
 # Read data from BigQuery(sql) into pandas dataframes.
-def run_query(query, project_id):
+def run_query(query, project_id, params=None):
   """
-  Executes a SQL query on Google BigQuery and returns the result as a DataFrame.
+  Executes a SQL query on the current query backend (Google BigQuery by default) and returns the result as a DataFrame.
+  If a query cache is set, a result previously computed for the same query, backend and dataset version is returned instead.
+  If a query profiler is set, a record of the call is added to it.
 
   Args:
   - query (str): The SQL query to execute.
-  - project_id (str): The Google Cloud project ID used for accessing BigQuery.
+  - project_id (str): The Google Cloud project ID used for accessing BigQuery (ignored by local backends).
+  - params (dict, optional): Named query parameters, e.g. {'hadm_ids': cohort_df.hadm_id} for a query
+                             filtering on `hadm_id IN UNNEST(@hadm_ids)`. The filter is applied inside the engine.
 
   Returns:
   - DataFrame: The result of the query as a pandas DataFrame.
   """
-  os.environ["GOOGLE_CLOUD_PROJECT"] = project_id
-  return pd.io.gbq.read_gbq(
-      query,
-      project_id=project_id,
-      dialect='standard')
+  backend, cache, profiler = _query_backend, _query_cache, _query_profiler
+  params = normalize_query_params(params)
+  record = None if profiler is None else profiler.start(query, backend, project_id, params)
+  start = time.perf_counter()
+  if cache is None:
+    df = backend.run_query(query, project_id, params)
+  else:
+    key = cache.key(query, backend.name, backend.dataset_version(query), params)
+    df = cache.get(key)
+    if record is not None:
+      record['cache_hit'] = df is not None
+    if df is None:
+      df = backend.run_query(query, project_id, params)
+      cache.put(key, df)
+
+  if record is not None:
+    record.update(wall_time_s=time.perf_counter() - start, rows=len(df), result_bytes=result_bytes(df))
+    profiler.finish(record)
+  return df
+
+def run_query_batches(query, project_id, batch_size=500000, params=None):
+  """
+  Executes a SQL query on the current query backend and yields the result in DataFrame chunks,
+  so that peak memory is bounded by `batch_size` rather than by the size of the result.
+  If a query cache is set, cached results are read back in chunks and new results are cached as they stream.
+  If a query profiler is set, the call is recorded once every chunk has been consumed.
+
+  Args:
+  - query (str): The SQL query to execute.
+  - project_id (str): The Google Cloud project ID used for accessing BigQuery (ignored by local backends).
+  - batch_size (int, optional): Maximum number of rows per chunk.
+  - params (dict, optional): Named query parameters (see `run_query`).
+
+  Yields:
+  - DataFrame: Consecutive chunks of the query result.
+  """
+  backend, cache, profiler = _query_backend, _query_cache, _query_profiler
+  params = normalize_query_params(params)
+  # The call site is recorded now: the chunks are produced later, from the consumer's frames
+  record = None if profiler is None else profiler.start(query, backend, project_id, params, streamed=True)
+  return _iter_query_batches(query, project_id, batch_size, params, backend, cache, profiler, record)
+
+def _iter_query_batches(query, project_id, batch_size, params, backend, cache, profiler, record):
+  if cache is None:
+    batches = backend.iter_batches(query, project_id, batch_size, params)
+  else:
+    key = cache.key(query, backend.name, backend.dataset_version(query), params)
+    batches = cache.open_batches(key, batch_size)
+    if record is not None:
+      record['cache_hit'] = batches is not None
+    if batches is None:
+      batches = cache.put_batches(key, backend.iter_batches(query, project_id, batch_size, params))
+  if record is not None:
+    batches = profiler.timed_batches(record, batches)
+
+  # Number rows continuously across chunks, as in the DataFrame returned by `run_query`
+  offset = 0
+  for chunk in batches:
+    chunk.index = pd.RangeIndex(offset, offset + len(chunk))
+    offset += len(chunk)
+    yield chunk
+
+def write_batches_to_csv(batches, saved_path):
+  """
+  Writes DataFrame chunks to a single CSV file (header written once) while passing them through,
+  so a streamed result can be saved without ever holding it in memory.
+  """
+  for i, chunk in enumerate(batches):
+    chunk.to_csv(saved_path, mode='w' if i == 0 else 'a', header=(i == 0))
+    yield chunk
 
 def test_mimiciii_bigquery_access(project_id):
     """
@@ -0,0 +1,115 @@
+import numpy as np
+import pandas as pd
+
+
+###################################
+# Hospital time axis shared by the pipeline stages
+###################################
+# Event times (cultures, antibiotics, SOFA hours, vital signs) are converted once to datetime64[ns] NumPy arrays and
+# the time-axis quantities are computed with integer arithmetic on nanoseconds, instead of `.dt.date` conversions
+# followed by `.apply(lambda x: x.days)` over Python `date` objects:
+#   hospital day   calendar day since admission, day 1 = day of admission ((date - admission date).days + 1)
+#   hospital hour  hours since admission, rounded to the nearest hour (halves to even, as `Timedelta.round('h')`)
+#   hour of day    0-23
+#   night index    nights run from the evening of day d to the morning of day d + 1 and are numbered d
+# Inputs may be timestamps, `datetime.date` objects, strings or datetime64 values of any unit. Results are int64
+# arrays, or float64 arrays with NaN where an input time is missing (NaT). Calendar dates are returned as
+# datetime64[ns] midnights (`calendar_date`, for arithmetic) or as `datetime.date` objects (`to_date`, the format of the
+# date columns of the stored tables and datasets, as `.dt.date` gives).
+
+_NS_PER_HOUR = 3600 * 10**9
+_NS_PER_DAY = 24 * _NS_PER_HOUR
+
+
+def to_datetime64(values):
+    """
+    Converts timestamps, dates, strings or datetime64 values to a datetime64[ns] NumPy array (NaT for missing values).
+    """
+    if isinstance(values, np.ndarray) and values.dtype.kind == 'M':
+        return values.astype('datetime64[ns]')
+    if not isinstance(values, (pd.Series, pd.Index)):
+        values = pd.Series(values)
+    return pd.to_datetime(values).to_numpy(dtype='datetime64[ns]')
+
+
+def _int_or_nan(result, *times):
+    # Integer result, or float with NaN where one of the times is NaT
+    is_missing = np.zeros(result.shape, dtype=bool)
+    for values in times:
+        is_missing |= np.isnat(values)
+    if is_missing.any():
+        result = result.astype('float64')
+        result[is_missing] = np.nan
+    return result
+
+
+def calendar_date(times):
+    """
+    Calendar day of each time, as a datetime64[ns] midnight.
+    """
+    return to_datetime64(times).astype('datetime64[D]').astype('datetime64[ns]')
+
+
+def to_date(times):
+    """
+    Calendar day of each time as a `datetime.date` object (NaT for missing times), as `.dt.date` would give,
+    converted in one array cast.
+    """
+    days = to_datetime64(times).astype('datetime64[D]')
+    dates = days.astype(object)
+    dates[np.isnat(days)] = pd.NaT
+    return dates
+
+
+def days_between(later, earlier):
+    """
+    Number of whole days from `earlier` to `later`, as `(later - earlier).days` would give for each row
+    (floor of the difference; the difference of calendar days when both are dates).
+    """
+    later, earlier = to_datetime64(later), to_datetime64(earlier)
+    return _int_or_nan((later.view('int64') - earlier.view('int64')) // _NS_PER_DAY, later, earlier)
+
+
+def hospital_day(times, admittimes):
+    """
+    Hospital day of each time: calendar day since the day of admission, day 1 being the day of admission.
+    """
+    times, admittimes = to_datetime64(times), to_datetime64(admittimes)
+    days = times.astype('datetime64[D]').view('int64') - admittimes.astype('datetime64[D]').view('int64') + 1
+    return _int_or_nan(days, times, admittimes)
+
+
+def hospital_hour(times, admittimes):
+    """
+    Hours since admission, rounded to the nearest hour (halves to even).
+    """
+    times, admittimes = to_datetime64(times), to_datetime64(admittimes)
+    hours, remainder = np.divmod(times.view('int64') - admittimes.view('int64'), _NS_PER_HOUR)
+    half = _NS_PER_HOUR // 2
+    hours = hours + ((remainder > half) | ((remainder == half) & (hours % 2 == 1)))
+    return _int_or_nan(hours, times, admittimes)
+
+
+def hour_of_day(times):
+    """
+    Hour of the day (0-23) of each time.
+    """
+    times = to_datetime64(times)
+    return _int_or_nan((times.view('int64') // _NS_PER_HOUR) % 24, times)
+
+
+def night_index(days, hours, last_hour=6):
+    """
+    Night of each hourly record: the hours up to `last_hour` o'clock belong to the night that started on the evening
+    of the previous day, so the night of day d covers the evening of day d and the morning of day d + 1.
+
+    Parameters:
+    - days (array-like): Hospital day (or any day number) of each record.
+    - hours (array-like): Hour of the day of each record.
+    - last_hour (int, optional): Last hour of the morning counted in the previous night (default: 6).
+
+    Returns:
+    - np.array: The day number of the night of each record.
+    """
+    days = np.asarray(days)
+    return np.where(np.asarray(hours) <= last_hour, days - 1, days)
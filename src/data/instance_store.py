@@ -0,0 +1,181 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from src.data import artifact_store
+
+
+###################################
+# Instance sets: contiguous feature arrays plus index tables, sharded by fold
+###################################
+# The nighttime instances of the final datasets are stored as (instances × timestamps × features) float arrays and
+# compact index tables, instead of a DataFrame holding one NumPy array per row in its 'Temporal Features' column.
+# An instance set is a directory with one shard per cross-validation fold and a manifest:
+#   <path>/manifest.json                      shards, their fold and number of instances, feature shape and index columns
+#   <path>/fold_<k>/temporal_features.npy     feature array of the instances of fold k (NumPy format)
+#   <path>/fold_<k>/index.parquet             'subject_id', 'hadm_id', 'Date', 'Night', 'Label', 'Fold' of these
+#                                             instances (typed artifact 'night_instances', see src/data/artifact_store.py)
+# Row i of a feature array is the instance on row i of the shard's index (instances without a fold go to the shard
+# 'fold_none'). The index tables keep the row labels of the saved DataFrame, so loading every fold restores its order.
+#
+# Loading reads the manifest and opens only the requested folds, and only the requested index columns. Feature arrays
+# are opened with `np.load(..., mmap_mode='r')`: a single fold is mapped, not read (zero-copy), and slicing instances
+# reads only their pages; several folds are concatenated, reading only their shards. `instance_frame` gives the
+# DataFrame layout of the former pickles, with each 'Temporal Features' entry a view of the array (no copy).
+
+MANIFEST_FILE = 'manifest.json'
+FEATURES_FILE = 'temporal_features.npy'
+INDEX_FILE = 'index.parquet'
+TEMPORAL_FEATURES = 'Temporal Features'
+SHARD_COLUMN = 'Fold'
+MANIFEST_VERSION = 1
+
+
+def instance_arrays(instance_df):
+    """
+    Splits a DataFrame of instances into its index table and one contiguous feature array.
+
+    Parameters:
+    - instance_df (pd.DataFrame): Instances with a 'Temporal Features' column of equally shaped arrays.
+
+    Returns:
+    - tuple: (index_df, values), the other columns (row labels kept) and the stacked features
+      (instances × timestamps × features).
+    """
+    features = instance_df[TEMPORAL_FEATURES]
+    if len(features):
+        values = np.stack(features.to_list())
+    else:
+        values = np.empty((0, 0, 0))
+    return instance_df.drop(columns=TEMPORAL_FEATURES), values
+
+def instance_frame(index_df, values):
+    """
+    DataFrame of instances from an index table and a feature array: the 'Temporal Features' column (after 'Night')
+    holds views of the rows of `values`.
+    """
+    if len(index_df) != len(values):
+        raise ValueError(f"The index has {len(index_df)} instances but the feature array has {len(values)}.")
+    instance_df = index_df.copy()
+    position = instance_df.columns.get_loc('Night') + 1 if 'Night' in instance_df else len(instance_df.columns)
+    instance_df.insert(position, TEMPORAL_FEATURES, pd.Series(list(values), index=instance_df.index, dtype=object))
+    return instance_df
+
+def _shard_name(fold):
+    return 'fold_none' if fold is None else f'fold_{fold}'
+
+def instance_set_exists(path):
+    return os.path.exists(os.path.join(path, MANIFEST_FILE))
+
+def read_manifest(path):
+    """
+    Manifest of an instance set: a dict with 'n_instances', 'feature_shape', 'dtype', 'columns' (index columns) and
+    'shards' (one dict per shard with 'fold', 'path' and 'n_instances').
+    """
+    with open(os.path.join(path, MANIFEST_FILE)) as f:
+        return json.load(f)
+
+def instance_set_folds(path):
+    """
+    Folds of an instance set (None for the instances without a fold).
+    """
+    return [shard['fold'] for shard in read_manifest(path)['shards']]
+
+def save_instance_set(path, index_df, values):
+    """
+    Saves an instance set (index table and feature array) to the directory `path`, one shard per fold, replacing an
+    existing one. The files are written to a temporary directory first, so an interrupted save leaves no partial
+    instance set.
+    """
+    if len(index_df) != len(values):
+        raise ValueError(f"The index has {len(index_df)} instances but the feature array has {len(values)}.")
+    tmp_path = f'{path}.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    # Instances grouped by fold (in order of the folds; instances keep their order within a fold)
+    if SHARD_COLUMN in index_df:
+        fold_codes, folds = pd.factorize(index_df[SHARD_COLUMN], sort=True, use_na_sentinel=True)
+    else:
+        fold_codes, folds = np.full(len(index_df), -1), []
+    shard_folds = [int(fold) for fold in folds] + ([None] if (fold_codes == -1).any() else [])
+    shards = []
+    for code, fold in enumerate(shard_folds):
+        rows = np.flatnonzero(fold_codes == (-1 if fold is None else code))
+        shard_path = os.path.join(tmp_path, _shard_name(fold))
+        os.makedirs(shard_path)
+        np.save(os.path.join(shard_path, FEATURES_FILE), np.ascontiguousarray(values[rows]))
+        artifact_store.write_artifact(index_df.iloc[rows], os.path.join(shard_path, INDEX_FILE), 'night_instances')
+        shards.append({'fold': fold, 'path': _shard_name(fold), 'n_instances': int(len(rows))})
+
+    manifest = {'version': MANIFEST_VERSION, 'n_instances': int(len(index_df)),
+                'feature_shape': [int(size) for size in values.shape[1:]], 'dtype': str(values.dtype),
+                'columns': list(index_df.columns), 'shards': shards}
+    with open(os.path.join(tmp_path, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    return path
+
+def iter_instance_shards(path, folds=None, columns=None, mmap_mode='r'):
+    """
+    Yields the shards of an instance set one at a time, as (fold, index_df, values), opening only the requested folds.
+
+    Parameters:
+    - path (str): Directory of the instance set.
+    - folds (list, optional): Folds to open (default: all); None stands for the instances without a fold.
+    - columns (list of str, optional): Columns of the index tables to load (default: all).
+    - mmap_mode (str, optional): Memory-map mode of the feature arrays ('r' by default: read-only and zero-copy;
+      None reads the arrays into memory).
+    """
+    manifest = read_manifest(path)
+    available = [shard['fold'] for shard in manifest['shards']]
+    unknown = [fold for fold in (folds or []) if fold not in available]
+    if unknown:
+        raise ValueError(f"Unknown folds {unknown} in {path}. Available folds: {available}.")
+    for shard in manifest['shards']:
+        if folds is not None and shard['fold'] not in folds:
+            continue
+        shard_path = os.path.join(path, shard['path'])
+        index_df = artifact_store.read_artifact(os.path.join(shard_path, INDEX_FILE), columns=columns)
+        values = np.load(os.path.join(shard_path, FEATURES_FILE), mmap_mode=mmap_mode)
+        yield shard['fold'], index_df, values
+
+def load_instance_set(path, folds=None, columns=None, mmap_mode='r'):
+    """
+    Loads the requested folds of an instance set.
+
+    Parameters:
+    - path (str): Directory of the instance set.
+    - folds (int or list, optional): Fold(s) to load (default: all).
+    - columns (list of str, optional): Columns of the index table to load (default: all).
+    - mmap_mode (str, optional): Memory-map mode of the feature arrays (default: 'r').
+
+    Returns:
+    - tuple: (index_df, values), the index table and the feature array. With a single fold, `values` is the
+      memory-mapped array of its shard; several folds are read into one array, in the order of the row labels of
+      the saved DataFrame.
+    """
+    if folds is not None and not isinstance(folds, (list, tuple, set)):
+        folds = [folds]
+    shards = list(iter_instance_shards(path, folds=folds, columns=columns, mmap_mode=mmap_mode))
+    if len(shards) == 1:
+        return shards[0][1], shards[0][2]
+    if not shards:
+        manifest = read_manifest(path)
+        columns = manifest['columns'] if columns is None else columns
+        return pd.DataFrame(columns=columns), np.empty((0, *manifest['feature_shape']), dtype=manifest['dtype'])
+    # Instances back in the order of their row labels; each shard is read once, into its rows of the result
+    index_df = pd.concat([shard_index for _, shard_index, _ in shards])
+    order = np.argsort(index_df.index.to_numpy(), kind='stable')
+    position = np.empty_like(order)
+    position[order] = np.arange(len(order))
+    values = np.empty((len(order), *shards[0][2].shape[1:]), dtype=shards[0][2].dtype)
+    start = 0
+    for _, _, shard_values in shards:
+        values[position[start:start + len(shard_values)]] = shard_values
+        start += len(shard_values)
+    return index_df.iloc[order], values
@@ -0,0 +1,165 @@
+import numpy as np
+import pandas as pd
+
+from src.data import hospital_time
+
+
+###################################
+# Sliding observation windows over the hourly grid of each admission
+###################################
+# The nighttime instances (22:00 to 06:00, see `extract_night_data`) are one instance definition among many: hourly
+# rolling predictions need windows of any length ending at any hour. Windows are taken from an hourly grid of the
+# vital signs:
+#   hourly grid      one row per hour of each admission, from its first to its last record, with the mean of the
+#                    records of the hour (NaN for hours without records); the admissions are consecutive blocks of one
+#                    (hours × features) array, described by an admission table ('grid_start', 'n_hours', ...)
+#   hours            counted from midnight of the day of admission: hour h is hour h % 24 of hospital day h // 24 + 1
+#   window           `lookback` consecutive hours of one admission, identified by the grid row of its first hour;
+#                    `sliding_windows` gives every window of the grid as one strided view (windows × lookback ×
+#                    features) of the grid array, without copying it
+#   window ends      a window is emitted when its last hour h satisfies (h - offset) % stride == 0, e.g. every hour
+#                    (stride=1) or every night at 06:00 (lookback=9, stride=24, offset=6: the hours 22:00 to 06:00 in
+#                    time order)
+# Window selection (observed hours, completeness) uses cumulative sums over the grid rows, so no window is copied
+# until the selected windows are gathered (`windows[window_df['window']]`).
+
+HOUR_COLUMN = 'hour'
+
+
+def hourly_admission_grid(df, feature_columns=None, ffill_hours=None):
+    """
+    Hourly grid of the records of each admission (see the module notes).
+
+    Parameters:
+    - df (pd.DataFrame): Records with 'subject_id', 'hadm_id', 'Date' (calendar day), 'Day' (hospital day), 'Hour'
+      (hour of the day) and the feature columns, e.g. the output of `extract_trauma_vitalsign`.
+    - feature_columns (list of str, optional): Features of the grid (default: all the other columns).
+    - ffill_hours (int, optional): Forward fill the hours without a value with the last value of the admission of at
+      most `ffill_hours` hours before (default: no filling).
+
+    Returns:
+    - tuple: (admission_df, values)
+      - admission_df (pd.DataFrame): One row per admission (sorted by 'hadm_id'): 'subject_id', 'hadm_id',
+        'admission_date' (midnight of the day of admission), 'first_hour' (hour of the first grid row), 'grid_start'
+        (first grid row) and 'n_hours' (number of grid rows).
+      - values (np.array): Hourly values (hours × features).
+    """
+    if feature_columns is None:
+        feature_columns = list(df.columns.drop(['subject_id', 'hadm_id', 'Date', 'Day', 'Hour']))
+    records = df[['subject_id', 'hadm_id'] + feature_columns].assign(
+        **{HOUR_COLUMN: (df['Day'].to_numpy() - 1) * 24 + df['Hour'].to_numpy()})
+
+    # Mean of the records of each hour (one row per admission and hour, sorted)
+    hourly_df = records.groupby(['hadm_id', HOUR_COLUMN], sort=True)[feature_columns].mean()
+    hadm_ids = hourly_df.index.get_level_values('hadm_id').to_numpy()
+    hours = hourly_df.index.get_level_values(HOUR_COLUMN).to_numpy()
+
+    # Admission blocks of the grid, from the first to the last hour with records
+    is_first = np.r_[True, hadm_ids[1:] != hadm_ids[:-1]] if len(hadm_ids) else np.zeros(0, dtype=bool)
+    first_rows = np.flatnonzero(is_first)
+    last_rows = np.r_[first_rows[1:], len(hours)] - 1
+    n_hours = hours[last_rows] - hours[first_rows] + 1
+    grid_start = (np.cumsum(n_hours) - n_hours).astype('int64')
+    admission = np.cumsum(is_first) - 1
+    values = np.full((int(n_hours.sum()), len(feature_columns)), np.nan)
+    values[grid_start[admission] + hours - hours[first_rows][admission]] = hourly_df.to_numpy(dtype='float64')
+
+    # Day of admission of each admission, from the calendar day and hospital day of its first record
+    first_records = df.drop_duplicates('hadm_id').set_index('hadm_id').loc[hadm_ids[first_rows]]
+    admission_date = (hospital_time.calendar_date(first_records['Date'])
+                      - (first_records['Day'].to_numpy() - 1) * np.timedelta64(1, 'D'))
+    admission_df = pd.DataFrame({'subject_id': first_records['subject_id'].to_numpy(), 'hadm_id': hadm_ids[first_rows],
+                                 'admission_date': admission_date, 'first_hour': hours[first_rows],
+                                 'grid_start': grid_start, 'n_hours': n_hours})
+
+    if ffill_hours:
+        values = forward_fill_hours(values, np.repeat(grid_start, n_hours), ffill_hours)
+    return admission_df, values
+
+def forward_fill_hours(values, row_start, limit):
+    """
+    Forward fills the NaN values of each feature with the last value of at most `limit` rows before, within blocks of
+    rows (`row_start`: first row of the block of each row, e.g. of its admission).
+    """
+    rows = np.arange(len(values))[:, None]
+    last_row = np.maximum.accumulate(np.where(np.isnan(values), -1, rows), axis=0)
+    is_filled = (last_row >= row_start[:, None]) & (rows - last_row <= limit)
+    filled = values[np.clip(last_row, 0, None), np.arange(values.shape[1])]
+    return np.where(is_filled, filled, np.nan)
+
+def sliding_windows(values, lookback):
+    """
+    Every window of `lookback` consecutive rows of the grid, as a read-only strided view of `values`
+    (windows × lookback × features); window w covers the grid rows w to w + lookback - 1.
+    """
+    if len(values) < lookback:
+        return np.empty((0, lookback, values.shape[1]), dtype=values.dtype)
+    return np.lib.stride_tricks.sliding_window_view(values, lookback, axis=0).transpose(0, 2, 1)
+
+def _window_sums(flags, lookback):
+    # Sum of `flags` over the window starting at each grid row (rows past the end of the grid are left at 0)
+    cumulative = np.r_[0, np.cumsum(flags)]
+    sums = np.zeros(len(flags), dtype='int64')
+    sums[:max(len(flags) - lookback + 1, 0)] = cumulative[lookback:] - cumulative[:len(cumulative) - lookback]
+    return sums
+
+def window_index(admission_df, values, lookback, stride=1, offset=0, min_observed_hours=1, complete=False):
+    """
+    Index table of the windows of `lookback` hours ending every `stride` hours (see the module notes).
+
+    Parameters:
+    - admission_df (pd.DataFrame): Admission table of the grid (see `hourly_admission_grid`).
+    - values (np.array): Hourly values of the grid.
+    - lookback (int): Number of hours of a window.
+    - stride (int, optional): Hours between the ends of consecutive windows (default: 1).
+    - offset (int, optional): Windows end at the hours h with (h - offset) % stride == 0 (default: 0).
+    - min_observed_hours (int, optional): Minimum number of hours of a window with at least one value (default: 1).
+    - complete (bool, optional): If True, keeps only the windows without NaN values (default: False).
+
+    Returns:
+    - pd.DataFrame: One row per window, in grid order: 'subject_id', 'hadm_id', 'Date' (calendar day of the last
+      hour), 'Day' (hospital day of the last hour), 'Hour' (hour of the day of the last hour) and 'window' (position of
+      the window in `sliding_windows(values, lookback)`).
+    """
+    # Last hour of the first and last windows of each admission
+    first_hour = admission_df['first_hour'].to_numpy()
+    last_hour = first_hour + admission_df['n_hours'].to_numpy() - 1
+    first_end = first_hour + lookback - 1
+    first_end = first_end + (offset - first_end) % stride
+    n_windows = np.where(first_end <= last_hour, (last_hour - first_end) // stride + 1, 0)
+
+    # Last hour of every window, then its position in the grid
+    admission = np.repeat(np.arange(len(admission_df)), n_windows)
+    rank = np.arange(n_windows.sum()) - np.repeat(np.cumsum(n_windows) - n_windows, n_windows)
+    end_hour = first_end[admission] + rank * stride
+    window = admission_df['grid_start'].to_numpy()[admission] + end_hour - first_hour[admission] - lookback + 1
+
+    # Windows with enough observed hours (and without NaN values)
+    is_kept = _window_sums(~np.isnan(values).all(axis=1), lookback)[window] >= min_observed_hours
+    if complete:
+        is_kept &= _window_sums(np.isnan(values).any(axis=1), lookback)[window] == 0
+    admission, end_hour, window = admission[is_kept], end_hour[is_kept], window[is_kept]
+
+    return pd.DataFrame({
+        'subject_id': admission_df['subject_id'].to_numpy()[admission],
+        'hadm_id': admission_df['hadm_id'].to_numpy()[admission],
+        'Date': hospital_time.to_date(admission_df['admission_date'].to_numpy()[admission] + (end_hour // 24) * np.timedelta64(1, 'D')),
+        'Day': end_hour // 24 + 1,
+        'Hour': end_hour % 24,
+        'window': window,
+    })
+
+def observation_windows(df, lookback, stride=1, offset=0, feature_columns=None, ffill_hours=None,
+                        min_observed_hours=1, complete=False):
+    """
+    Sliding observation windows of the records of each admission: builds the hourly grid (`hourly_admission_grid`) and
+    selects the windows (`window_index`). See these functions for the parameters.
+
+    Returns:
+    - tuple: (window_df, windows), the index table of the selected windows and the strided view of every window of
+      the grid; the features of the selected windows are `windows[window_df['window']]`.
+    """
+    admission_df, values = hourly_admission_grid(df, feature_columns=feature_columns, ffill_hours=ffill_hours)
+    window_df = window_index(admission_df, values, lookback, stride=stride, offset=offset,
+                             min_observed_hours=min_observed_hours, complete=complete)
+    return window_df, sliding_windows(values, lookback)
@@ -0,0 +1,254 @@
+import numpy as np
+import pandas as pd
+
+
+###################################
+# Online detection of post-traumatic sepsis onset
+###################################
+# `StreamingOnsetDetector` consumes, for each admission, culture, antibiotic-start and SOFA events in time order and
+# emits an onset event as soon as the admission's sepsis label and onset are known. It applies the criteria of
+# `scripts/sepsis_onset_label_assignment.py`:
+#   suspected infection   a culture with an antibiotic start within `cx_abx_window` days (before or after)
+#   organ dysfunction     a SOFA increase of `min_sofa_rise` points within `sofa_window` days of the culture
+#   onset                 the (charted) time of the earliest qualifying culture
+# Events only carry the hospital day they fall on (day 1 = day of admission, as 'cx_day', 'abx_day' and 'sofa_day'),
+# so a criterion that may still be met by a later event stays pending until that day has passed: an onset is
+# detected up to `cx_abx_window` days (antibiotics started after the culture) or `sofa_window` days (SOFA increase after
+# the culture) after the culture.
+#
+# State kept per admission (bounded by the windows, not by the length of the stay, apart from one entry per culture day):
+#   pending cultures      cultures whose infection or organ dysfunction criteria are not settled yet
+#   recent antibiotics    the day of the last antibiotic start
+#   SOFA windows          running minimum and increase flag of the SOFA scores since each of the last 2 * sofa_window + 1
+#                         days: the organ dysfunction window of a culture on day d is the one started on day d - sofa_window
+# Each event updates at most 2 * sofa_window + 1 windows and cultures, and every culture is settled once: O(1) amortized
+# work per event.
+#
+# The labels match `assign_sepsis_labels` when historical data is replayed (`replay_sepsis_onsets`). This includes how
+# `sepsis_onset_candidates` pairs suspected infections with organ dysfunction: the result of the k-th suspected infection
+# of an admission is joined to the row of its k-th culture, so an admission's onset is settled in culture order.
+
+
+class _AdmissionState:
+    __slots__ = ['day', 'last_abx_day', 'windows', 'cultures', 'culture_at_day', 'next_culture', 'infections', 'next_row']
+
+    def __init__(self):
+        self.day = None
+        self.last_abx_day = None
+        # {start day: [running minimum, increase flag]} of the SOFA scores recorded since the start day
+        self.windows = {}
+        # [day, time, infection flag, organ dysfunction flag] of each culture (flags are None while pending)
+        self.cultures = []
+        self.culture_at_day = {}
+        # Positions of the cultures with suspected infection, in culture order (cultures before `next_culture` are settled)
+        self.next_culture = 0
+        self.infections = []
+        # Candidate rows (suspected infections, in culture order) already known not to be sepsis
+        self.next_row = 0
+
+
+class StreamingOnsetDetector:
+    """
+    Detects sepsis onset from a stream of culture, antibiotic-start and SOFA events (see the module notes).
+
+    Events of one admission must come in time order (non-decreasing hospital days); events of different admissions may
+    be interleaved. Each method returns the onset events emitted by the event (a list, usually empty); all the emitted
+    events are also kept in `onsets`.
+
+    Args:
+    - cx_abx_window (int, optional): Max. days between a culture and an antibiotic start (default: 2).
+    - sofa_window (int, optional): Days before/after the culture searched for a SOFA increase (default: 3).
+    - min_sofa_rise (int, optional): Min. SOFA increase, in points (default: 2).
+
+    Attributes:
+    - onsets (list): Emitted onset events, as dicts with 'hadm_id', 'onset_datetime' and 'onset_day' (the qualifying
+      culture), and 'detected_day' / 'detected_at' (day and time of the event that settled the onset; 'detected_at' is
+      None when the onset was settled by `end_admission`).
+    """
+    def __init__(self, cx_abx_window=2, sofa_window=3, min_sofa_rise=2):
+        self.cx_abx_window = cx_abx_window
+        self.sofa_window = sofa_window
+        self.min_sofa_rise = min_sofa_rise
+        self.onsets = []
+        self._states = {}
+        # Admissions whose onset was emitted or which ended: later events are ignored
+        self._closed = set()
+
+    def culture(self, hadm_id, day, time=None):
+        """
+        A (blood) culture charted on hospital day `day` at `time`. Only the first culture of a day is considered
+        (as in `preprocess_data`).
+        """
+        state = self._advance(hadm_id, day)
+        if state is None or (state.cultures and state.cultures[-1][0] == day):
+            return []
+        # Antibiotics started within the window before the culture
+        is_infection = True if state.last_abx_day is not None and state.last_abx_day >= day - self.cx_abx_window else None
+        # SOFA increase already observed within the window (since day - sofa_window)
+        is_dysfunction = True if state.windows[day - self.sofa_window][1] else None
+        state.culture_at_day[day] = len(state.cultures)
+        state.cultures.append([day, time, is_infection, is_dysfunction])
+        return self._resolve(hadm_id, state, time)
+
+    def antibiotic(self, hadm_id, day, time=None):
+        """
+        A (qualifying) antibiotic event started on hospital day `day`.
+        """
+        state = self._advance(hadm_id, day)
+        if state is None:
+            return []
+        state.last_abx_day = day
+        # Cultures charted within the window before the antibiotic start (the ones after it will see `last_abx_day`)
+        for culture in reversed(state.cultures):
+            if culture[0] < day - self.cx_abx_window:
+                break
+            if culture[2] is None:
+                culture[2] = True
+        return self._resolve(hadm_id, state, time)
+
+    def sofa(self, hadm_id, day, score, time=None):
+        """
+        A SOFA score ('sofa_24hours') recorded on hospital day `day`.
+        """
+        state = self._advance(hadm_id, day)
+        if state is None:
+            return []
+        for start_day, window in state.windows.items():
+            if window[0] is not None and not window[1] and score - window[0] >= self.min_sofa_rise:
+                window[1] = True
+                # Organ dysfunction of the culture at the center of the window
+                position = state.culture_at_day.get(start_day + self.sofa_window)
+                if position is not None:
+                    state.cultures[position][3] = True
+            window[0] = score if window[0] is None else min(window[0], score)
+        return self._resolve(hadm_id, state, time)
+
+    def end_admission(self, hadm_id):
+        """
+        No more events for the admission (e.g. discharge): settles the pending criteria and releases its state.
+        """
+        state = self._states.pop(hadm_id, None)
+        if state is None or hadm_id in self._closed:
+            return []
+        for culture in state.cultures:
+            if culture[2] is None:
+                culture[2] = False
+            if culture[3] is None:
+                culture[3] = state.windows.get(culture[0] - self.sofa_window, [None, False])[1]
+        onsets = self._resolve(hadm_id, state, None, is_final=True)
+        self._closed.add(hadm_id)
+        return onsets
+
+    def flush(self):
+        """
+        Ends every open admission (end of the replayed data), returning the onset events emitted.
+        """
+        onsets = []
+        for hadm_id in list(self._states):
+            onsets.extend(self.end_admission(hadm_id))
+        return onsets
+
+    def _advance(self, hadm_id, day):
+        # Moves the admission to `day`: settles the criteria that no later event can meet and slides the SOFA windows
+        if hadm_id in self._closed:
+            return None
+        state = self._states.get(hadm_id)
+        if state is None:
+            state = self._states[hadm_id] = _AdmissionState()
+        elif day < state.day:
+            raise ValueError(f"Events of admission {hadm_id} are not in time order (day {day} after day {state.day}).")
+        elif day == state.day:
+            return state
+
+        # No antibiotic start can be matched to cultures charted more than `cx_abx_window` days ago
+        for culture in state.cultures[state.next_culture:]:
+            if culture[0] >= day - self.cx_abx_window:
+                break
+            if culture[2] is None:
+                culture[2] = False
+        # SOFA windows ending before `day` are settled (organ dysfunction of the culture at their center)
+        first_day = day - 2 * self.sofa_window
+        for start_day in [start_day for start_day in state.windows if start_day < first_day]:
+            position = state.culture_at_day.get(start_day + self.sofa_window)
+            if position is not None and state.cultures[position][3] is None:
+                state.cultures[position][3] = state.windows[start_day][1]
+            del state.windows[start_day]
+        new_day = first_day if state.day is None else max(first_day, state.day + 1)
+        for start_day in range(new_day, day + 1):
+            state.windows[start_day] = [None, False]
+        state.day = day
+        return state
+
+    def _resolve(self, hadm_id, state, time, is_final=False):
+        # Suspected infections in culture order, as far as the infection criteria of the cultures are settled
+        while state.next_culture < len(state.cultures) and state.cultures[state.next_culture][2] is not None:
+            if state.cultures[state.next_culture][2]:
+                state.infections.append(state.next_culture)
+            state.next_culture += 1
+
+        # Candidate rows in culture order: the k-th suspected infection is sepsis if the suspected infection whose
+        # rank is the position of its culture (as joined by `sepsis_onset_candidates`) shows organ dysfunction
+        while state.next_row < len(state.infections):
+            position = state.infections[state.next_row]
+            if position < len(state.infections):
+                is_dysfunction = state.cultures[state.infections[position]][3]
+                if is_dysfunction is None:
+                    return []
+                if is_dysfunction:
+                    culture = state.cultures[position]
+                    onset = {'hadm_id': hadm_id, 'onset_datetime': culture[1], 'onset_day': culture[0],
+                             'detected_day': state.day, 'detected_at': time}
+                    self.onsets.append(onset)
+                    self._closed.add(hadm_id)
+                    self._states.pop(hadm_id, None)
+                    return [onset]
+            elif not is_final:
+                # Not settled until the admission has as many suspected infections (or ends)
+                return []
+            state.next_row += 1
+        return []
+
+
+def onset_events(cx_df, abx_df, sofa_df):
+    """
+    Builds the event stream of historical data, from the preprocessed tables of `preprocess_data`
+    (cultures 'cx_day'/'cx_datetime', antibiotic events 'abx_day'/'startdate', SOFA scores 'sofa_day'/'sofa_24hours').
+
+    Returns:
+    - pd.DataFrame: One row per event with columns 'hadm_id', 'kind' ('culture', 'antibiotic' or 'sofa'), 'day', 'time'
+      and 'score', sorted by admission and day (events of a day keep the order of their table).
+    """
+    events = pd.concat([
+        pd.DataFrame({'hadm_id': cx_df['hadm_id'].values, 'kind': 'culture', 'day': cx_df['cx_day'].values,
+                      'time': pd.to_datetime(cx_df['cx_datetime']).values, 'score': np.nan}),
+        pd.DataFrame({'hadm_id': abx_df['hadm_id'].values, 'kind': 'antibiotic', 'day': abx_df['abx_day'].values,
+                      'time': pd.to_datetime(abx_df['startdate']).values, 'score': np.nan}),
+        pd.DataFrame({'hadm_id': sofa_df['hadm_id'].values, 'kind': 'sofa', 'day': sofa_df['sofa_day'].values,
+                      'time': pd.to_datetime(sofa_df['starttime']).values if 'starttime' in sofa_df else pd.NaT,
+                      'score': sofa_df['sofa_24hours'].values}),
+    ], ignore_index=True)
+    return events.sort_values(['hadm_id', 'day'], kind='stable').reset_index(drop=True)
+
+
+def replay_sepsis_onsets(trum_cohort_info_df, cx_df, abx_df, sofa_df, detector=None):
+    """
+    Replays historical data through a `StreamingOnsetDetector` and returns the resulting labels, to be compared with
+    the sepsis label table of `assign_sepsis_labels`.
+
+    Returns:
+    - pd.DataFrame: One row per cohort patient (sorted by 'hadm_id') with columns 'is_sepsis', 'onset_datetime',
+      'onset_day', 'detected_day' and 'detected_at'.
+    """
+    detector = detector or StreamingOnsetDetector()
+    handlers = {'culture': detector.culture, 'antibiotic': detector.antibiotic}
+    for hadm_id, kind, day, time, score in onset_events(cx_df, abx_df, sofa_df).itertuples(index=False):
+        if kind == 'sofa':
+            detector.sofa(hadm_id, day, score, time)
+        else:
+            handlers[kind](hadm_id, day, time)
+    detector.flush()
+
+    onset_df = pd.DataFrame(detector.onsets, columns=['hadm_id', 'onset_datetime', 'onset_day', 'detected_day', 'detected_at'])
+    labels = trum_cohort_info_df[['hadm_id']].drop_duplicates().merge(onset_df, on='hadm_id', how='left')
+    labels.insert(1, 'is_sepsis', labels.onset_day.notna().astype(int))
+    return labels.sort_values('hadm_id').reset_index(drop=True)
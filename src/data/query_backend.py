@@ -0,0 +1,296 @@
+import os
+import re
+import threading
+
+import pandas as pd
+
+
+###################################
+# Query backends used by `data_utils.run_query`
+###################################
+# Every query in this project is written in BigQuery standard SQL against the
+# `physionet-data.mimiciii_*` datasets. A backend takes that SQL text and returns a DataFrame.
+#   * BigQueryBackend:    the default, runs the query on Google BigQuery (Colab setup).
+#   * LocalMimicBackend:  runs the same query with DuckDB over a local copy of MIMIC-III
+#                         (CSV/CSV.gz/Parquet files), remapping table names and translating
+#                         the few BigQuery-only functions used by the queries.
+#
+# Queries may reference named parameters, e.g. `WHERE hadm_id IN UNNEST(@hadm_ids)`, whose values
+# (lists of integer IDs) are passed separately in `params` and bound by the engine.
+
+
+class BigQueryBackend:
+    """
+    Executes queries on Google BigQuery through pandas-gbq.
+
+    Args:
+    - dataset_version (str, optional): Version tag of the `physionet-data` datasets, used in query cache keys.
+    """
+    name = 'bigquery'
+
+    def __init__(self, dataset_version='mimiciii_v1.4'):
+        self._dataset_version = dataset_version
+
+    def dataset_version(self, query):
+        return self._dataset_version
+
+    def run_query(self, query, project_id, params=None):
+        os.environ["GOOGLE_CLOUD_PROJECT"] = project_id
+        configuration = None
+        if params:
+            configuration = {'query': {
+                'parameterMode': 'NAMED',
+                'queryParameters': [_bigquery_parameter(name, value) for name, value in params.items()]}}
+        return pd.io.gbq.read_gbq(
+            query,
+            project_id=project_id,
+            dialect='standard',
+            configuration=configuration)
+
+    def _job_config(self, params, **kwargs):
+        from google.cloud import bigquery
+        return bigquery.QueryJobConfig(query_parameters=[
+            bigquery.ArrayQueryParameter(name, 'INT64', value) if isinstance(value, list)
+            else bigquery.ScalarQueryParameter(name, 'INT64', value)
+            for name, value in (params or {}).items()], **kwargs)
+
+    def iter_batches(self, query, project_id, batch_size, params=None):
+        """
+        Yields the result of `query` as DataFrame chunks of at most `batch_size` rows,
+        fetching one result page at a time.
+        """
+        from google.cloud import bigquery
+        client = bigquery.Client(project=project_id)
+        rows = client.query(query, job_config=self._job_config(params)).result(page_size=batch_size)
+        for chunk in rows.to_dataframe_iterable():
+            yield chunk
+
+    def dry_run_bytes(self, query, project_id, params=None):
+        """
+        Returns the number of bytes `query` would scan (and be billed for), from a BigQuery dry run.
+        """
+        from google.cloud import bigquery
+        client = bigquery.Client(project=project_id)
+        job = client.query(query, job_config=self._job_config(params, dry_run=True, use_query_cache=False))
+        return job.total_bytes_processed
+
+
+class LocalMimicBackend:
+    """
+    Executes the project's BigQuery queries on a local copy of MIMIC-III with DuckDB.
+
+    Table references such as `physionet-data.mimiciii_clinical.admissions` are mapped to local files.
+    For each referenced table the backend looks for, in order:
+        1. an explicit entry in `table_map` (key: 'mimiciii_clinical.admissions' or 'admissions'),
+        2. <data_dir>/<dataset>/<table>.<ext>
+        3. <data_dir>/<table>.<ext>
+    where <table> is tried in lower and upper case (the PhysioNet CSVs are named e.g. ADMISSIONS.csv.gz)
+    and <ext> is one of 'parquet', 'csv.gz', 'csv'.
+    Derived views (`mimiciii_derived.*`, e.g. pivoted_vital, ventilation_classification) are not part of
+    the raw MIMIC-III release and must be materialized as files in the same way.
+
+    Args:
+    - data_dir (str): Folder containing the local MIMIC-III files.
+    - table_map (dict, optional): Explicit {table name: file path} overrides.
+    - database (str, optional): DuckDB database file; the default keeps everything in memory.
+    - dataset_version (str, optional): Version tag of the local copy, used in query cache keys.
+    """
+    name = 'duckdb'
+    file_extensions = ['parquet', 'csv.gz', 'csv']
+
+    def __init__(self, data_dir, table_map=None, database=':memory:', dataset_version='mimiciii_v1.4'):
+        try:
+            import duckdb
+        except ImportError as e:
+            raise ImportError("LocalMimicBackend requires the `duckdb` package (pip install duckdb).") from e
+        self.data_dir = data_dir
+        self.table_map = dict(table_map or {})
+        self._connection = duckdb.connect(database)
+        self._views = {}
+        self._lock = threading.Lock()  # view registration from concurrent queries
+        self._dataset_version = dataset_version
+
+    def resolve_table(self, dataset, table):
+        """
+        Returns the local file backing `dataset.table`.
+        """
+        for key in [f'{dataset}.{table}', table]:
+            if key in self.table_map:
+                return self.table_map[key]
+        for folder in [os.path.join(self.data_dir, dataset), self.data_dir]:
+            for name in [table.lower(), table.upper()]:
+                for ext in self.file_extensions:
+                    path = os.path.join(folder, f'{name}.{ext}')
+                    if os.path.exists(path):
+                        return path
+        raise FileNotFoundError(f"No local file found for table `{dataset}.{table}` under {self.data_dir}")
+
+    def dataset_version(self, query):
+        """
+        Returns the version tag of the data read by `query`: the configured tag plus the
+        path, size and modification time of every local file the query references.
+        Replacing a file therefore invalidates the cached results of the queries reading it.
+        """
+        files = []
+        for dataset, table in sorted(set(re.findall(r'`physionet-data\.(\w+)\.(\w+)`', strip_sql_comments(query)))):
+            path = self.resolve_table(dataset, table)
+            stat = os.stat(path)
+            files.append(f'{path}:{stat.st_size}:{int(stat.st_mtime)}')
+        return '|'.join([self._dataset_version] + files)
+
+    def _register_view(self, dataset, table):
+        view_name = f'{dataset}__{table}'.lower()
+        with self._lock:
+            if view_name in self._views:
+                return view_name
+            path = self.resolve_table(dataset, table)
+            if path.endswith('.parquet'):
+                reader = f"read_parquet('{path}')"
+            else:
+                reader = f"read_csv_auto('{path}', header=true)"
+            self._connection.execute(f'CREATE OR REPLACE VIEW {view_name} AS SELECT * FROM {reader}')
+            self._views[view_name] = path
+        return view_name
+
+    def translate(self, query):
+        """
+        Rewrites a BigQuery query into DuckDB SQL over the local views.
+        """
+        # Drop comments first: they mention tables (e.g. inputevents_mv) that the query never reads
+        query = strip_sql_comments(query)
+        query = re.sub(r'`physionet-data\.(\w+)\.(\w+)`',
+                       lambda m: self._register_view(m.group(1), m.group(2)),
+                       query)
+        return translate_bigquery_sql(query)
+
+    def _execute(self, query, params):
+        # Each query runs on its own cursor, so queries can be issued from several threads
+        sql = self.translate(query)
+        # Only bind the parameters the query actually references (DuckDB rejects unused ones); whole names only,
+        # so that `$hadm_id` does not match `$hadm_ids`
+        params = {name: value for name, value in (params or {}).items()
+                  if re.search(rf'\${re.escape(name)}\b', sql)}
+        with self._lock:
+            cursor = self._connection.cursor()
+        return cursor.execute(sql, params)
+
+    def run_query(self, query, project_id=None, params=None):
+        # `project_id` is accepted for interface compatibility with BigQueryBackend and ignored.
+        df = self._execute(query, params).df()
+        return df.rename(columns=query_case_columns(query, df.columns))
+
+    def iter_batches(self, query, project_id=None, batch_size=500000, params=None):
+        """
+        Yields the result of `query` as DataFrame chunks of at most `batch_size` rows.
+        DuckDB streams Arrow record batches, so the full result is never materialized.
+        """
+        reader = self._execute(query, params).fetch_record_batch(batch_size)
+        columns = query_case_columns(query, reader.schema.names)
+        for batch in reader:
+            yield batch.to_pandas().rename(columns=columns)
+
+    def dry_run_bytes(self, query, project_id=None, params=None):
+        # DuckDB has no scanned-bytes estimate
+        return None
+
+
+def _bigquery_parameter(name, value):
+    """
+    Builds a named INT64 (or ARRAY<INT64>) query parameter in the BigQuery REST format.
+    """
+    if isinstance(value, list):
+        return {'name': name,
+                'parameterType': {'type': 'ARRAY', 'arrayType': {'type': 'INT64'}},
+                'parameterValue': {'arrayValues': [{'value': str(v)} for v in value]}}
+    return {'name': name,
+            'parameterType': {'type': 'INT64'},
+            'parameterValue': {'value': str(value)}}
+
+
+###################################
+# BigQuery -> DuckDB dialect shim
+###################################
+
+def strip_sql_comments(sql):
+    """
+    Removes `-- ...` line comments (outside of string literals) from a query.
+    """
+    return re.sub(r"('(?:[^']|'')*')|--[^\n]*", lambda m: m.group(1) or '', sql)
+
+def query_case_columns(query, columns):
+    """
+    BigQuery names an output column as it is written in the query (`SELECT ie.subject_id` -> 'subject_id'),
+    DuckDB as it is stored in the file ('SUBJECT_ID' in the PhysioNet CSVs).
+    Returns the {DuckDB name: BigQuery name} renaming of the result columns, using the first spelling
+    of each identifier in the query; columns the query never names (e.g. from `SELECT *`) keep their stored name.
+    """
+    spellings = {}
+    for token in re.findall(r'[A-Za-z_]\w*', re.sub(r"'(?:[^']|'')*'", ' ', strip_sql_comments(query))):
+        spellings.setdefault(token.lower(), token)
+    return {column: spellings[column.lower()] for column in columns
+            if column.lower() in spellings and spellings[column.lower()] != column}
+
+def _split_args(args):
+    """
+    Splits the argument string of a function call on top-level commas.
+    """
+    parts, depth, quote, start = [], 0, None, 0
+    for i, ch in enumerate(args):
+        if quote:
+            if ch == quote:
+                quote = None
+        elif ch in "'\"":
+            quote = ch
+        elif ch == '(':
+            depth += 1
+        elif ch == ')':
+            depth -= 1
+        elif ch == ',' and depth == 0:
+            parts.append(args[start:i].strip())
+            start = i + 1
+    parts.append(args[start:].strip())
+    return parts
+
+def _rewrite_function(sql, name, rewrite):
+    """
+    Replaces every call `name(...)` in `sql` by `rewrite(args)`, where `args` is the list of
+    (already rewritten) arguments.
+    """
+    pattern = re.compile(r'\b' + name + r'\s*\(', re.IGNORECASE)
+    match = pattern.search(sql)
+    while match is not None:
+        depth, end = 1, match.end()
+        while depth > 0:
+            if sql[end] == '(':
+                depth += 1
+            elif sql[end] == ')':
+                depth -= 1
+            end += 1
+        args = _split_args(_rewrite_function(sql[match.end():end - 1], name, rewrite))
+        replacement = rewrite(args)
+        sql = sql[:match.start()] + replacement + sql[end:]
+        match = pattern.search(sql, match.start() + len(replacement))
+    return sql
+
+def translate_bigquery_sql(sql):
+    """
+    Translates the BigQuery-only datetime functions used in this project into DuckDB syntax.
+        DATETIME_DIFF(end, start, PART)        -> date_diff('part', start, end)  (arguments cast to TIMESTAMP)
+        DATETIME_SUB(ts, INTERVAL 'n' PART)    -> (ts - INTERVAL 'n' PART)
+        DATETIME_ADD(ts, INTERVAL 'n' PART)    -> (ts + INTERVAL 'n' PART)
+        DATETIME_TRUNC(ts, PART)               -> date_trunc('part', ts)
+        x IN UNNEST(@ids)                      -> x IN (SELECT UNNEST($ids))
+        @param                                 -> $param
+    Both engines count crossed part boundaries in DATETIME_DIFF, so results are identical.
+    """
+    sql = _rewrite_function(sql, 'DATETIME_DIFF',
+                           lambda a: f"date_diff('{a[2].lower()}', CAST({a[1]} AS TIMESTAMP), CAST({a[0]} AS TIMESTAMP))")
+    sql = _rewrite_function(sql, 'DATETIME_SUB', lambda a: f"({a[0]} - {a[1]})")
+    sql = _rewrite_function(sql, 'DATETIME_ADD', lambda a: f"({a[0]} + {a[1]})")
+    sql = _rewrite_function(sql, 'DATETIME_TRUNC', lambda a: f"date_trunc('{a[1].lower()}', {a[0]})")
+    # Named query parameters
+    sql = re.sub(r'\bIN\s+UNNEST\s*\(\s*@(\w+)\s*\)', r'IN (SELECT UNNEST($\1))', sql, flags=re.IGNORECASE)
+    sql = re.sub(r'@(\w+)', r'$\1', sql)
+    # Any remaining backtick-quoted identifier
+    sql = sql.replace('`', '"')
+    return sql
@@ -0,0 +1,182 @@
+import hashlib
+import os
+import re
+import threading
+
+import pandas as pd
+
+
+###################################
+# On-disk query result cache used by `data_utils.run_query`
+###################################
+# Each result is stored as one Parquet file named after a SHA-256 of
+#   (normalized SQL text, query parameters, backend name, dataset version),
+# so editing a query (or switching backend / dataset) never serves a stale result.
+# The cache is bounded by `max_bytes`; the least recently used results are evicted first
+# (a cache hit refreshes the file modification time).
+
+
+def normalize_sql(query):
+    """
+    Normalizes a SQL query for hashing: removes `--` comments and collapses whitespace,
+    leaving string literals untouched.
+    """
+    tokens = re.findall(r"'(?:[^']|'')*'|--[^\n]*|\s+|[^'\s-]+|-", query)
+    normalized = []
+    for token in tokens:
+        if token.startswith('--') or token.isspace():
+            if normalized and normalized[-1] != ' ':
+                normalized.append(' ')
+        else:
+            normalized.append(token)
+    return re.sub(r'\s*;\s*$', '', ''.join(normalized).strip())
+
+
+class QueryCache:
+    """
+    Content-addressed, size-bounded cache of query results stored as Parquet files.
+
+    Args:
+    - cache_dir (str): Folder where the cached results are stored (e.g. ProjectPaths.query_cache_path).
+    - max_bytes (int, optional): Maximum total size of the cache on disk. Defaults to 20 GB.
+
+    Attributes:
+    - stats (dict): Number of cache 'hits', 'misses' and 'evictions' since the cache was created.
+    """
+    def __init__(self, cache_dir, max_bytes=20 * 1024**3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, query, backend_name, dataset_version, params=None):
+        params = sorted((params or {}).items())
+        content = '\x1f'.join([normalize_sql(query), repr(params), str(backend_name), str(dataset_version)])
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.parquet')
+
+    def get(self, key):
+        """
+        Returns the cached result for `key`, or None on a cache miss (a corrupt or truncated file is a miss).
+        """
+        import pyarrow as pa
+        path = self._path(key)
+        try:
+            df = pd.read_parquet(path)
+            os.utime(path)  # mark as recently used
+        except (OSError, pa.ArrowException):
+            with self._lock:
+                self.stats['misses'] += 1
+            return None
+        with self._lock:
+            self.stats['hits'] += 1
+        return df
+
+    def put(self, key, df):
+        """
+        Stores a query result and evicts the least recently used results if the cache exceeds `max_bytes`.
+        """
+        path = self._path(key)
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def open_batches(self, key, batch_size):
+        """
+        Returns an iterator over the cached result for `key` in DataFrame chunks of at most
+        `batch_size` rows, or None on a cache miss (a corrupt or truncated file is a miss).
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        path = self._path(key)
+        try:
+            parquet_file = pq.ParquetFile(path)
+            os.utime(path)  # mark as recently used
+        except (OSError, pa.ArrowException):
+            with self._lock:
+                self.stats['misses'] += 1
+            return None
+        with self._lock:
+            self.stats['hits'] += 1
+        return (batch.to_pandas() for batch in parquet_file.iter_batches(batch_size=batch_size))
+
+    def put_batches(self, key, batches):
+        """
+        Passes DataFrame chunks through while writing them to the cache.
+        The result is only committed to the cache once every chunk has been consumed.
+
+        The file takes the Arrow schema of the first chunk. If a later chunk cannot be cast to it (e.g. a column that
+        is all null in the first chunk, typed `null` by Arrow, has values later), the result is not cached and the
+        remaining chunks are passed through unchanged.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        path = self._path(key)
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        writer = None
+        is_cached = True
+
+        def discard():
+            writer.close()
+            os.remove(tmp_path)
+
+        try:
+            for chunk in batches:
+                if is_cached:
+                    table = pa.Table.from_pandas(chunk, preserve_index=False)
+                    if writer is None:
+                        writer = pq.ParquetWriter(tmp_path, table.schema)
+                    try:
+                        table = table.cast(writer.schema)
+                    except pa.ArrowException:
+                        # The schema of the file cannot hold this chunk: skip caching this result
+                        discard()
+                        is_cached = False
+                    else:
+                        writer.write_table(table)
+                yield chunk
+        except BaseException:
+            if writer is not None and is_cached:
+                discard()
+            raise
+        if writer is not None and is_cached:
+            writer.close()
+            os.replace(tmp_path, path)
+            self.evict()
+
+    def evict(self):
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.cache_dir):
+                if name.endswith('.parquet'):
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                    entries.append((stat.st_mtime, stat.st_size, name))
+            total = sum(size for _, size, _ in entries)
+            for _, size, name in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                os.remove(os.path.join(self.cache_dir, name))
+                total -= size
+                self.stats['evictions'] += 1
+
+    def size_bytes(self):
+        return sum(os.path.getsize(os.path.join(self.cache_dir, name))
+                   for name in os.listdir(self.cache_dir) if name.endswith('.parquet'))
+
+    def clear(self):
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.parquet'):
+                os.remove(os.path.join(self.cache_dir, name))
+
+    def report(self):
+        """
+        Returns the cache statistics, including the hit rate and the current size on disk.
+        """
+        lookups = self.stats['hits'] + self.stats['misses']
+        return {**self.stats,
+                'hit_rate': self.stats['hits'] / lookups if lookups else 0.0,
+                'size_bytes': self.size_bytes()}
@@ -0,0 +1,182 @@
+import datetime
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+
+import pandas as pd
+
+from .query_cache import normalize_sql
+
+
+###################################
+# Per-query instrumentation used by `data_utils.run_query`
+###################################
+# When a profiler is set (`data_utils.set_query_profiler`), every query of the pipeline emits one
+# JSON record with:
+#   stage                   the pipeline step (outermost function of `scripts/`) that issued the query
+#   call_site               the function that called `run_query` / `run_query_batches`, e.g. 'src/data/sql2df.py:SOFA_calculate'
+#   wall_time_s             time spent executing (or reading the cached result of) the query
+#   rows, result_bytes      size of the result (in-memory footprint of the DataFrame)
+#   bytes_scanned_estimate  bytes the engine would scan, from a dry run (BigQuery only, else null)
+# Records are kept in memory and optionally appended to a JSON-lines log, so runs can be compared
+# (e.g. to catch a regression after a query was edited) with `load_query_log` and `query_report`.
+
+# Repository root: frames outside of it (libraries, threading) are never call sites or stages
+_REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+_SCRIPTS_DIR = os.path.join(_REPO_ROOT, 'scripts')
+# Query plumbing modules, skipped when looking for the call site
+_QUERY_MODULES = {os.path.join(_REPO_ROOT, 'src', 'data', f'{name}.py')
+                  for name in ['data_utils', 'query_profiler', 'query_cache', 'query_backend']}
+
+
+def query_hash(query):
+    """
+    Short identifier of a query (comments and whitespace ignored), to follow one query across runs.
+    """
+    return hashlib.sha256(normalize_sql(query).encode('utf-8')).hexdigest()[:16]
+
+
+def result_bytes(df):
+    """
+    In-memory footprint of a query result, including the Python objects of text columns.
+    """
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def call_context():
+    """
+    Inspects the call stack of the current thread.
+
+    Returns:
+    - dict: 'call_site' (innermost function outside the query modules, as '<path relative to the repository>:<function>'),
+            'line' (its line number) and 'stage' (outermost function defined in `scripts/`,
+            or the call site when the query was not issued by a pipeline script).
+    """
+    frame = sys._getframe(1)
+    call_site, line, stage = None, None, None
+    while frame is not None:
+        path = os.path.abspath(frame.f_code.co_filename)
+        if call_site is None and path not in _QUERY_MODULES and not path.startswith(_REPO_ROOT):
+            # Query issued from outside the repository (e.g. a notebook cell)
+            call_site, line = f'{os.path.basename(path)}:{frame.f_code.co_name}', frame.f_lineno
+        if path.startswith(_REPO_ROOT) and path not in _QUERY_MODULES:
+            name = f'{os.path.relpath(path, _REPO_ROOT)}:{frame.f_code.co_name}'
+            if call_site is None:
+                call_site, line = name, frame.f_lineno
+            if path.startswith(_SCRIPTS_DIR) and frame.f_code.co_name != '<module>':
+                stage = frame.f_code.co_name
+        frame = frame.f_back
+    return {'stage': stage or call_site, 'call_site': call_site, 'line': line}
+
+
+class QueryProfiler:
+    """
+    Collects one record per executed query (see the module notes for the fields).
+
+    Args:
+    - log_path (str, optional): JSON-lines file the records are appended to (one JSON object per line).
+    - dry_run (bool, optional): Also estimate the bytes scanned by each query with a dry run
+                                (an extra, free request on BigQuery; ignored by local backends).
+
+    Attributes:
+    - records (list): Records of the queries executed since the profiler was created.
+    """
+    def __init__(self, log_path=None, dry_run=True):
+        self.log_path = log_path
+        self.dry_run = dry_run
+        self.records = []
+        self._lock = threading.Lock()
+
+    def start(self, query, backend, project_id, params, streamed=False):
+        """
+        Starts the record of a query issued from the caller of `data_utils.run_query(_batches)`.
+        """
+        bytes_scanned = None
+        if self.dry_run:
+            try:
+                bytes_scanned = backend.dry_run_bytes(query, project_id, params)
+            except Exception as e:  # instrumentation never fails the pipeline
+                print(f"Dry run failed: {e}")
+        return {
+            'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+            **call_context(),
+            'backend': backend.name,
+            'query_hash': query_hash(query),
+            'params': {name: len(value) if isinstance(value, list) else value for name, value in params.items()},
+            'streamed': streamed,
+            'cache_hit': None,
+            'wall_time_s': 0.0,
+            'rows': 0,
+            'result_bytes': 0,
+            'bytes_scanned_estimate': bytes_scanned,
+        }
+
+    def finish(self, record):
+        """
+        Stores a completed record (and appends it to the log file).
+        """
+        record['wall_time_s'] = round(record['wall_time_s'], 6)
+        with self._lock:
+            self.records.append(record)
+            if self.log_path is not None:
+                with open(self.log_path, 'a') as log_file:
+                    log_file.write(json.dumps(record) + '\n')
+
+    def timed_batches(self, record, batches):
+        """
+        Passes the chunks of a streamed result through, timing only the production of each chunk
+        (not the work of the consumer). The record is stored once every chunk has been consumed.
+        """
+        batches = iter(batches)
+        while True:
+            start = time.perf_counter()
+            try:
+                chunk = next(batches)
+            except StopIteration:
+                record['wall_time_s'] += time.perf_counter() - start
+                break
+            record['wall_time_s'] += time.perf_counter() - start
+            record['rows'] += len(chunk)
+            record['result_bytes'] += result_bytes(chunk)
+            yield chunk
+        self.finish(record)
+
+    def report(self, by=('stage', 'call_site')):
+        return query_report(self.records, by=by)
+
+
+def load_query_log(log_path):
+    """
+    Reads the records of a JSON-lines query log.
+    """
+    with open(log_path) as log_file:
+        return [json.loads(line) for line in log_file if line.strip()]
+
+
+def query_report(records, by=('stage', 'call_site')):
+    """
+    Aggregates query records per stage and call site (or any other record fields in `by`).
+
+    Returns:
+    - DataFrame: calls, cache hits, total wall time, rows, result bytes and estimated scanned bytes
+                 per group, sorted by decreasing wall time.
+    """
+    by = list(by)
+    columns = ['calls', 'cache_hits', 'wall_time_s', 'rows', 'result_bytes', 'bytes_scanned_estimate']
+    if not records:
+        return pd.DataFrame(columns=by + columns)
+    df = pd.DataFrame(records)
+    df['calls'] = 1
+    df['cache_hits'] = (df['cache_hit'] == True).astype(int)
+    df['bytes_scanned_estimate'] = pd.to_numeric(df['bytes_scanned_estimate'])
+    report = df.groupby(by, dropna=False).agg(
+        calls=('calls', 'sum'),
+        cache_hits=('cache_hits', 'sum'),
+        wall_time_s=('wall_time_s', 'sum'),
+        rows=('rows', 'sum'),
+        result_bytes=('result_bytes', 'sum'),
+        bytes_scanned_estimate=('bytes_scanned_estimate', lambda x: x.sum(min_count=1)))
+    return report.sort_values('wall_time_s', ascending=False).reset_index()
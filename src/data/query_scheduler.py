@@ -0,0 +1,68 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+###################################
+# Concurrent execution of independent extraction steps
+###################################
+# The pipeline stages pull several independent tables (demographics, diagnoses, ventilation,
+# antibiotics, blood cultures, SOFA, vitals, FiO2). Queries spend their time waiting on the
+# query engine, so they are submitted to a thread pool and the stage functions wait on the
+# returned futures: the wall-clock time of a cold build approaches the slowest query
+# instead of the sum of all of them.
+
+
+class QueryScheduler:
+    """
+    Thread pool running independent extraction steps concurrently.
+
+    Args:
+    - max_workers (int, optional): Maximum number of steps (queries) running at the same time.
+
+    Notes:
+    - A step submitted from inside another running step is executed immediately in the calling thread,
+      so nested stages never wait on a saturated pool (no deadlock).
+    """
+    def __init__(self, max_workers=4):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='query')
+        self._local = threading.local()
+
+    def _run(self, fn, args, kwargs):
+        self._local.in_worker = True
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self._local.in_worker = False
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Schedules `fn(*args, **kwargs)` and returns a concurrent.futures.Future with its result.
+        """
+        if getattr(self._local, 'in_worker', False):
+            future = Future()
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+            return future
+        return self._executor.submit(self._run, fn, args, kwargs)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+# Scheduler shared by the pipeline stages
+_scheduler = QueryScheduler()
+
+def get_scheduler():
+    return _scheduler
+
+def set_max_concurrent_queries(max_workers):
+    """
+    Sets the maximum number of extraction steps run concurrently by the pipeline stages.
+    Use 1 to run every step sequentially.
+    """
+    global _scheduler
+    _scheduler.shutdown(wait=True)
+    _scheduler = QueryScheduler(max_workers=max_workers)
@@ -0,0 +1,435 @@
+import numpy as np
+import pandas as pd
+
+from .data_utils import run_query, id_filter, normalize_query_params
+
+
+###################################
+# Local vectorized SOFA engine
+###################################
+# Computes the same hourly modified SOFA table as `sql2df.SOFA_calculate` with NumPy/pandas,
+# instead of running the range joins of the SQL query inside the query engine.
+#   * Input tables are fetched with plain filtered scans (no joins), restricted to the cohort when
+#     `hadm_ids` is given. They may come from BigQuery or from local files (LocalMimicBackend).
+#   * "Event within hour" joins (starttime < charttime <= endtime) use `merge_asof` on the sorted hourly grid.
+#   * "Hour within interval" joins (vasopressor doses, ventilation) are sort-based as well; the rare ICU stays
+#     whose intervals overlap fall back to an explicit join so that every match is kept, as in SQL.
+#   * The 24-hour window (ROWS BETWEEN 24 PRECEDING AND 0 FOLLOWING, i.e. 25 rows) is a rolling max
+#     computed by doubling, and `hr >= 0` is applied after the windows, as in the query.
+#   * Incremental updates: only the hours from a per-icustay start hour onward are recomputed. The hourly
+#     components have no memory, so the grid only needs to start 24 hours earlier to complete the windows,
+#     and the input tables are only read from the start of that grid onward (per-icustay lower bounds).
+# NULL semantics follow SQL: a comparison with a missing value is never true, and a component is
+# missing only if all of its inputs are missing.
+
+_MEANBP_ITEMIDS = [456, 52, 6702, 443, 220052, 220181, 225312]
+_VASOPRESSORS = ['epinephrine', 'norepinephrine', 'dopamine', 'dobutamine']
+_COMPONENTS = ['respiration', 'coagulation', 'liver', 'cardiovascular', 'renal']
+
+
+def _lower_bound_filter(column, key, bounds, prefix='AND'):
+    """
+    Returns the SQL condition keeping the rows whose `column` is at or after the lower bound of their `key`
+    (`bounds`: {key: bound}, an hour or a time); the rows of the other keys are all kept.
+    Empty string if there is no bound.
+    e.g. _lower_bound_filter('hr', 'icustay_id', {200001: 12})
+         -> "AND CASE icustay_id WHEN 200001 THEN hr >= 12 ELSE TRUE END"
+    """
+    if bounds is None or len(bounds) == 0:
+        return ''
+    cases = ' '.join(f"WHEN {int(key_value)} THEN {column} >= {_sql_literal(bound)}" for key_value, bound in bounds.items())
+    return f"{prefix} CASE {key} {cases} ELSE TRUE END"
+
+
+def _sql_literal(value):
+    if isinstance(value, (pd.Timestamp, np.datetime64)):
+        return f"DATETIME '{pd.Timestamp(value).isoformat(sep=' ')}'"
+    return str(int(value))
+
+
+def load_sofa_tables(project_id, hadm_ids=None, from_hours=None):
+    """
+    Fetches the tables used by the SOFA calculation with filtered scans (no joins).
+
+    Args:
+    - project_id (str): The Google Cloud project ID (ignored by the local backend).
+    - hadm_ids (list-like, optional): Restricts every table to these hospital admissions.
+    - from_hours (Series, optional): {icustay_id: hr}, see `calculate_sofa`. For these ICU stays only the hours
+      from hr - 24 onward (the start of the window of hour hr), and the events and intervals reaching into these
+      hours, are read.
+
+    Returns:
+    - dict: {table name: DataFrame}, the input of `calculate_sofa`.
+    """
+    tables = {}
+    tables['icustays'] = run_query(f"""
+        SELECT hadm_id, icustay_id
+        FROM `physionet-data.mimiciii_clinical.icustays`
+        {id_filter('hadm_id', 'hadm_ids', hadm_ids, prefix='WHERE')}
+        """, project_id, params={'hadm_ids': hadm_ids})
+    # Tables without hadm_id are restricted by the cohort's ICU stays
+    icustay_ids = tables['icustays']['icustay_id'] if hadm_ids is not None else None
+    params = {'hadm_ids': hadm_ids, 'icustay_ids': icustay_ids}
+    where = 'WHERE' if icustay_ids is None else 'AND'
+
+    # Incremental updates: hourly grid from 24 hours before the first recomputed hour
+    grid_from = None if from_hours is None else from_hours - 24
+    tables['icustay_hours'] = run_query(f"""
+        SELECT icustay_id, hr, endtime
+        FROM `physionet-data.mimiciii_derived.icustay_hours`
+        {id_filter('icustay_id', 'icustay_ids', icustay_ids, prefix='WHERE')}
+        {_lower_bound_filter('hr', 'icustay_id', grid_from, prefix=where)}
+        """, project_id, params=params)
+    # ... and the events and intervals from the start of that grid (start of its first hour) onward
+    if grid_from is None:
+        time_from = hadm_time_from = None
+    else:
+        hours = tables['icustay_hours']
+        first_endtime = pd.to_datetime(hours['endtime']).groupby(hours['icustay_id']).min()
+        time_from = first_endtime[first_endtime.index.isin(grid_from.index)] - pd.Timedelta(hours=1)
+        # Admissions are bounded only if all their ICU stays are
+        stays = tables['icustays'].assign(time_from=tables['icustays']['icustay_id'].map(time_from))
+        is_bounded = stays['time_from'].notna().groupby(stays['hadm_id']).all()
+        hadm_time_from = stays.groupby('hadm_id')['time_from'].min()[is_bounded]
+
+    tables['chartevents'] = run_query(f"""
+        SELECT icustay_id, charttime, valuenum
+        FROM `physionet-data.mimiciii_clinical.chartevents`
+        WHERE (error IS NULL OR error != 1)
+        AND itemid IN ({', '.join(str(itemid) for itemid in _MEANBP_ITEMIDS)})
+        AND valuenum > 0 AND valuenum < 300
+        {id_filter('hadm_id', 'hadm_ids', hadm_ids)}
+        {_lower_bound_filter('charttime', 'icustay_id', time_from)}
+        """, project_id, params=params)
+    tables['pivoted_lab'] = run_query(f"""
+        SELECT hadm_id, charttime, bilirubin, creatinine, platelet
+        FROM `physionet-data.mimiciii_derived.pivoted_lab`
+        {id_filter('hadm_id', 'hadm_ids', hadm_ids, prefix='WHERE')}
+        {_lower_bound_filter('charttime', 'hadm_id', hadm_time_from, prefix=where)}
+        """, project_id, params=params)
+    tables['pivoted_bg_art'] = run_query(f"""
+        SELECT icustay_id, charttime, pao2fio2ratio
+        FROM `physionet-data.mimiciii_derived.pivoted_bg_art`
+        {id_filter('icustay_id', 'icustay_ids', icustay_ids, prefix='WHERE')}
+        {_lower_bound_filter('charttime', 'icustay_id', time_from, prefix=where)}
+        """, project_id, params=params)
+    # Intervals are needed if they end after the start of the grid
+    tables['ventilation_durations'] = run_query(f"""
+        SELECT icustay_id, starttime, endtime
+        FROM `physionet-data.mimiciii_derived.ventilation_durations`
+        {id_filter('icustay_id', 'icustay_ids', icustay_ids, prefix='WHERE')}
+        {_lower_bound_filter('endtime', 'icustay_id', time_from, prefix=where)}
+        """, project_id, params=params)
+    for drug in _VASOPRESSORS:
+        tables[f'{drug}_dose'] = run_query(f"""
+            SELECT icustay_id, starttime, endtime, vaso_rate
+            FROM `physionet-data.mimiciii_derived.{drug}_dose`
+            {id_filter('icustay_id', 'icustay_ids', icustay_ids, prefix='WHERE')}
+            {_lower_bound_filter('endtime', 'icustay_id', time_from, prefix=where)}
+            """, project_id, params=params)
+    return tables
+
+
+def _to_datetime(df, columns):
+    df = df.copy()
+    for column in columns:
+        df[column] = pd.to_datetime(df[column])
+    return df
+
+
+def _events_in_hours(co, events, key, value_columns):
+    """
+    Assigns every event to the hour (starttime, endtime] of the hourly grid `co` it falls in,
+    matching on `key`. Returns the events with the row position `co_row` of their hour.
+    """
+    grid = co[[key, 'endtime']].assign(co_row=np.arange(len(co)))
+    if key == 'hadm_id':
+        # The grids of several ICU stays of the same admission may overlap: match each ICU stay separately
+        events = events.merge(co[['hadm_id', 'icustay_id']].drop_duplicates(), on='hadm_id')
+        grid = co[['icustay_id', 'endtime']].assign(co_row=np.arange(len(co)))
+        key = 'icustay_id'
+    events = events.dropna(subset=[key, 'charttime'])
+    events = events.astype({key: grid[key].dtype}).sort_values('charttime', kind='stable')
+    grid = grid.sort_values('endtime', kind='stable')
+    # First hour ending at or after the event ...
+    matched = pd.merge_asof(events, grid, left_on='charttime', right_on='endtime', by=key, direction='forward')
+    # ... that also started before the event
+    matched = matched[matched['charttime'] > matched['endtime'] - pd.Timedelta(hours=1)]
+    return matched[['co_row'] + value_columns].astype({'co_row': int})
+
+
+def _has_overlaps(intervals):
+    """
+    True for the ICU stays whose intervals (sorted by starttime) overlap.
+    """
+    previous_end = intervals.groupby('icustay_id')['endtime'].shift()
+    overlap = (intervals['starttime'] < previous_end)
+    return overlap.groupby(intervals['icustay_id']).transform('any')
+
+
+def _hours_in_intervals(co, intervals):
+    """
+    Left join of the hourly grid with the dose intervals (starttime < endtime_of_hour <= endtime), on icustay_id.
+    Returns (co_row, vaso_rate) pairs: one row per match, or one row with a missing rate if no interval matches.
+    """
+    intervals = intervals.dropna(subset=['icustay_id', 'starttime', 'endtime'])
+    intervals = intervals.astype({'icustay_id': co['icustay_id'].dtype})
+    intervals = intervals.sort_values(['icustay_id', 'starttime'], kind='stable').reset_index(drop=True)
+    overlapping = _has_overlaps(intervals)
+    hours = co[['icustay_id', 'endtime']].assign(co_row=np.arange(len(co)))
+
+    # Non-overlapping intervals: at most one match, the last interval starting before the hour ends
+    simple = intervals[~overlapping].sort_values('starttime', kind='stable')
+    matched = pd.merge_asof(hours.sort_values('endtime', kind='stable'), simple.rename(columns={'endtime': 'dose_endtime'}),
+                            left_on='endtime', right_on='starttime', by='icustay_id',
+                            direction='backward', allow_exact_matches=False)
+    matched = matched[matched['endtime'] <= matched['dose_endtime']][['co_row', 'vaso_rate']]
+
+    # Overlapping intervals: explicit join restricted to these ICU stays
+    overlap = intervals[overlapping]
+    if len(overlap) > 0:
+        joined = hours.merge(overlap, on='icustay_id', suffixes=('', '_dose'))
+        joined = joined[(joined['endtime'] > joined['starttime']) & (joined['endtime'] <= joined['endtime_dose'])]
+        matched = pd.concat([matched, joined[['co_row', 'vaso_rate']]], ignore_index=True)
+
+    # Hours without any interval keep a single row with a missing rate (left join)
+    missing = pd.DataFrame({'co_row': np.setdiff1d(np.arange(len(co)), matched['co_row'].to_numpy()),
+                            'vaso_rate': np.nan})
+    return pd.concat([matched, missing], ignore_index=True).sort_values('co_row', kind='stable')
+
+
+def _is_ventilated(bg, vd):
+    """
+    True for the blood gases taken during a ventilation period (vd.starttime <= charttime <= vd.endtime).
+    """
+    if len(bg) == 0:
+        return np.zeros(0, dtype=bool)
+    vd = vd.dropna(subset=['icustay_id', 'starttime', 'endtime'])
+    vd = vd.astype({'icustay_id': bg['icustay_id'].dtype}).sort_values(['icustay_id', 'starttime'], kind='stable')
+    # Latest end of all the periods started so far: a blood gas is covered iff it is before that end
+    vd = vd.assign(max_endtime=vd.groupby('icustay_id')['endtime'].cummax()).sort_values('starttime', kind='stable')
+    bg = bg[['icustay_id', 'charttime']].assign(bg_row=np.arange(len(bg))).sort_values('charttime', kind='stable')
+    matched = pd.merge_asof(bg, vd[['icustay_id', 'starttime', 'max_endtime']],
+                            left_on='charttime', right_on='starttime', by='icustay_id', direction='backward')
+    ventilated = np.zeros(len(bg), dtype=bool)
+    ventilated[matched['bg_row'].to_numpy()] = (matched['charttime'] <= matched['max_endtime']).to_numpy()
+    return ventilated
+
+
+def _group_reduce(co_len, rows, values, how):
+    """
+    Per-hour min/max of `values` (NaN ignored); NaN for the hours without any value.
+    """
+    result = np.full(co_len, np.nan)
+    keep = ~np.isnan(values)
+    if keep.any():
+        reduced = pd.Series(values[keep]).groupby(rows[keep]).agg(how)
+        result[reduced.index.to_numpy()] = reduced.to_numpy()
+    return result
+
+
+def _rolling_max(values, position, window):
+    """
+    Max over the last `window` rows of each group (NaN ignored), where `position` is the row
+    position within its group. Uses log2(window) vectorized doubling steps.
+    """
+    result, span = values.copy(), 1
+    while span * 2 <= window:
+        shifted = np.full_like(result, np.nan)
+        shifted[span:] = result[:-span]
+        result = np.where(position >= span, np.fmax(result, shifted), result)
+        span *= 2
+    rest = window - span
+    if rest > 0:
+        shifted = np.full_like(result, np.nan)
+        shifted[rest:] = result[:-rest]
+        result = np.where(position >= rest, np.fmax(result, shifted), result)
+    return result
+
+
+def _score(conditions, null_mask):
+    """
+    Evaluates a SQL CASE: the score of the first true condition, NULL if `null_mask`, 0 otherwise.
+    """
+    choices = [score for score, _ in conditions]
+    result = np.select([condition for _, condition in conditions], choices, default=0).astype(float)
+    # `null_mask` only applies when no earlier condition was true
+    any_true = np.logical_or.reduce([condition for _, condition in conditions])
+    result[~any_true & null_mask] = np.nan
+    return result
+
+
+def calculate_sofa(tables, hadm_ids=None, from_hours=None):
+    """
+    Computes the hourly modified SOFA score (without GCS and urine output) from the input tables.
+    The result has the same rows and columns as `sql2df.SOFA_calculate`.
+
+    Args:
+    - tables (dict): Input tables, as returned by `load_sofa_tables`.
+    - hadm_ids (list-like, optional): Restricts the hourly grid to these hospital admissions.
+    - from_hours (Series, optional): {icustay_id: hr}. For these ICU stays only the hours >= hr are returned
+      (the windows are computed from 24 hours earlier, so the returned rows equal those of a full computation).
+
+    Returns:
+    - DataFrame: One row per ICU stay hour (hr >= 0), sorted by hadm_id, icustay_id and hr.
+    """
+    # Hourly grid (co)
+    co = tables['icustay_hours'].merge(tables['icustays'][['hadm_id', 'icustay_id']], on='icustay_id')
+    if hadm_ids is not None:
+        co = co[co['hadm_id'].isin(normalize_query_params({'ids': hadm_ids})['ids'])]
+    if from_hours is not None:
+        # The 24 preceding hours are needed to complete the windows of the first recomputed hour
+        first_hr = co['icustay_id'].map(from_hours)
+        co = co[first_hr.isna() | (co['hr'] >= first_hr - 24)]
+    co = _to_datetime(co, ['endtime'])
+    co = co.sort_values(['icustay_id', 'hr'], kind='stable').reset_index(drop=True)
+    co.insert(3, 'starttime', co['endtime'] - pd.Timedelta(hours=1))
+    co = co[['hadm_id', 'icustay_id', 'hr', 'starttime', 'endtime']]
+    n = len(co)
+
+    # Minimum mean blood pressure per chart time (bp)
+    bp = _to_datetime(tables['chartevents'], ['charttime'])
+    bp = bp.groupby(['icustay_id', 'charttime'], as_index=False)['valuenum'].min().rename(columns={'valuenum': 'meanbp_min'})
+    # Aggregates of the events within each hour (mini_agg)
+    bp = _events_in_hours(co, bp, 'icustay_id', ['meanbp_min'])
+    labs = _events_in_hours(co, _to_datetime(tables['pivoted_lab'], ['charttime']), 'hadm_id', ['bilirubin', 'creatinine', 'platelet'])
+    bg = _to_datetime(tables['pivoted_bg_art'], ['charttime']).dropna(subset=['icustay_id', 'charttime']).reset_index(drop=True)
+    bg['ventilated'] = _is_ventilated(bg, _to_datetime(tables['ventilation_durations'], ['starttime', 'endtime']))
+    bg = _events_in_hours(co, bg, 'icustay_id', ['pao2fio2ratio', 'ventilated'])
+
+    def reduce(events, column, how, mask=None):
+        events = events if mask is None else events[mask]
+        return _group_reduce(n, events['co_row'].to_numpy(), events[column].to_numpy(dtype=float), how)
+    scorecomp = co.copy()
+    scorecomp['pao2fio2ratio_novent'] = reduce(bg, 'pao2fio2ratio', 'min', ~bg['ventilated'].astype(bool))
+    scorecomp['pao2fio2ratio_vent'] = reduce(bg, 'pao2fio2ratio', 'min', bg['ventilated'].astype(bool))
+
+    # Vasopressor rates (one row per matching dose interval, as with the SQL left joins)
+    scorecomp['co_row'] = np.arange(n)
+    for drug in _VASOPRESSORS:
+        doses = _hours_in_intervals(co, _to_datetime(tables[f'{drug}_dose'], ['starttime', 'endtime']))
+        scorecomp = scorecomp.merge(doses.rename(columns={'vaso_rate': f'rate_{drug}'}), on='co_row', how='left', sort=False)
+    rows = scorecomp['co_row'].to_numpy()
+    scorecomp['meanbp_min'] = reduce(bp, 'meanbp_min', 'min')[rows]
+    scorecomp['bilirubin_max'] = reduce(labs, 'bilirubin', 'max')[rows]
+    scorecomp['creatinine_max'] = reduce(labs, 'creatinine', 'max')[rows]
+    scorecomp['platelet_min'] = reduce(labs, 'platelet', 'min')[rows]
+    scorecomp = scorecomp.drop(columns='co_row')
+
+    # Component scores (scorecalc)
+    s = {column: scorecomp[column].to_numpy(dtype=float) for column in scorecomp.columns
+         if column.startswith(('pao2fio2ratio', 'rate_')) or column.endswith(('_min', '_max'))}
+    scorecomp['respiration'] = _score([
+        (4, s['pao2fio2ratio_vent'] < 100), (3, s['pao2fio2ratio_vent'] < 200),
+        (2, s['pao2fio2ratio_novent'] < 300), (1, s['pao2fio2ratio_novent'] < 400)],
+        np.isnan(s['pao2fio2ratio_vent']) & np.isnan(s['pao2fio2ratio_novent']))
+    scorecomp['coagulation'] = _score([
+        (4, s['platelet_min'] < 20), (3, s['platelet_min'] < 50),
+        (2, s['platelet_min'] < 100), (1, s['platelet_min'] < 150)],
+        np.isnan(s['platelet_min']))
+    scorecomp['liver'] = _score([
+        (4, s['bilirubin_max'] >= 12.0), (3, s['bilirubin_max'] >= 6.0),
+        (2, s['bilirubin_max'] >= 2.0), (1, s['bilirubin_max'] >= 1.2)],
+        np.isnan(s['bilirubin_max']))
+    scorecomp['cardiovascular'] = _score([
+        (4, (s['rate_dopamine'] > 15) | (s['rate_epinephrine'] > 0.1) | (s['rate_norepinephrine'] > 0.1)),
+        (3, (s['rate_dopamine'] > 5) | (s['rate_epinephrine'] <= 0.1) | (s['rate_norepinephrine'] <= 0.1)),
+        (2, (s['rate_dopamine'] > 0) | (s['rate_dobutamine'] > 0)),
+        (1, s['meanbp_min'] < 70)],
+        np.logical_and.reduce([np.isnan(s[c]) for c in ['meanbp_min', 'rate_dopamine', 'rate_dobutamine',
+                                                         'rate_epinephrine', 'rate_norepinephrine']]))
+    scorecomp['renal'] = _score([
+        (4, s['creatinine_max'] >= 5.0), (3, s['creatinine_max'] >= 3.5),
+        (2, s['creatinine_max'] >= 2.0), (1, s['creatinine_max'] >= 1.2)],
+        np.isnan(s['creatinine_max']))
+
+    # 24-hour windows (score_final): max over the current and 24 preceding rows of the ICU stay
+    position = scorecomp.groupby('icustay_id').cumcount().to_numpy()
+    scorecomp['sofa_24hours'] = 0
+    for component in _COMPONENTS:
+        scorecomp[f'{component}_24hours'] = np.nan_to_num(
+            _rolling_max(scorecomp[component].to_numpy(dtype=float), position, 25), nan=0).astype(int)
+        scorecomp['sofa_24hours'] += scorecomp[f'{component}_24hours']
+        values = scorecomp[component].to_numpy(dtype=float)
+        scorecomp[component] = pd.arrays.IntegerArray(np.nan_to_num(values).astype('int64'), np.isnan(values))
+    scorecomp['sofa_24hours'] = scorecomp.pop('sofa_24hours')
+
+    keep = scorecomp['hr'] >= 0
+    if from_hours is not None:
+        first_hr = scorecomp['icustay_id'].map(from_hours)
+        keep &= first_hr.isna() | (scorecomp['hr'] >= first_hr)
+    sofa_df = scorecomp[keep]
+    return sofa_df.sort_values(['hadm_id', 'icustay_id', 'hr'], kind='stable').reset_index(drop=True)
+
+
+def SOFA_calculate_local(project_id, saved_path=None, hadm_ids=None, from_hours=None):
+    """
+    Drop-in alternative to `sql2df.SOFA_calculate`: fetches the input tables with filtered scans and
+    computes the hourly modified SOFA score locally (see `calculate_sofa`).
+    """
+    tables = load_sofa_tables(project_id, hadm_ids=hadm_ids, from_hours=from_hours)
+    sofa_df = calculate_sofa(tables, hadm_ids=hadm_ids, from_hours=from_hours)
+    if saved_path is not None:
+        print("Saved SOFA score at", saved_path)
+        sofa_df.to_csv(saved_path)
+    return sofa_df
+
+
+def sofa_watermarks(sofa_df):
+    """
+    Returns the watermark of every ICU stay of a SOFA table: the last hour (hr) it contains.
+    """
+    return sofa_df.groupby('icustay_id', as_index=False)['hr'].max().rename(columns={'hr': 'watermark_hr'})
+
+
+def recompute_from_hours(watermarks, icustay_ids):
+    """
+    First hour to recompute for each updated ICU stay: its watermark minus 24 hours, since events
+    arriving late may change the hours before the watermark and `sofa_24hours` looks 24 hours back.
+    ICU stays without a watermark (new stays) are recomputed entirely.
+
+    Returns:
+    - Series: {icustay_id: first hour to recompute}, for the ICU stays with a watermark.
+    """
+    watermarks = watermarks[watermarks['icustay_id'].isin(icustay_ids)]
+    return (watermarks.set_index('icustay_id')['watermark_hr'] - 24).rename('from_hr')
+
+
+def merge_sofa_update(sofa_df, update_df, from_hours):
+    """
+    Merges recomputed rows into a stored SOFA table: for the updated ICU stays, the stored rows from
+    `from_hours` onward (all rows for new stays) are replaced by the rows of `update_df`.
+    """
+    updated = sofa_df['icustay_id'].isin(update_df['icustay_id']) | sofa_df['icustay_id'].isin(from_hours.index)
+    first_hr = sofa_df['icustay_id'].map(from_hours)
+    replaced = updated & (first_hr.isna() | (sofa_df['hr'] >= first_hr))
+    merged = pd.concat([sofa_df[~replaced], update_df], ignore_index=True)
+    return merged.sort_values(['hadm_id', 'icustay_id', 'hr'], kind='stable').reset_index(drop=True)
+
+
+def validate_against_sql(project_id, hadm_ids=None):
+    """
+    Runs both `sql2df.SOFA_calculate` and `SOFA_calculate_local` and compares them row by row.
+
+    Returns:
+    - DataFrame: The rows (of the SQL result) where at least one column differs; empty if the tables are identical.
+
+    Notes:
+    - Hours matching several overlapping dose intervals appear several times (one row per interval, as in SQL);
+      the order of such tied rows, and therefore their 24-hour windows, is not defined by the query.
+    """
+    from .sql2df import SOFA_calculate
+    sql_df = SOFA_calculate(project_id, hadm_ids=hadm_ids)
+    local_df = SOFA_calculate_local(project_id, hadm_ids=hadm_ids)
+    if list(sql_df.columns) != list(local_df.columns) or len(sql_df) != len(local_df):
+        raise ValueError(f"Shape mismatch: SQL {sql_df.shape} vs local {local_df.shape}")
+    differs = np.zeros(len(sql_df), dtype=bool)
+    for column in sql_df.columns:
+        if column in ['starttime', 'endtime']:
+            sql_values, local_values = pd.to_datetime(sql_df[column]).to_numpy(), pd.to_datetime(local_df[column]).to_numpy()
+            differs |= sql_values != local_values
+        else:
+            sql_values = pd.to_numeric(sql_df[column]).to_numpy(dtype=float, na_value=np.nan)
+            local_values = pd.to_numeric(local_df[column]).to_numpy(dtype=float, na_value=np.nan)
+            differs |= ~np.isclose(sql_values, local_values, equal_nan=True)
+    return sql_df[differs]
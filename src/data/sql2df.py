@@ -5,11 +5,16 @@ import numpy as np
 import pandas as pd
 from datetime import datetime
 
-from .data_utils import run_query
+from .data_utils import run_query, run_query_batches, write_batches_to_csv, id_filter
 
 ###################################
 # Raw DATA
 ###################################
+# Cohort-scoped queries:
+#   Every function below accepts an optional ID set (`hadm_ids`, e.g. `trum_cohort_info_df.hadm_id`).
+#   The IDs are bound as a query parameter (`IN UNNEST(@hadm_ids)`) so the filter is applied inside
+#   the engine: only the cohort's rows are scanned, transferred and merged.
+#   If no ID set is given, the query covers all of MIMIC-III (original behavior).
 
 
 ####################### Demographics ##################################################################
@@ -29,8 +34,9 @@ from .data_utils import run_query
 #  > 'icustay_id', 'intime', 'outtime', 'los_icu_hours', 'icustay_seq', 'first_icu_stay' (T/F)
 ########################################################################################################
 
-def demog_sql2df(project_id, saved_path=None):
-  demog_query = """
+def demog_sql2df(project_id, saved_path=None, hadm_ids=None):
+  # Scoping uses QUALIFY, i.e. it is applied after the DENSE_RANK windows, so hospstay_seq/icustay_seq are unchanged.
+  demog_query = f"""
   SELECT ie.subject_id, ie.hadm_id, ie.icustay_id
   -- patient level factors
   , pat.gender, pat.dod
@@ -120,9 +126,10 @@ def demog_sql2df(project_id, saved_path=None):
   INNER JOIN `physionet-data.mimiciii_clinical.patients` pat
       ON ie.subject_id = pat.subject_id
   WHERE adm.has_chartevents_data = 1
+  {id_filter('ie.hadm_id', 'hadm_ids', hadm_ids, prefix='QUALIFY')}
   ORDER BY ie.subject_id, adm.admittime, ie.intime;
   """
-  demog_df = run_query(demog_query, project_id)
+  demog_df = run_query(demog_query, project_id, params={'hadm_ids': hadm_ids})
   if saved_path != None:
     print("File saved at:", saved_path)
     demog_df.to_csv(saved_path)
@@ -135,9 +142,9 @@ def demog_sql2df(project_id, saved_path=None):
 # A modified version of: https://github.com/MIT-LCP/mimic-code/blob/b9ed7a3d22a85dd95a50797e15bd24d566bce337/mimic-iv/concepts/medication/antibiotic.sql#L4
 
 ########################################################################################################
-def abx_sql2df(project_id):
+def abx_sql2df(project_id, hadm_ids=None):
   abx_df = run_query(
-    """
+    f"""
     WITH abx AS (
         SELECT DISTINCT
             gsn
@@ -202,8 +209,9 @@ def abx_sql2df(project_id):
         ON pr.drug = abx.drug
             AND pr.route = abx.route
     WHERE abx.antibiotic = 1
+    {id_filter('pr.hadm_id', 'hadm_ids', hadm_ids)}
     ;
-    """, project_id).drop_duplicates()
+    """, project_id, params={'hadm_ids': hadm_ids}).drop_duplicates()
   return abx_df
 
 ####################### SOFA score ##################################################################
@@ -216,8 +224,10 @@ def abx_sql2df(project_id):
 #   https://github.com/MIT-LCP/mimic-code/blob/main/mimic-iii/concepts/pivot/pivoted_sofa.sql
 
 ########################################################################################################
-def SOFA_calculate(project_id, saved_path=None):
-  sofa_query = """
+def SOFA_calculate(project_id, saved_path=None, hadm_ids=None):
+  # Scoping filters the hourly grid (`co`) and the chartevents scan; the 24-hour windows are computed
+  # per icustay_id, so the scores of the selected admissions are unchanged.
+  sofa_query = f"""
     -- ------------------------------------------------------------------
     -- Title: A modified version of the SOFA(Sequential Organ Failure Assessment) score
     -- This query extracts the sequential organ failure assessment (formally: sepsis-related organ failure assessment).
@@ -257,6 +267,7 @@ def SOFA_calculate(project_id, saved_path=None):
       from `physionet-data.mimiciii_derived.icustay_hours` ih
       INNER JOIN `physionet-data.mimiciii_clinical.icustays` ie
         ON ih.icustay_id = ie.icustay_id
+      {id_filter('ie.hadm_id', 'hadm_ids', hadm_ids, prefix='WHERE')}
     )
     -- get minimum blood pressure FROM `physionet-data.mimiciii_clinical.chartevents`
     , bp as
@@ -267,6 +278,7 @@ def SOFA_calculate(project_id, saved_path=None):
       FROM `physionet-data.mimiciii_clinical.chartevents` ce
       -- exclude rows marked as error
       where (ce.error IS NULL OR ce.error != 1)
+      {id_filter('ce.hadm_id', 'hadm_ids', hadm_ids)}
       and ce.itemid in
       (
       -- MEAN ARTERIAL PRESSURE
@@ -481,7 +493,7 @@ def SOFA_calculate(project_id, saved_path=None):
     where hr >= 0
     order by icustay_id, hr;
     """
-  sofa_df = run_query(sofa_query, project_id).sort_values(['hadm_id', 'icustay_id', 'hr']).reset_index(drop=True)
+  sofa_df = run_query(sofa_query, project_id, params={'hadm_ids': hadm_ids}).sort_values(['hadm_id', 'icustay_id', 'hr']).reset_index(drop=True)
   if saved_path is not None:
       print("Saved SOFA score at", saved_path)
       sofa_df.to_csv(saved_path)
@@ -492,7 +504,7 @@ def SOFA_calculate(project_id, saved_path=None):
 # Processed DATA
 ###################################
 
-def ventilation_day_processed(project_id, vent_type=['MechVent'], saved_path=None):
+def ventilation_day_processed(project_id, vent_type=['MechVent'], saved_path=None, hadm_ids=None):
   '''
   Identify the presence of mechanical ventilation
   - Based on source file: [ventilation_classification.sql](https://github.com/MIT-LCP/mimic-code/blob/main/mimic-iii/concepts/durations/ventilation_classification.sql)
@@ -506,15 +518,17 @@ def ventilation_day_processed(project_id, vent_type=['MechVent'], saved_path=Non
               This function only counts the ventilation types within this subset.
               By default, only 'MechVent' will be considered a qualifying ventilation event.
     saved_path: (Optional) path to save the resulting CSV file.
+    hadm_ids: (Optional) hospital admission IDs to restrict the query to.
   '''
   # Identify the presence of a mechanical ventilation using settings
   vent_df = run_query(
-      """
+      f"""
       SELECT i.hadm_id, v.*
       FROM `physionet-data.mimiciii_derived.ventilation_classification` v
       JOIN `physionet-data.mimiciii_clinical.icustays` i
-      ON v.ICUSTAY_ID = i.ICUSTAY_ID;
-      """, project_id)
+      ON v.ICUSTAY_ID = i.ICUSTAY_ID
+      {id_filter('i.hadm_id', 'hadm_ids', hadm_ids, prefix='WHERE')};
+      """, project_id, params={'hadm_ids': hadm_ids})
 
   # Select qualified ventilation event according to vent_type
   vent_df['sum'] = vent_df[vent_type].sum(axis=1)
@@ -535,13 +549,16 @@ def ventilation_day_processed(project_id, vent_type=['MechVent'], saved_path=Non
 # vital_signs & FiO2
 #########
 
-def vital_signs_sql2df(project_id, saved_path=None):
+def vital_signs_sql2df(project_id, saved_path=None, batch_size=None, hadm_ids=None):
   """
   A modified version of pivoted_vital.sql: (https://github.com/MIT-LCP/mimic-code/blob/main/mimic-iii/concepts/pivot/pivoted_vital.sql)
   * add hadm_id to the return table 
 
+  If batch_size is given, the result is streamed instead: an iterator of DataFrame chunks of at most
+  batch_size rows is returned (and written to saved_path as the chunks are consumed).
+  If hadm_ids is given, only these hospital admissions are queried.
   """
-  vs_query = """
+  vs_query = f"""
   -- This query pivots the vital signs a patient's stay (hadm_id)
   -- Vital signs include heart rate, blood pressure, respiration rate, temperature, spo2 and glucose
 
@@ -562,6 +579,7 @@ def vital_signs_sql2df(project_id, saved_path=None):
     -- exclude rows marked as error
     where (ce.error IS NULL OR ce.error != 1)
     and ce.icustay_id IS NOT NULL
+    {id_filter('ce.hadm_id', 'hadm_ids', hadm_ids)}
     and ce.itemid in
     (
     -- HEART RATE
@@ -638,18 +656,25 @@ def vital_signs_sql2df(project_id, saved_path=None):
   order by ce.hadm_id, ce.icustay_id, ce.charttime
   ;
   """
-  vs_df = run_query(vs_query, project_id)
+  if batch_size is not None:
+    batches = run_query_batches(vs_query, project_id, batch_size, params={'hadm_ids': hadm_ids})
+    return write_batches_to_csv(batches, saved_path) if saved_path is not None else batches
+  vs_df = run_query(vs_query, project_id, params={'hadm_ids': hadm_ids})
   if saved_path != None:
     vs_df.to_csv(saved_path)
   return vs_df
 
 
-def fio2_sql2df(project_id, saved_path=None):
+def fio2_sql2df(project_id, saved_path=None, batch_size=None, hadm_ids=None):
   """
   A modified version of pivoted_fio2.sql(https://github.com/MIT-LCP/mimic-code/blob/main/mimic-iii/concepts/pivot/pivoted_fio2.sql)
   * add hadm_id to the return table 
+
+  If batch_size is given, the result is streamed instead: an iterator of DataFrame chunks of at most
+  batch_size rows is returned (and written to saved_path as the chunks are consumed).
+  If hadm_ids is given, only these hospital admissions are queried.
   """
-  query = """
+  query = f"""
   with pvt as
   ( -- begin query that extracts the data
     select le.hadm_id
@@ -668,6 +693,7 @@ def fio2_sql2df(project_id, saved_path=None):
       ELSE valuenum END), 2) AS valuenum
       FROM `physionet-data.mimiciii_clinical.labevents` le
       where le.ITEMID = 50816
+      {id_filter('le.hadm_id', 'hadm_ids', hadm_ids)}
       GROUP BY le.hadm_id, le.charttime
   )
   , stg_fio2 as
@@ -705,6 +731,7 @@ def fio2_sql2df(project_id, saved_path=None):
     and valuenum > 0 and valuenum < 100
     -- exclude rows marked as error
     AND (error IS NULL OR error != 1)
+    {id_filter('hadm_id', 'hadm_ids', hadm_ids)}
     group by hadm_id, charttime
   )
   select *
@@ -718,7 +745,10 @@ def fio2_sql2df(project_id, saved_path=None):
   )
   ORDER BY hadm_id, charttime;
   """
-  fio2_df = run_query(query, project_id)
+  if batch_size is not None:
+    batches = run_query_batches(query, project_id, batch_size, params={'hadm_ids': hadm_ids})
+    return write_batches_to_csv(batches, saved_path) if saved_path is not None else batches
+  fio2_df = run_query(query, project_id, params={'hadm_ids': hadm_ids})
   if saved_path is not None:
     fio2_df.to_csv(saved_path)
   return fio2_df
@@ -0,0 +1,472 @@
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+
+###################################
+# Synthetic MIMIC-III tables for tests and scale runs
+###################################
+# The pipeline can otherwise only be exercised on the real (credentialed) MIMIC-III data.
+# `generate_synthetic_mimic` writes every table read by the pipeline queries
+# (cohort extraction, blood cultures, antibiotics, SOFA inputs, vital signs and FiO2) as Parquet files:
+#   <data_dir>/mimiciii_clinical/<TABLE>.parquet    raw tables, upper-case columns as in the PhysioNet CSVs
+#   <data_dir>/mimiciii_derived/<table>.parquet     mimic-code concepts (icustay_hours, pivoted_vital, ...)
+# which `LocalMimicBackend(data_dir)` reads directly.
+#
+# Each admission gets a role:
+#   'sepsis'     a blood culture >= 72 hours after admission, a >= 4-day antibiotic course started within a day
+#                of it, and an acute worsening of labs / blood gases (SOFA rise >= 2) after it
+#   'infection'  the same blood culture and antibiotic course, without organ dysfunction
+#   'none'       background data only
+# Background values are normal (SOFA components are 0) and background antibiotics are prophylactic or short,
+# so the sepsis labels of the pipeline follow the planted roles. Roles, planted onset times and whether the
+# admission meets the trauma cohort criteria are written to <data_dir>/synthetic_ground_truth.parquet.
+# Tables are generated and written per block of admissions, so memory does not grow with `n_admissions`.
+
+# Column types of the generated tables ('datetime' columns are stored as timestamps)
+_CLINICAL = 'mimiciii_clinical'
+_DERIVED = 'mimiciii_derived'
+_DOSE = {'icustay_id': 'int64', 'starttime': 'datetime', 'endtime': 'datetime', 'vaso_rate': 'float64'}
+TABLE_SCHEMAS = {
+    'PATIENTS': (_CLINICAL, {'SUBJECT_ID': 'int64', 'GENDER': 'str', 'DOB': 'datetime', 'DOD': 'datetime'}),
+    'ADMISSIONS': (_CLINICAL, {
+        'SUBJECT_ID': 'int64', 'HADM_ID': 'int64', 'ADMITTIME': 'datetime', 'DISCHTIME': 'datetime',
+        'DEATHTIME': 'datetime', 'ETHNICITY': 'str', 'HOSPITAL_EXPIRE_FLAG': 'int64', 'HAS_CHARTEVENTS_DATA': 'int64'}),
+    'ICUSTAYS': (_CLINICAL, {
+        'SUBJECT_ID': 'int64', 'HADM_ID': 'int64', 'ICUSTAY_ID': 'int64',
+        'INTIME': 'datetime', 'OUTTIME': 'datetime', 'LOS': 'float64'}),
+    'DIAGNOSES_ICD': (_CLINICAL, {'SUBJECT_ID': 'int64', 'HADM_ID': 'int64', 'SEQ_NUM': 'int64', 'ICD9_CODE': 'str'}),
+    'PRESCRIPTIONS': (_CLINICAL, {
+        'SUBJECT_ID': 'int64', 'HADM_ID': 'int64', 'ICUSTAY_ID': 'Int64', 'STARTDATE': 'datetime', 'ENDDATE': 'datetime',
+        'DRUG_TYPE': 'str', 'DRUG': 'str', 'DRUG_NAME_GENERIC': 'str', 'GSN': 'str', 'ROUTE': 'str'}),
+    'MICROBIOLOGYEVENTS': (_CLINICAL, {
+        'SUBJECT_ID': 'int64', 'HADM_ID': 'int64', 'CHARTDATE': 'datetime', 'CHARTTIME': 'datetime',
+        'SPEC_ITEMID': 'int64', 'SPEC_TYPE_DESC': 'str'}),
+    'CHARTEVENTS': (_CLINICAL, {
+        'SUBJECT_ID': 'int64', 'HADM_ID': 'int64', 'ICUSTAY_ID': 'int64', 'ITEMID': 'int64',
+        'CHARTTIME': 'datetime', 'VALUENUM': 'float64', 'ERROR': 'Int64'}),
+    'icustay_hours': (_DERIVED, {'icustay_id': 'int64', 'hr': 'int64', 'endtime': 'datetime'}),
+    'ventilation_classification': (_DERIVED, {
+        'icustay_id': 'int64', 'charttime': 'datetime',
+        'MechVent': 'int64', 'OxygenTherapy': 'int64', 'Extubated': 'int64', 'SelfExtubated': 'int64'}),
+    'ventilation_durations': (_DERIVED, {
+        'icustay_id': 'int64', 'ventnum': 'int64', 'starttime': 'datetime', 'endtime': 'datetime', 'duration_hours': 'float64'}),
+    'pivoted_lab': (_DERIVED, {
+        'hadm_id': 'int64', 'charttime': 'datetime', 'bilirubin': 'float64', 'creatinine': 'float64', 'platelet': 'float64'}),
+    'pivoted_bg_art': (_DERIVED, {'icustay_id': 'int64', 'charttime': 'datetime', 'pao2fio2ratio': 'float64'}),
+    'epinephrine_dose': (_DERIVED, _DOSE),
+    'norepinephrine_dose': (_DERIVED, _DOSE),
+    'dopamine_dose': (_DERIVED, _DOSE),
+    'dobutamine_dose': (_DERIVED, _DOSE),
+    'pivoted_vital': (_DERIVED, {
+        'icustay_id': 'int64', 'charttime': 'datetime',
+        'HeartRate': 'float64', 'SysBP': 'float64', 'DiasBP': 'float64', 'MeanBP': 'float64',
+        'RespRate': 'float64', 'TempC': 'float64', 'SpO2': 'float64', 'Glucose': 'float64'}),
+    'pivoted_fio2': (_DERIVED, {'icustay_id': 'int64', 'charttime': 'datetime', 'fio2': 'float64'}),
+}
+GROUND_TRUTH_SCHEMA = {'subject_id': 'int64', 'hadm_id': 'int64', 'role': 'str',
+                       'onset_datetime': 'datetime', 'in_trauma_cohort': 'bool'}
+
+# (DRUG, DRUG_NAME_GENERIC, GSN, ROUTE)
+_COURSE_ABX = [
+    ('Vancomycin', 'Vancomycin HCl', '043952', 'IV'),
+    ('Piperacillin-Tazobactam Na', 'Piperacillin-Tazobactam', '062739', 'IV'),
+    ('Cefepime', 'Cefepime HCl', '060085', 'IV'),
+    ('Meropenem', 'Meropenem', '018957', 'IV'),
+    ('Levofloxacin', 'Levofloxacin', '029848', 'IV'),
+    ('Metronidazole', 'Metronidazole', '008906', 'IV'),
+    ('Vancomycin Oral Liquid', 'Vancomycin HCl', '043954', 'PO'),
+]
+_PROPHYLAXIS_ABX = ('CefazoLIN', 'Cefazolin', '009247', 'IV')
+_OTHER_DRUGS = [
+    ('Acetaminophen', 'Acetaminophen', '004489', 'PO'),
+    ('Heparin', 'Heparin Sodium', '006549', 'SC'),
+    ('Docusate Sodium', 'Docusate Sodium', '003009', 'PO'),
+    ('Pantoprazole', 'Pantoprazole Sodium', '027462', 'IV'),
+    ('Insulin', 'Insulin Regular', '016576', 'SC'),
+]
+_OTHER_ICD9 = ['80501', '86500', '8600', '4019', '51881', '2851', '42731', '5849', '2762']
+_ETHNICITY = ['WHITE', 'BLACK/AFRICAN AMERICAN', 'HISPANIC OR LATINO', 'ASIAN', 'UNKNOWN/NOT SPECIFIED', 'OTHER']
+_MAP_ITEMIDS = [220052, 220181, 456, 52]
+_BLOOD_CULTURE = (70012, 'BLOOD CULTURE')
+_OTHER_CULTURES = [(70079, 'URINE'), (70062, 'SPUTUM')]
+_EPOCH = np.datetime64('2100-01-01T00:00', 'm')
+
+
+def load_qualified_ecodes(path=None):
+    """
+    Returns the qualified traumatic injury E-codes in MIMIC's format (e.g. 800.0 -> 'E8000'), as in
+    `cohort_extraction.select_ICDcode_df`. Defaults to supplementary/qualified_traumatic_ICD9_Ecodes.xlsx.
+    """
+    if path is None:
+        repo_path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        path = os.path.join(repo_path, 'supplementary', 'qualified_traumatic_ICD9_Ecodes.xlsx')
+    df_hmc_e = pd.read_excel(path, sheet_name="Ecodes ICD 9")
+    return np.array(sorted({"E" + re.sub(r'\W+', '', str(x)) for x in df_hmc_e["Ecode"]}))
+
+
+def _hours(values):
+    # Float hours -> minute-resolution timedelta64
+    return (np.asarray(values, dtype=float) * 60).round().astype('timedelta64[m]')
+
+def _expand(counts):
+    """
+    For groups of the given sizes, returns (group of each row, position of the row within its group).
+    """
+    counts = np.asarray(counts, dtype=int)
+    owner = np.repeat(np.arange(len(counts)), counts)
+    position = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return owner, position
+
+def _floor_day(times):
+    return times.astype('datetime64[D]').astype('datetime64[m]')
+
+def _frame(table, columns, schemas=TABLE_SCHEMAS):
+    """
+    Builds a DataFrame with the columns and dtypes of `table` (column arrays may be empty).
+    """
+    _, schema = schemas[table] if isinstance(schemas[table], tuple) else (None, schemas[table])
+    df = pd.DataFrame({column: columns[column] for column in schema})
+    for column, column_type in schema.items():
+        if column_type == 'datetime':
+            df[column] = pd.to_datetime(df[column]).astype('datetime64[ns]')
+        elif column_type == 'str':
+            df[column] = df[column].astype(object)
+        else:
+            df[column] = df[column].astype(column_type)
+    return df
+
+
+def _arrow_schema(schema):
+    import pyarrow as pa
+    types = {'int64': pa.int64(), 'Int64': pa.int64(), 'float64': pa.float64(), 'bool': pa.bool_(),
+             'datetime': pa.timestamp('ns'), 'str': pa.string()}
+    return pa.schema([(column, types[column_type]) for column, column_type in schema.items()])
+
+
+def _generate_block(rng, start, n, ecodes, sepsis_prevalence, infection_fraction, trauma_fraction,
+                    ineligible_fraction, event_density, vital_interval_hours):
+    """
+    Generates every table for the admissions start, ..., start + n - 1.
+    Returns {table name: DataFrame} (plus 'ground_truth').
+    """
+    idx = np.arange(start, start + n)
+    subject_id = 10000 + idx
+    hadm_id = 100000 + idx
+
+    # Roles and cohort criteria
+    trauma = rng.random(n) < trauma_fraction
+    ineligible = rng.random(n) < ineligible_fraction
+    reason = rng.integers(0, 3, n)  # failed criterion: 0 age, 1 hospital stay < 48 hours, 2 ventilation < 3 days
+    bad_age, short_stay, short_vent = [ineligible & (reason == r) for r in range(3)]
+    cohort = trauma & ~ineligible
+    u = rng.random(n)
+    septic = cohort & (u < sepsis_prevalence)
+    infected = cohort & (u >= sepsis_prevalence) & (u < sepsis_prevalence + infection_fraction)
+    suspected = septic | infected
+
+    # Hospital and ICU stays
+    admittime = _EPOCH + rng.integers(0, 100 * 365 * 24 * 60, n).astype('timedelta64[m]')
+    icu_offset_h = rng.uniform(0.5, 12, n)
+    icu_los_h = 24 * (3 + rng.gamma(2.0, 2.0, n))
+    icu_los_h[short_stay] = rng.uniform(12, 30, short_stay.sum())
+    icu_los_h[suspected] = np.maximum(icu_los_h[suspected], 180)
+    intime = admittime + _hours(icu_offset_h)
+    outtime = intime + _hours(icu_los_h)
+    # A second, short ICU stay for some admissions
+    second = ~short_stay & (rng.random(n) < 0.1)
+    intime2 = outtime + _hours(rng.uniform(4, 24, n))
+    outtime2 = intime2 + _hours(rng.uniform(12, 48, n))
+    last_out = np.where(second, outtime2, outtime)
+    dischtime = last_out + _hours(np.where(short_stay, rng.uniform(1, 5, n), rng.uniform(6, 120, n)))
+    died = rng.random(n) < 0.05
+    deathtime = np.where(died, dischtime, np.datetime64('NaT'))
+    hospital_los_h = (dischtime - admittime) / np.timedelta64(1, 'h')
+
+    # Sepsis onset (time of the qualifying blood culture): >= 76 h after admission, >= 48 h before ICU discharge
+    onset = admittime + _hours(rng.uniform(76, np.maximum(icu_offset_h + icu_los_h - 48, 77)))
+    onset = np.where(suspected, onset, np.datetime64('NaT'))
+
+    # Demographics (DATETIME_DIFF(intime, dob, YEAR) counts year boundaries: dob is in year(intime) - age)
+    age = rng.integers(19, 89, n)
+    age[bad_age] = rng.choice([15, 16, 17, 91, 93, 95], bad_age.sum())
+    dob_year = pd.DatetimeIndex(intime).year.to_numpy() - age
+    dob = (pd.to_datetime(pd.DataFrame({'year': dob_year, 'month': 1, 'day': 1})).to_numpy().astype('datetime64[m]')
+           + rng.integers(0, 360, n).astype('timedelta64[D]'))
+    tables = {}
+    tables['PATIENTS'] = _frame('PATIENTS', {
+        'SUBJECT_ID': subject_id, 'GENDER': rng.choice(['M', 'F'], n, p=[0.7, 0.3]), 'DOB': dob,
+        'DOD': np.where(died, _floor_day(dischtime), np.datetime64('NaT'))})
+    tables['ADMISSIONS'] = _frame('ADMISSIONS', {
+        'SUBJECT_ID': subject_id, 'HADM_ID': hadm_id, 'ADMITTIME': admittime, 'DISCHTIME': dischtime,
+        'DEATHTIME': deathtime, 'ETHNICITY': rng.choice(_ETHNICITY, n),
+        'HOSPITAL_EXPIRE_FLAG': died.astype(int), 'HAS_CHARTEVENTS_DATA': np.ones(n, dtype=int)})
+
+    # ICU stays (stay table: one row per ICU stay, `adm` is the admission row)
+    stay_adm = np.concatenate([np.arange(n), np.nonzero(second)[0]])
+    stay_id = np.concatenate([200000 + 2 * idx, 200001 + 2 * idx[second]])
+    stay_in = np.concatenate([intime, intime2[second]])
+    stay_out = np.concatenate([outtime, outtime2[second]])
+    order = np.lexsort((stay_in, stay_adm))
+    stay_adm, stay_id, stay_in, stay_out = stay_adm[order], stay_id[order], stay_in[order], stay_out[order]
+    stay_los_h = (stay_out - stay_in) / np.timedelta64(1, 'h')
+    tables['ICUSTAYS'] = _frame('ICUSTAYS', {
+        'SUBJECT_ID': subject_id[stay_adm], 'HADM_ID': hadm_id[stay_adm], 'ICUSTAY_ID': stay_id,
+        'INTIME': stay_in, 'OUTTIME': stay_out, 'LOS': stay_los_h / 24})
+    first_stay_id = 200000 + 2 * idx
+
+    # Diagnoses: qualified E-codes for trauma admissions (some written with 4 characters, e.g. 'E800',
+    # which the cohort extraction pads to 'E8000'), other codes for everyone
+    n_ecodes = np.where(trauma, rng.integers(1, 3, n), 0)
+    n_other = rng.integers(1, 4, n)
+    e_adm, _ = _expand(n_ecodes)
+    e_codes = rng.choice(ecodes, len(e_adm)).astype(object)
+    short = np.array([c.endswith('0') for c in e_codes], dtype=bool) & (rng.random(len(e_adm)) < 0.3)
+    e_codes[short] = [c[:-1] for c in e_codes[short]]
+    o_adm, _ = _expand(n_other)
+    dx_adm = np.concatenate([o_adm, e_adm])
+    dx = pd.DataFrame({'adm': dx_adm, 'code': np.concatenate([rng.choice(_OTHER_ICD9, len(o_adm)), e_codes])})
+    dx = dx.sort_values('adm', kind='stable')
+    tables['DIAGNOSES_ICD'] = _frame('DIAGNOSES_ICD', {
+        'SUBJECT_ID': subject_id[dx['adm']], 'HADM_ID': hadm_id[dx['adm']],
+        'SEQ_NUM': dx.groupby('adm').cumcount().to_numpy() + 1, 'ICD9_CODE': dx['code'].to_numpy()})
+
+    # Hourly grid of each ICU stay (mimic-code icustay_hours: hr from -24 to the ICU discharge hour)
+    intime_hr = stay_in.astype('datetime64[h]').astype('datetime64[m]')
+    n_hours = np.ceil((stay_out - intime_hr) / np.timedelta64(1, 'h')).astype(int) + 25
+    h_stay, h_pos = _expand(n_hours)
+    hr = h_pos - 24
+    tables['icustay_hours'] = _frame('icustay_hours', {
+        'icustay_id': stay_id[h_stay], 'hr': hr, 'endtime': intime_hr[h_stay] + hr.astype('timedelta64[h]')})
+
+    # Mechanical ventilation (first ICU stay): >= 72 hours for the cohort, short or none when it fails the criterion
+    vent_h = rng.uniform(72, np.maximum(icu_los_h, 72.1))
+    vent_h[short_stay] = np.minimum(icu_los_h[short_stay], rng.uniform(6, 24, short_stay.sum()))
+    vent_h[short_vent] = np.where(rng.random(short_vent.sum()) < 0.5, 0, rng.uniform(4, 30, short_vent.sum()))
+    ventilated = vent_h > 0
+    vent_start = intime
+    vent_end = np.minimum(intime + _hours(vent_h), outtime)
+    v_adm = np.nonzero(ventilated)[0]
+    tables['ventilation_durations'] = _frame('ventilation_durations', {
+        'icustay_id': first_stay_id[v_adm], 'ventnum': np.ones(len(v_adm), dtype=int),
+        'starttime': vent_start[v_adm], 'endtime': vent_end[v_adm],
+        'duration_hours': (vent_end[v_adm] - vent_start[v_adm]) / np.timedelta64(1, 'h')})
+    # Ventilator settings charted every 4 hours, then the extubation
+    n_settings = ((vent_end[v_adm] - vent_start[v_adm]) // np.timedelta64(4, 'h')).astype(int) + 1
+    s_row, s_pos = _expand(n_settings)
+    s_adm = v_adm[s_row]
+    setting_times = vent_start[s_adm] + (4 * s_pos).astype('timedelta64[h]')
+    settings = {'icustay_id': np.concatenate([first_stay_id[s_adm], first_stay_id[v_adm]]),
+                'charttime': np.concatenate([setting_times, vent_end[v_adm]])}
+    n_rows = len(settings['charttime'])
+    is_setting = np.arange(n_rows) < len(s_adm)
+    settings.update({'MechVent': is_setting.astype(int), 'OxygenTherapy': (~is_setting).astype(int),
+                     'Extubated': (~is_setting).astype(int), 'SelfExtubated': np.zeros(n_rows, dtype=int)})
+    tables['ventilation_classification'] = _frame('ventilation_classification', settings).sort_values(
+        ['icustay_id', 'charttime'], kind='stable').reset_index(drop=True)
+    # FiO2 charted with the ventilator settings (higher around a sepsis onset)
+    fio2_times = setting_times + np.timedelta64(30, 'm')
+    near_onset = septic[s_adm] & (np.abs((fio2_times - onset[s_adm]) / np.timedelta64(1, 'h') - 12) < 24)
+    fio2 = np.where(near_onset, rng.choice([60., 80., 100.], len(s_adm)), rng.choice([40., 50., 60.], len(s_adm)))
+    tables['pivoted_fio2'] = _frame('pivoted_fio2', {'icustay_id': first_stay_id[s_adm], 'charttime': fio2_times, 'fio2': fio2})
+
+    # Vital signs every `vital_interval_hours` of each ICU stay
+    n_vitals = (stay_los_h // vital_interval_hours).astype(int) + 1
+    vs_stay, vs_pos = _expand(n_vitals)
+    vs_adm = stay_adm[vs_stay]
+    charttime = stay_in[vs_stay] + _hours(vs_pos * vital_interval_hours + rng.uniform(0, 0.2, len(vs_stay)) * vital_interval_hours)
+    m = len(vs_stay)
+    vitals = {'HeartRate': rng.normal(85, 12, m), 'SysBP': rng.normal(122, 15, m), 'DiasBP': rng.normal(65, 9, m),
+              'RespRate': rng.normal(17, 3.5, m), 'TempC': rng.normal(37.0, 0.4, m), 'SpO2': np.minimum(rng.normal(97.5, 1.5, m), 100),
+              'Glucose': rng.normal(130, 25, m)}
+    # Physiological response around a sepsis onset (from 12 hours before to 72 hours after)
+    since_onset = (charttime - onset[vs_adm]) / np.timedelta64(1, 'h')
+    response = septic[vs_adm] & (since_onset > -12) & (since_onset < 72)
+    for feature, delta in {'HeartRate': 25, 'SysBP': -22, 'DiasBP': -12, 'RespRate': 7, 'TempC': 1.3, 'SpO2': -3}.items():
+        vitals[feature] = np.where(response, vitals[feature] + delta, vitals[feature])
+    vitals['MeanBP'] = (vitals['SysBP'] + 2 * vitals['DiasBP']) / 3
+    vitals['Glucose'][vs_pos % 4 != 0] = np.nan  # point-of-care glucose every ~4 measurements
+    for feature in vitals:
+        vitals[feature][rng.random(m) < 0.05] = np.nan
+    vitals = {feature: values.round(1) for feature, values in vitals.items()}
+    tables['pivoted_vital'] = _frame('pivoted_vital', {'icustay_id': stay_id[vs_stay], 'charttime': charttime, **vitals})
+    # Mean arterial pressure in CHARTEVENTS (SOFA cardiovascular component)
+    bp = ~np.isnan(vitals['MeanBP'])
+    tables['CHARTEVENTS'] = _frame('CHARTEVENTS', {
+        'SUBJECT_ID': subject_id[vs_adm[bp]], 'HADM_ID': hadm_id[vs_adm[bp]], 'ICUSTAY_ID': stay_id[vs_stay[bp]],
+        'ITEMID': rng.choice(_MAP_ITEMIDS, bp.sum()), 'CHARTTIME': charttime[bp], 'VALUENUM': vitals['MeanBP'][bp],
+        'ERROR': pd.array(np.zeros(bp.sum(), dtype=int), dtype='Int64')})
+
+    # Labs over the hospital stay (normal values) + organ dysfunction after a sepsis onset
+    n_labs = rng.poisson(event_density * hospital_los_h / 24) + 1
+    l_adm, _ = _expand(n_labs)
+    lab_times = admittime[l_adm] + _hours(rng.uniform(0, hospital_los_h[l_adm]))
+    labs = {'bilirubin': rng.uniform(0.2, 1.0, len(l_adm)), 'creatinine': rng.uniform(0.5, 1.1, len(l_adm)),
+            'platelet': rng.uniform(160, 400, len(l_adm))}
+    for lab in labs:
+        labs[lab][rng.random(len(l_adm)) < 0.2] = np.nan
+    sep_adm = np.repeat(np.nonzero(septic)[0], 3)
+    k = len(sep_adm)
+    lab_times = np.concatenate([lab_times, onset[sep_adm] + _hours(rng.uniform(2, 36, k))])
+    labs = {'bilirubin': np.concatenate([labs['bilirubin'], rng.uniform(2.2, 5.0, k)]),
+            'creatinine': np.concatenate([labs['creatinine'], rng.uniform(3.6, 4.8, k)]),
+            'platelet': np.concatenate([labs['platelet'], rng.uniform(25, 45, k)])}
+    lab_adm = np.concatenate([l_adm, sep_adm])
+    tables['pivoted_lab'] = _frame('pivoted_lab', {'hadm_id': hadm_id[lab_adm], 'charttime': lab_times,
+                                                   **{lab: values.round(2) for lab, values in labs.items()}})
+
+    # Arterial blood gases while ventilated (normal PaO2/FiO2) + hypoxemia after a sepsis onset
+    n_bg = np.where(ventilated, rng.poisson(event_density * vent_h / 8) + 1, 0)
+    b_adm, _ = _expand(n_bg)
+    bg_times = vent_start[b_adm] + _hours(rng.uniform(0, vent_h[b_adm]))
+    sep_adm = np.repeat(np.nonzero(septic)[0], 2)
+    tables['pivoted_bg_art'] = _frame('pivoted_bg_art', {
+        'icustay_id': first_stay_id[np.concatenate([b_adm, sep_adm])],
+        'charttime': np.concatenate([bg_times, onset[sep_adm] + _hours(rng.uniform(1, 24, len(sep_adm)))]),
+        'pao2fio2ratio': np.concatenate([rng.uniform(400.5, 550, len(b_adm)), rng.uniform(120, 190, len(sep_adm))]).round(1)})
+
+    # Vasopressors: norepinephrine for half of the sepsis onsets, no other infusions
+    pressor = np.nonzero(septic & (rng.random(n) < 0.5))[0]
+    pressor_start = onset[pressor] + _hours(rng.uniform(1, 8, len(pressor)))
+    tables['norepinephrine_dose'] = _frame('norepinephrine_dose', {
+        'icustay_id': first_stay_id[pressor], 'starttime': pressor_start,
+        'endtime': pressor_start + _hours(rng.uniform(6, 36, len(pressor))),
+        'vaso_rate': rng.uniform(0.05, 0.3, len(pressor)).round(3)})
+    for drug in ['epinephrine', 'dopamine', 'dobutamine']:
+        tables[f'{drug}_dose'] = _frame(f'{drug}_dose', {column: [] for column in _DOSE})
+
+    # Microbiology: the qualifying blood culture at the onset + background cultures
+    n_cx = rng.poisson(0.15 * event_density * hospital_los_h / 24)
+    c_adm, _ = _expand(n_cx)
+    cx_times = admittime[c_adm] + _hours(rng.uniform(0, hospital_los_h[c_adm]))
+    spec = rng.choice(len(_OTHER_CULTURES) + 1, len(c_adm))
+    specs = [_BLOOD_CULTURE] + _OTHER_CULTURES
+    s_adm = np.nonzero(suspected)[0]
+    cx = pd.DataFrame({
+        'adm': np.concatenate([c_adm, s_adm]),
+        'time': np.concatenate([cx_times, onset[s_adm]]),
+        'spec': np.concatenate([spec, np.zeros(len(s_adm), dtype=int)]),
+        # some background cultures only have a chart date
+        'dated': np.concatenate([rng.random(len(c_adm)) < 0.1, np.zeros(len(s_adm), dtype=bool)])
+    }).sort_values(['adm', 'time'], kind='stable')
+    cx_time = cx['time'].to_numpy().astype('datetime64[m]')
+    tables['MICROBIOLOGYEVENTS'] = _frame('MICROBIOLOGYEVENTS', {
+        'SUBJECT_ID': subject_id[cx['adm']], 'HADM_ID': hadm_id[cx['adm']], 'CHARTDATE': _floor_day(cx_time),
+        'CHARTTIME': np.where(cx['dated'].to_numpy(), np.datetime64('NaT'), cx_time),
+        'SPEC_ITEMID': [specs[s][0] for s in cx['spec']], 'SPEC_TYPE_DESC': [specs[s][1] for s in cx['spec']]})
+
+    # Prescriptions (dates at midnight, as in MIMIC-III)
+    adm_day = _floor_day(admittime)
+    disch_day = _floor_day(dischtime)
+    los_days = ((disch_day - adm_day) // np.timedelta64(1, 'D')).astype(int)
+    orders = []
+    # Surgical prophylaxis on the first hospital day (excluded by the antibiotic criteria)
+    p_adm = np.nonzero(rng.random(n) < 0.5)[0]
+    orders.append((p_adm, adm_day[p_adm], adm_day[p_adm] + np.timedelta64(1, 'D'), np.full(len(p_adm), -1)))
+    # Short antibiotic orders (fail the duration criteria) and other drugs (not antibiotics)
+    for rate, drugs, max_days in [(0.3, 'abx', 2), (2.0, 'other', 5)]:
+        eligible = los_days >= 4
+        n_orders = np.where(eligible, rng.poisson(rate * event_density, n), 0)
+        o_adm, _ = _expand(n_orders)
+        first = adm_day[o_adm] + (1 + rng.integers(0, np.maximum(los_days[o_adm] - 3, 1))).astype('timedelta64[D]')
+        last = np.minimum(first + rng.integers(0, max_days, len(o_adm)).astype('timedelta64[D]'),
+                          disch_day[o_adm] - np.timedelta64(2, 'D'))
+        last = np.maximum(first, last)
+        drug = rng.integers(0, len(_COURSE_ABX), len(o_adm)) if drugs == 'abx' else -2 - rng.integers(0, len(_OTHER_DRUGS), len(o_adm))
+        orders.append((o_adm, first, last, drug))
+    # Antibiotic course of a suspected infection: starts within a day of the culture (never on the first
+    # hospital day), lasts 4-10 days and is charted as consecutive, sometimes overlapping, orders
+    course_adm = np.concatenate([s_adm, s_adm[rng.random(len(s_adm)) < 0.5]])
+    course_drug = rng.integers(0, len(_COURSE_ABX), len(course_adm))
+    course_first = np.maximum(_floor_day(onset[course_adm]) + rng.integers(-1, 2, len(course_adm)).astype('timedelta64[D]'),
+                              adm_day[course_adm] + np.timedelta64(1, 'D'))
+    d_course, d_pos = _expand(rng.integers(4, 11, len(course_adm)))
+    new_order = (d_pos == 0) | (rng.random(len(d_course)) < 0.4)
+    fragment = pd.DataFrame({'course': d_course, 'order': np.cumsum(new_order), 'day': d_pos})
+    fragment = fragment.groupby('order').agg(course=('course', 'first'), first=('day', 'min'), last=('day', 'max'))
+    f_course = fragment['course'].to_numpy()
+    f_last = fragment['last'].to_numpy() + (rng.random(len(fragment)) < 0.2)
+    orders.append((course_adm[f_course],
+                   course_first[f_course] + fragment['first'].to_numpy().astype('timedelta64[D]'),
+                   course_first[f_course] + f_last.astype('timedelta64[D]'),
+                   course_drug[f_course]))
+    rx_adm, rx_first, rx_last, rx_drug = [np.concatenate(parts) for parts in zip(*orders)]
+    drug_table = {-1: _PROPHYLAXIS_ABX, **dict(enumerate(_COURSE_ABX)),
+                  **{-2 - i: drug for i, drug in enumerate(_OTHER_DRUGS)}}
+    drug_info = np.array([drug_table[d] for d in rx_drug], dtype=object).reshape(-1, 4)
+    rx = pd.DataFrame({'adm': rx_adm, 'first': rx_first, 'last': rx_last}).sort_values(['adm', 'first'], kind='stable')
+    drug_info = drug_info[rx.index.to_numpy()]
+    rx_adm = rx['adm'].to_numpy()
+    tables['PRESCRIPTIONS'] = _frame('PRESCRIPTIONS', {
+        'SUBJECT_ID': subject_id[rx_adm], 'HADM_ID': hadm_id[rx_adm],
+        'ICUSTAY_ID': pd.array(first_stay_id[rx_adm], dtype='Int64'),
+        'STARTDATE': rx['first'].to_numpy(), 'ENDDATE': rx['last'].to_numpy(), 'DRUG_TYPE': np.full(len(rx), 'MAIN'),
+        'DRUG': drug_info[:, 0], 'DRUG_NAME_GENERIC': drug_info[:, 1], 'GSN': drug_info[:, 2], 'ROUTE': drug_info[:, 3]})
+
+    tables['ground_truth'] = _frame('ground_truth', {
+        'subject_id': subject_id, 'hadm_id': hadm_id,
+        'role': np.where(septic, 'sepsis', np.where(infected, 'infection', 'none')),
+        'onset_datetime': onset, 'in_trauma_cohort': cohort}, schemas={'ground_truth': GROUND_TRUTH_SCHEMA})
+    return tables
+
+
+def generate_synthetic_mimic(data_dir, n_admissions=1570, sepsis_prevalence=0.2, infection_fraction=0.1,
+                             trauma_fraction=0.8, ineligible_fraction=0.1, event_density=1.0,
+                             vital_interval_hours=1.0, block_size=5000, seed=0, ecodes_path=None):
+    """
+    Writes synthetic MIMIC-III tables (see the module notes) readable by `LocalMimicBackend(data_dir)`.
+
+    Args:
+    - data_dir (str): Output folder (existing tables in it are overwritten).
+    - n_admissions (int, optional): Number of hospital admissions (one per patient). The default matches
+                                    the size of the real trauma cohort; use 10x-100x for scale runs.
+    - sepsis_prevalence (float, optional): Fraction of the trauma cohort with a planted sepsis onset.
+    - infection_fraction (float, optional): Fraction of the trauma cohort with a suspected infection only.
+    - trauma_fraction (float, optional): Fraction of admissions with a qualified trauma E-code.
+    - ineligible_fraction (float, optional): Fraction of admissions failing one of the other cohort criteria
+                                             (age in [18, 89], hospital stay >= 48 hours, ventilation >= 3 days).
+    - event_density (float, optional): Multiplier of the number of background events per day
+                                       (labs, blood gases, cultures, prescriptions).
+    - vital_interval_hours (float, optional): Time between two vital sign measurements.
+    - block_size (int, optional): Number of admissions generated (and held in memory) at a time.
+    - seed (int, optional): Random seed; the same arguments always produce the same tables.
+    - ecodes_path (str, optional): Excel file of the qualified E-codes (see `load_qualified_ecodes`).
+
+    Returns:
+    - dict: {table name: number of rows written}.
+
+    Example:
+        generate_synthetic_mimic('/tmp/synthetic_mimic', n_admissions=15700)
+        data_utils.set_query_backend(LocalMimicBackend('/tmp/synthetic_mimic'))
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    ecodes = load_qualified_ecodes(ecodes_path)
+    paths = {table: os.path.join(data_dir, dataset, f'{table}.parquet') for table, (dataset, _) in TABLE_SCHEMAS.items()}
+    paths['ground_truth'] = os.path.join(data_dir, 'synthetic_ground_truth.parquet')
+    schemas = {table: _arrow_schema(schema) for table, (_, schema) in TABLE_SCHEMAS.items()}
+    schemas['ground_truth'] = _arrow_schema(GROUND_TRUTH_SCHEMA)
+    for dataset in [_CLINICAL, _DERIVED]:
+        os.makedirs(os.path.join(data_dir, dataset), exist_ok=True)
+
+    writers, rows = {}, {table: 0 for table in paths}
+    try:
+        for block, start in enumerate(range(0, n_admissions, block_size)):
+            rng = np.random.default_rng([seed, block])
+            tables = _generate_block(rng, start, min(block_size, n_admissions - start), ecodes,
+                                     sepsis_prevalence, infection_fraction, trauma_fraction,
+                                     ineligible_fraction, event_density, vital_interval_hours)
+            for table, df in tables.items():
+                if table not in writers:
+                    writers[table] = pq.ParquetWriter(f'{paths[table]}.tmp', schemas[table])
+                writers[table].write_table(pa.Table.from_pandas(df, schema=schemas[table], preserve_index=False))
+                rows[table] += len(df)
+            print(f"Generated {start + len(tables['ADMISSIONS'])}/{n_admissions} admissions")
+    finally:
+        for writer in writers.values():
+            writer.close()
+    for table in writers:
+        os.replace(f'{paths[table]}.tmp', paths[table])
+    return rows
@@ -1,4 +1,7 @@
 import os
+import pandas as pd
+
+from src.data import artifact_store, instance_store
 
 class ProjectPaths:
     def __init__(self, base_path):
@@ -7,15 +10,17 @@ class ProjectPaths:
         self.data_path = os.path.join(self.base_path, 'data')
         self.raw_data_path = os.path.join(self.data_path, 'raw')
         self.processed_data_path = os.path.join(self.data_path, 'processed')
+        # cached query results (see src/data/query_cache.py)
+        self.query_cache_path = os.path.join(self.data_path, 'cache')
         
         # dataset folder:
         self.final_dataset_path = os.path.join(self.base_path, 'dataset')
         # patient ids fold assignments for stratified 5-fold CV at the patient level.
         self.fold_patient_info_path = os.path.join(self.final_dataset_path, 'Fold_IDs.csv')
-        # dataset with nan value
-        self.dataset_with_nan_path = os.path.join(self.final_dataset_path, 'PostTraumaticSepsis_dataset_w_nan.pkl')
+        # dataset with nan value (instance set directory, see src/data/instance_store.py)
+        self.dataset_with_nan_path = os.path.join(self.final_dataset_path, 'PostTraumaticSepsis_dataset_w_nan')
         # dataset w/o nan value
-        self.dataset_wo_nan_path = os.path.join(self.final_dataset_path, 'PostTraumaticSepsis_dataset_wo_nan.pkl')
+        self.dataset_wo_nan_path = os.path.join(self.final_dataset_path, 'PostTraumaticSepsis_dataset_wo_nan')
 
         
         # code folder
@@ -32,13 +37,13 @@ class ProjectPaths:
 
         # important files saved in "raw" folder
 
-        # important files saved in "processed" folder
-        self.trauma_cohort_info_path = os.path.join(self.processed_data_path, 'trauma_cohort_info.csv')
+        # important files saved in "processed" folder (typed Parquet artifacts, see src/data/artifact_store.py)
+        self.trauma_cohort_info_path = self.get_artifact_path('trauma_cohort_info')
         # self.trauma_blood_cx_path = os.path.join(self.processed_data_path, 'trauma_blood_cx.csv')
-        self.trauma_abxOrder_path = os.path.join(self.processed_data_path, 'trauma_abx_order.csv') # abx order 
-        self.trauma_abxEvent_path = os.path.join(self.processed_data_path, 'trauma_abx_event.csv') # abx event 
+        self.trauma_abxOrder_path = self.get_artifact_path('trauma_abx_order') # abx order 
+        self.trauma_abxEvent_path = self.get_artifact_path('trauma_abx_event') # abx event 
         # self.trauma_sofa_path = os.path.join(self.processed_data_path, 'trauma_sofa.csv')
-        self.sepsis_label_path = os.path.join(self.processed_data_path, 'sepsis_label.csv') # sepsis onset info
+        self.sepsis_label_path = self.get_artifact_path('sepsis_label') # sepsis onset info
 
         
 
@@ -55,6 +60,66 @@ class ProjectPaths:
     def get_final_data_file(self, filename):
         return os.path.join(self.final_data_path, filename)
 
+    # Typed artifacts: intermediate tables saved as Parquet with a per-artifact schema
+    # (artifact names and schemas: src/data/artifact_store.py); `key` identifies the cohort of an artifact restricted
+    # to a cohort (see `artifact_store.cohort_key`)
+    def get_artifact_path(self, name, key=None):
+        folder = self.raw_data_path if artifact_store.ARTIFACT_SCHEMAS[name]['folder'] == 'raw' else self.processed_data_path
+        return os.path.join(folder, f'{name}.parquet' if key is None else f'{name}_{key}.parquet')
+
+    def _legacy_csv_path(self, name):
+        return self.get_artifact_path(name)[:-len('.parquet')] + '.csv'
+
+    def artifact_exists(self, name, key=None):
+        if key is not None:
+            return os.path.exists(self.get_artifact_path(name, key=key))
+        return os.path.exists(self.get_artifact_path(name)) or os.path.exists(self._legacy_csv_path(name))
+
+    def _migrate_legacy_csv(self, name, key=None):
+        # Artifacts saved as CSV by earlier versions are converted once, on first load
+        path = self.get_artifact_path(name, key=key)
+        if key is None and not os.path.exists(path) and os.path.exists(self._legacy_csv_path(name)):
+            print(f"Converting {self._legacy_csv_path(name)} to {path}")
+            if artifact_store.ARTIFACT_SCHEMAS[name].get('streamed', False):
+                batches = pd.read_csv(self._legacy_csv_path(name), index_col=0, chunksize=500000)
+                for _ in artifact_store.write_artifact_batches(batches, path, name):
+                    pass
+            else:
+                artifact_store.write_artifact(pd.read_csv(self._legacy_csv_path(name), index_col=0), path, name)
+        return path
+
+    def load_artifact(self, name, columns=None, key=None):
+        """
+        Loads a typed artifact (no parsing); `columns` restricts the load to these columns.
+        """
+        return artifact_store.read_artifact(self._migrate_legacy_csv(name, key=key), columns=columns)
+
+    def iter_artifact_batches(self, name, batch_size, columns=None, key=None):
+        return artifact_store.iter_artifact_batches(self._migrate_legacy_csv(name, key=key), batch_size, columns=columns)
+
+    def save_artifact(self, name, df, key=None):
+        path = self.get_artifact_path(name, key=key)
+        artifact_store.write_artifact(df, path, name)
+        return path
+
+    # Final datasets: instance sets (feature array and index table, see src/data/instance_store.py)
+    def dataset_exists(self, path):
+        return instance_store.instance_set_exists(path) or os.path.exists(f'{path}.pkl')
+
+    def load_dataset(self, path, folds=None, columns=None, mmap_mode='r'):
+        """
+        Loads the index table and the (memory-mapped) feature array of a dataset, reading only the shards of the
+        requested folds and the requested index columns (see `instance_store.load_instance_set`).
+        """
+        # Datasets pickled by earlier versions are converted once, on first load
+        if not instance_store.instance_set_exists(path) and os.path.exists(f'{path}.pkl'):
+            print(f"Converting {path}.pkl to {path}")
+            instance_store.save_instance_set(path, *instance_store.instance_arrays(pd.read_pickle(f'{path}.pkl')))
+        return instance_store.load_instance_set(path, folds=folds, columns=columns, mmap_mode=mmap_mode)
+
+    def save_dataset(self, path, index_df, values):
+        return instance_store.save_instance_set(path, index_df, values)
+
     def get_script_file(self, filename):
         return os.path.join(self.scripts_path, filename)
 
@@ -0,0 +1,87 @@
+import builtins
+import contextlib
+import io
+import os
+import shutil
+
+import matplotlib
+matplotlib.use('Agg')
+import pytest
+
+from src.data import data_utils
+from src.data.query_backend import LocalMimicBackend
+from src.data.synthetic_mimic import generate_synthetic_mimic
+from src.path_manager import ProjectPaths
+
+
+###################################
+# Shared fixtures: a small synthetic MIMIC-III cohort run through the pipeline with the local backend
+###################################
+# The synthetic tables (src/data/synthetic_mimic.py) are generated once per test session; the cohort extraction,
+# preprocessing and label assignment are run once on them, and tests that modify the project work on a copy
+# (`project_copy`).
+
+PROJECT_ID = 'synthetic'
+N_ADMISSIONS = 80
+_REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The pipeline scripts are written for notebooks, where `display` is a builtin
+if not hasattr(builtins, 'display'):
+    builtins.display = print
+
+
+def project_paths(base_path):
+    for folder in ['data/raw', 'data/processed', 'dataset']:
+        os.makedirs(os.path.join(base_path, folder), exist_ok=True)
+    project_path_obj = ProjectPaths(base_path)
+    # The cohort extraction reads the qualified E-codes from the repository's supplementary folder
+    project_path_obj.supplementary_path = os.path.join(_REPO_ROOT, 'supplementary')
+    return project_path_obj
+
+
+@pytest.fixture(scope='session')
+def mimic_dir(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('mimic'))
+    with contextlib.redirect_stdout(io.StringIO()):
+        generate_synthetic_mimic(path, n_admissions=N_ADMISSIONS, seed=0)
+    return path
+
+
+@pytest.fixture(scope='session')
+def local_backend(mimic_dir):
+    previous_backend = data_utils.get_query_backend()
+    data_utils.set_query_backend(LocalMimicBackend(mimic_dir))
+    yield
+    data_utils.set_query_backend(previous_backend)
+
+
+@pytest.fixture(scope='session')
+def labeled_project(tmp_path_factory, local_backend):
+    """
+    Project with the trauma cohort, the preprocessed tables and the sepsis labels of the synthetic cohort.
+
+    Returns:
+    - dict: 'path' (project folder), 'trauma_ids', 'cohort', 'cx', 'abx' and 'sofa' (outputs of `preprocess_data`).
+    """
+    from scripts.cohort_extraction import extract_trauma_cohort_ids
+    from scripts import sepsis_onset_label_assignment as label_assignment
+
+    path = str(tmp_path_factory.mktemp('project'))
+    project_path_obj = project_paths(path)
+    with contextlib.redirect_stdout(io.StringIO()):
+        trauma_ids = extract_trauma_cohort_ids(project_path_obj, PROJECT_ID, is_report=False, is_saved=True)
+        cohort, cx_df, abx_df, sofa_df = label_assignment.preprocess_data(project_path_obj, PROJECT_ID)
+        label_assignment.assign_sepsis_labels(project_path_obj, PROJECT_ID)
+    return {'path': path, 'trauma_ids': trauma_ids, 'cohort': cohort, 'cx': cx_df, 'abx': abx_df, 'sofa': sofa_df}
+
+
+@pytest.fixture
+def project_copy(labeled_project, tmp_path):
+    """
+    Returns a function making a copy of the labeled project (a ProjectPaths object) that a test may modify.
+    """
+    def make_copy(name='project'):
+        path = str(tmp_path / name)
+        shutil.copytree(labeled_project['path'], path)
+        return project_paths(path)
+    return make_copy
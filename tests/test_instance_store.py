@@ -0,0 +1,105 @@
+import datetime
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data import instance_store
+from src.path_manager import ProjectPaths
+
+
+def _instances(n=60, seed=0):
+    # Instances with increasing, non-contiguous row labels, so that the folds interleave
+    rng = np.random.default_rng(seed)
+    index_df = pd.DataFrame({
+        'subject_id': rng.integers(1, 20, n), 'hadm_id': rng.integers(100, 140, n),
+        'Date': [datetime.date(2150, 1, 1) + datetime.timedelta(days=int(day)) for day in rng.integers(0, 30, n)],
+        'Night': rng.integers(1, 10, n), 'Label': rng.integers(0, 2, n), 'Fold': rng.integers(0, 5, n),
+    }, index=np.sort(rng.choice(10 * n, n, replace=False)))
+    values = rng.normal(size=(n, 9, 4))
+    return index_df, values
+
+
+def test_round_trip(tmp_path):
+    index_df, values = _instances()
+    path = str(tmp_path / 'instances')
+    instance_store.save_instance_set(path, index_df, values)
+
+    loaded_index, loaded_values = instance_store.load_instance_set(path)
+    pd.testing.assert_frame_equal(loaded_index, index_df, check_dtype=False)
+    assert isinstance(loaded_index['Date'].iloc[0], datetime.date)
+    np.testing.assert_array_equal(loaded_values, values)
+
+
+def test_single_fold_is_memory_mapped(tmp_path):
+    index_df, values = _instances()
+    path = str(tmp_path / 'instances')
+    instance_store.save_instance_set(path, index_df, values)
+
+    is_fold = (index_df['Fold'] == 3).to_numpy()
+    loaded_index, loaded_values = instance_store.load_instance_set(path, folds=3)
+    assert isinstance(loaded_values, np.memmap)
+    np.testing.assert_array_equal(loaded_index.index, index_df.index[is_fold])
+    np.testing.assert_array_equal(loaded_values, values[is_fold])
+
+
+def test_several_folds_keep_the_row_order(tmp_path):
+    index_df, values = _instances()
+    path = str(tmp_path / 'instances')
+    instance_store.save_instance_set(path, index_df, values)
+
+    is_fold = index_df['Fold'].isin([4, 1]).to_numpy()
+    loaded_index, loaded_values = instance_store.load_instance_set(path, folds=[4, 1], columns=['hadm_id', 'Fold'])
+    pd.testing.assert_frame_equal(loaded_index, index_df.loc[is_fold, ['hadm_id', 'Fold']], check_dtype=False)
+    np.testing.assert_array_equal(loaded_values, values[is_fold])
+
+
+def test_unknown_fold(tmp_path):
+    index_df, values = _instances()
+    path = str(tmp_path / 'instances')
+    instance_store.save_instance_set(path, index_df, values)
+    with pytest.raises(ValueError):
+        instance_store.load_instance_set(path, folds=7)
+
+
+def test_instances_without_a_fold(tmp_path):
+    index_df, values = _instances()
+    index_df['Fold'] = index_df['Fold'].astype('Int64')
+    index_df.iloc[:5, index_df.columns.get_loc('Fold')] = pd.NA
+    path = str(tmp_path / 'instances')
+    instance_store.save_instance_set(path, index_df, values)
+
+    assert os.path.isdir(os.path.join(path, 'fold_none'))
+    loaded_index, loaded_values = instance_store.load_instance_set(path, folds=[None])
+    np.testing.assert_array_equal(loaded_index.index, index_df.index[:5])
+    np.testing.assert_array_equal(loaded_values, values[:5])
+
+
+def test_index_columns(tmp_path):
+    index_df, values = _instances()
+    path = str(tmp_path / 'instances')
+    instance_store.save_instance_set(path, index_df, values)
+
+    loaded_index, _ = instance_store.load_instance_set(path, columns=['hadm_id', 'Label'])
+    pd.testing.assert_frame_equal(loaded_index, index_df[['hadm_id', 'Label']], check_dtype=False)
+
+
+def test_instance_frame_round_trip():
+    index_df, values = _instances()
+    instance_df = instance_store.instance_frame(index_df, values)
+    assert np.shares_memory(instance_df['Temporal Features'].iloc[0], values)
+    split_index, split_values = instance_store.instance_arrays(instance_df)
+    pd.testing.assert_frame_equal(split_index, index_df)
+    np.testing.assert_array_equal(split_values, values)
+
+
+def test_legacy_pickle_is_converted(tmp_path):
+    index_df, values = _instances()
+    path = str(tmp_path / 'instances')
+    instance_store.instance_frame(index_df, values).to_pickle(f'{path}.pkl')
+
+    loaded_index, loaded_values = ProjectPaths(str(tmp_path)).load_dataset(path)
+    assert instance_store.instance_set_exists(path)
+    pd.testing.assert_frame_equal(loaded_index, index_df, check_dtype=False)
+    np.testing.assert_array_equal(loaded_values, values)
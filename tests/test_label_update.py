@@ -0,0 +1,84 @@
+import contextlib
+import io
+
+import numpy as np
+import pandas as pd
+
+from scripts import sepsis_onset_label_assignment as label_assignment
+
+from conftest import PROJECT_ID
+
+LABEL_ARTIFACTS = ['sepsis_label', 'sepsis_candidates', 'sepsis_label_inputs']
+
+
+def _run(function, *args):
+    with contextlib.redirect_stdout(io.StringIO()):
+        function(*args)
+
+
+def _change_label_inputs(project_path_obj):
+    # Late and new events for a few admissions, one new and one removed admission
+    cx = project_path_obj.load_artifact('trauma_blood_cx_events')
+    abx = project_path_obj.load_artifact('trauma_abx_event')
+    sofa = project_path_obj.load_artifact('trauma_sofa_score')
+    cohort = project_path_obj.load_artifact('trauma_cohort_info')
+    cx_ids = cx.hadm_id.unique()
+    assert len(cx_ids) >= 4
+    late_cx_id, copied_id, removed_id = cx_ids[0], cx_ids[1], cx_ids[-1]
+    new_id = cohort.hadm_id.max() + 1
+
+    # Antibiotic event 5 days after the first one of an admission (shifts the rows of the later admissions)
+    abx_id = abx.hadm_id.unique()[0]
+    row = abx[abx.hadm_id == abx_id].iloc[[0]].copy()
+    row['abx_day'] += 5
+    row['startdate'] = (pd.to_datetime(row['startdate']) + pd.Timedelta(days=5)).dt.date
+    abx = pd.concat([abx, row]).sort_values(['hadm_id', 'startdate'], kind='stable').reset_index(drop=True)
+    abx.index += 1
+
+    # Late culture, 3 days after the last one of an admission
+    row = cx[cx.hadm_id == late_cx_id].iloc[[-1]].copy()
+    row['cx_day'] += 3
+    row['cx_datetime'] += pd.Timedelta(days=3)
+    cx = pd.concat([cx, row]).sort_values(['hadm_id', 'cx_datetime'], kind='stable').reset_index(drop=True)
+
+    # New admission (a copy of an existing one) and removed admission
+    cohort = pd.concat([cohort, cohort[cohort.hadm_id == copied_id].assign(hadm_id=new_id)], ignore_index=True)
+    cohort = cohort[cohort.hadm_id != removed_id]
+    cx = pd.concat([cx, cx[cx.hadm_id == copied_id].assign(hadm_id=new_id)], ignore_index=True)
+    sofa = pd.concat([sofa[sofa.hadm_id != removed_id], sofa[sofa.hadm_id == copied_id].assign(hadm_id=new_id)])
+
+    # New SOFA scores of an admission
+    sofa_id = sofa.hadm_id.unique()[2]
+    is_changed = (sofa.hadm_id == sofa_id).to_numpy()
+    sofa.loc[is_changed, 'sofa_24hours'] = np.random.default_rng(0).integers(0, 8, is_changed.sum())
+    sofa = sofa.sort_values(['hadm_id', 'icustay_id', 'hr'], kind='stable').reset_index(drop=True)
+
+    project_path_obj.save_artifact('trauma_blood_cx_events', cx)
+    project_path_obj.save_artifact('trauma_abx_event', abx)
+    project_path_obj.save_artifact('trauma_sofa_score', sofa)
+    project_path_obj.save_artifact('trauma_cohort_info', cohort)
+    return new_id, removed_id
+
+
+def test_update_without_changes_keeps_the_labels(project_copy):
+    project_path_obj = project_copy()
+    before = {name: project_path_obj.load_artifact(name) for name in LABEL_ARTIFACTS}
+    _run(label_assignment.update_sepsis_labels, project_path_obj, PROJECT_ID)
+    for name in LABEL_ARTIFACTS:
+        pd.testing.assert_frame_equal(project_path_obj.load_artifact(name), before[name])
+
+
+def test_incremental_update_matches_full_reassignment(project_copy):
+    updated = project_copy('updated')
+    new_id, removed_id = _change_label_inputs(updated)
+    reassigned = project_copy('reassigned')
+    for name in ['trauma_blood_cx_events', 'trauma_abx_event', 'trauma_sofa_score', 'trauma_cohort_info']:
+        reassigned.save_artifact(name, updated.load_artifact(name))
+
+    _run(label_assignment.update_sepsis_labels, updated, PROJECT_ID)
+    _run(label_assignment.assign_sepsis_labels, reassigned, PROJECT_ID)
+
+    for name in LABEL_ARTIFACTS:
+        pd.testing.assert_frame_equal(updated.load_artifact(name), reassigned.load_artifact(name))
+    hadm_ids = set(updated.load_artifact('sepsis_label').hadm_id)
+    assert new_id in hadm_ids and removed_id not in hadm_ids
@@ -0,0 +1,101 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data import observation_windows as ow
+
+FEATURES = ['HR', 'SysBP', 'RespRate']
+
+
+def _records(n_admissions=12, seed=0):
+    # Hourly records of admissions of 1 to 4 days, with missing values and hours without records
+    rng = np.random.default_rng(seed)
+    frames = []
+    for k in range(n_admissions):
+        hours = np.sort(rng.choice(np.arange(rng.integers(0, 20), rng.integers(24, 96)), rng.integers(5, 40)))
+        records = pd.DataFrame(rng.normal(size=(len(hours), len(FEATURES))), columns=FEATURES)
+        records = records.mask(rng.random(records.shape) < 0.3)
+        admission_date = datetime.date(2150, 1, 1) + datetime.timedelta(days=int(rng.integers(0, 300)))
+        frames.append(records.assign(
+            subject_id=k // 2, hadm_id=1000 + k,
+            Date=[admission_date + datetime.timedelta(days=int(hour // 24)) for hour in hours],
+            Day=hours // 24 + 1, Hour=hours % 24))
+    df = pd.concat(frames, ignore_index=True)
+    return df[['subject_id', 'hadm_id', 'Date', 'Day', 'Hour'] + FEATURES].sample(frac=1, random_state=seed)
+
+
+def _brute_force_windows(admission_df, values, lookback, stride, offset, min_observed_hours):
+    # Windows enumerated admission by admission
+    rows = []
+    for admission in admission_df.itertuples():
+        block = values[admission.grid_start:admission.grid_start + admission.n_hours]
+        for end in range(admission.first_hour + lookback - 1, admission.first_hour + admission.n_hours):
+            start = end - admission.first_hour - lookback + 1
+            if (end - offset) % stride or (~np.isnan(block[start:start + lookback]).all(axis=1)).sum() < min_observed_hours:
+                continue
+            rows.append((admission.hadm_id, end // 24 + 1, end % 24, admission.grid_start + start))
+    return pd.DataFrame(rows, columns=['hadm_id', 'Day', 'Hour', 'window'])
+
+
+@pytest.mark.parametrize('lookback, stride, offset, min_observed_hours', [
+    (1, 1, 0, 1), (6, 1, 0, 1), (9, 24, 6, 1), (12, 4, 2, 3), (30, 5, 0, 10)])
+def test_windows_stay_within_their_admission(lookback, stride, offset, min_observed_hours):
+    admission_df, values = ow.hourly_admission_grid(_records())
+    window_df = ow.window_index(admission_df, values, lookback, stride=stride, offset=offset,
+                                min_observed_hours=min_observed_hours)
+    assert len(window_df) > 0
+
+    blocks = admission_df.set_index('hadm_id').loc[window_df['hadm_id']]
+    grid_start = blocks['grid_start'].to_numpy()
+    window = window_df['window'].to_numpy()
+    assert (window >= grid_start).all()
+    assert (window + lookback <= grid_start + blocks['n_hours'].to_numpy()).all()
+
+    end_hour = (window_df['Day'].to_numpy() - 1) * 24 + window_df['Hour'].to_numpy()
+    np.testing.assert_array_equal(end_hour, blocks['first_hour'].to_numpy() + window - grid_start + lookback - 1)
+    assert ((end_hour - offset) % stride == 0).all()
+    expected_date = pd.to_datetime(blocks['admission_date']).dt.date.to_numpy() \
+        + (end_hour // 24) * datetime.timedelta(days=1)
+    np.testing.assert_array_equal(window_df['Date'].to_numpy(), expected_date)
+
+    expected = _brute_force_windows(admission_df, values, lookback, stride, offset, min_observed_hours)
+    pd.testing.assert_frame_equal(window_df[['hadm_id', 'Day', 'Hour', 'window']], expected, check_dtype=False)
+
+
+def test_complete_windows_have_no_missing_values():
+    admission_df, values = ow.hourly_admission_grid(_records(), ffill_hours=3)
+    window_df = ow.window_index(admission_df, values, 4, complete=True)
+    windows = ow.sliding_windows(values, 4)
+    assert len(window_df) > 0
+    assert not np.isnan(windows[window_df['window']]).any()
+
+
+def test_windows_are_views_of_the_grid():
+    admission_df, values = ow.hourly_admission_grid(_records())
+    windows = ow.sliding_windows(values, 6)
+    assert np.shares_memory(windows, values)
+    assert not windows.flags.writeable
+    np.testing.assert_array_equal(windows[10], values[10:16])
+
+
+def test_grid_holds_the_hourly_means():
+    df = _records()
+    admission_df, values = ow.hourly_admission_grid(df)
+    hour = (df['Day'] - 1) * 24 + df['Hour']
+    hourly = df.assign(hour=hour).groupby(['hadm_id', 'hour'])[FEATURES].mean()
+    blocks = admission_df.set_index('hadm_id').loc[hourly.index.get_level_values('hadm_id')]
+    rows = blocks['grid_start'].to_numpy() + hourly.index.get_level_values('hour') - blocks['first_hour'].to_numpy()
+    np.testing.assert_allclose(values[rows], hourly.to_numpy())
+    assert admission_df['n_hours'].sum() == len(values)
+
+
+@pytest.mark.parametrize('limit', [1, 3, 24])
+def test_forward_fill_does_not_cross_admissions(limit):
+    admission_df, values = ow.hourly_admission_grid(_records())
+    filled = ow.forward_fill_hours(values, np.repeat(admission_df['grid_start'], admission_df['n_hours']).to_numpy(),
+                                   limit)
+    expected = pd.DataFrame(values).groupby(np.repeat(admission_df['hadm_id'], admission_df['n_hours']).to_numpy()) \
+        .ffill(limit=limit).to_numpy()
+    np.testing.assert_array_equal(filled, expected)
@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+
+from src.data.onset_stream import replay_sepsis_onsets
+from src.path_manager import ProjectPaths
+
+
+def _batch_labels(labeled_project):
+    labels = ProjectPaths(labeled_project['path']).load_artifact('sepsis_label')
+    return labels.sort_values('hadm_id').reset_index(drop=True)
+
+
+def test_replay_matches_batch_labels(labeled_project):
+    batch = _batch_labels(labeled_project)
+    replay = replay_sepsis_onsets(labeled_project['cohort'], labeled_project['cx'], labeled_project['abx'],
+                                  labeled_project['sofa'])
+
+    assert batch.is_sepsis.sum() > 0
+    np.testing.assert_array_equal(replay.hadm_id.to_numpy(), batch.hadm_id.to_numpy())
+    np.testing.assert_array_equal(replay.is_sepsis.to_numpy(), batch.is_sepsis.to_numpy())
+    np.testing.assert_array_equal(replay.onset_day.astype('float64').to_numpy(),
+                                  batch.onset_day.astype('float64').to_numpy())
+    np.testing.assert_array_equal(pd.to_datetime(replay.onset_datetime).to_numpy(),
+                                  pd.to_datetime(batch.onset_datetime).to_numpy())
+
+
+def test_onsets_are_not_detected_before_they_occur(labeled_project):
+    replay = replay_sepsis_onsets(labeled_project['cohort'], labeled_project['cx'], labeled_project['abx'],
+                                  labeled_project['sofa'])
+    onsets = replay[replay.is_sepsis == 1]
+    assert len(onsets) > 0
+    assert (onsets.detected_day >= onsets.onset_day).all()
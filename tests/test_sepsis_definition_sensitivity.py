@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+
+from scripts.sepsis_definition_sensitivity import (assign_sepsis_label_grid, sepsis_definition_grid,
+                                                   sepsis_label_grid)
+from scripts.sepsis_onset_label_assignment import consolidate_abx_orders, preprocess_data
+from src.path_manager import ProjectPaths
+
+from conftest import PROJECT_ID
+
+
+def test_default_definition_matches_assign_sepsis_labels(labeled_project):
+    project_path_obj = ProjectPaths(labeled_project['path'])
+    labels = project_path_obj.load_artifact('sepsis_label').sort_values('hadm_id').reset_index(drop=True)
+    label_grid = assign_sepsis_label_grid(project_path_obj, PROJECT_ID).xs(0, level='definition').reset_index()
+
+    assert labels.is_sepsis.sum() > 0
+    np.testing.assert_array_equal(label_grid.hadm_id.to_numpy(), labels.hadm_id.to_numpy())
+    np.testing.assert_array_equal(label_grid.is_infection.to_numpy(), labels.is_infection.to_numpy())
+    np.testing.assert_array_equal(label_grid.is_sepsis.to_numpy(), labels.is_sepsis.to_numpy())
+    np.testing.assert_array_equal(label_grid.onset_day.to_numpy(), labels.onset_day.astype('float64').to_numpy())
+    np.testing.assert_array_equal(pd.to_datetime(label_grid.onset_datetime).to_numpy(),
+                                  pd.to_datetime(labels.onset_datetime).to_numpy())
+
+
+def test_grid_matches_definitions_evaluated_alone(labeled_project):
+    # Inputs of `sepsis_label_grid`, as `assign_sepsis_label_grid` builds them
+    project_path_obj = ProjectPaths(labeled_project['path'])
+    trum_cohort_info_df, cx_df, _, sofa_df = preprocess_data(project_path_obj, PROJECT_ID)
+    abx_df = project_path_obj.load_artifact('trauma_abx_order').drop_duplicates(['hadm_id', 'startdate', 'enddate', 'drug'])
+    abx_event_df = consolidate_abx_orders(abx_df)
+
+    definitions = sepsis_definition_grid(cx_abx_window=[1, 3], sofa_window=[1, 3], min_sofa_rise=[1, 2, 3],
+                                         min_abx_duration=[3, 5], min_abx_day=[1, 2])
+    label_grid = sepsis_label_grid(trum_cohort_info_df, cx_df, abx_event_df, sofa_df, definitions)
+    # The definitions do not all give the same labels
+    assert label_grid.groupby('definition').is_infection.sum().nunique() > 1
+    assert label_grid.groupby('definition').is_sepsis.sum().nunique() > 1
+
+    for definition in definitions.index:
+        alone = sepsis_label_grid(trum_cohort_info_df, cx_df, abx_event_df, sofa_df, definitions.loc[[definition]])
+        pd.testing.assert_frame_equal(label_grid.xs(definition, level='definition', drop_level=False), alone)
@@ -0,0 +1,119 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data import data_utils, sofa_engine
+from src.data.query_backend import LocalMimicBackend
+
+PROJECT_ID = 'synthetic'
+_MEANBP_ITEMIDS = [456, 52, 6702, 443, 220052, 220181, 225312]
+
+
+def _random_times(rng, start, end, n):
+    # Times on a 30-minute grid, so that events fall on hour boundaries too
+    steps = rng.integers(0, int((end - start) / pd.Timedelta(minutes=30)) + 1, n)
+    return start + steps * pd.Timedelta(minutes=30)
+
+
+def _intervals(rng, icustay_id, start, end, n, overlapping):
+    # Dose or ventilation intervals of an ICU stay; without `overlapping`, consecutive and disjoint
+    times = np.sort(_random_times(rng, start, end, 2 * n))
+    starts, ends = (times[:n], times[n:]) if overlapping else (times[0::2], times[1::2])
+    return pd.DataFrame({'icustay_id': icustay_id, 'starttime': starts, 'endtime': ends})
+
+
+def _write_sofa_inputs(data_dir, n_admissions=8, seed=0):
+    # Randomized input tables of the SOFA query, in the layout read by LocalMimicBackend
+    rng = np.random.default_rng(seed)
+    tables = {name: [] for name in ['ICUSTAYS', 'CHARTEVENTS', 'icustay_hours', 'pivoted_lab', 'pivoted_bg_art',
+                                    'ventilation_durations', 'epinephrine_dose', 'norepinephrine_dose',
+                                    'dopamine_dose', 'dobutamine_dose']}
+    icustay_id = 300000
+    for hadm_id in range(100000, 100000 + n_admissions):
+        admittime = pd.Timestamp('2150-01-01') + pd.Timedelta(hours=int(rng.integers(0, 2000)))
+        # One or two ICU stays; the second one may overlap the first
+        stay_starts = [admittime + pd.Timedelta(minutes=int(rng.integers(0, 600)))]
+        if rng.random() < 0.5:
+            stay_starts.append(stay_starts[0] + pd.Timedelta(hours=int(rng.integers(-5, 60))))
+        for intime in stay_starts:
+            icustay_id += 1
+            n_hours = int(rng.integers(5, 80))
+            tables['ICUSTAYS'].append(pd.DataFrame({'SUBJECT_ID': [hadm_id], 'HADM_ID': [hadm_id],
+                                                    'ICUSTAY_ID': [icustay_id], 'INTIME': [intime]}))
+            hours = np.arange(-24, n_hours + 1)
+            tables['icustay_hours'].append(pd.DataFrame({
+                'icustay_id': icustay_id, 'hr': hours,
+                'endtime': intime.ceil('h') + pd.to_timedelta(hours, unit='h')}))
+            start, end = intime - pd.Timedelta(hours=30), intime + pd.Timedelta(hours=n_hours + 5)
+            n = int(rng.integers(10, 60))
+            tables['CHARTEVENTS'].append(pd.DataFrame({
+                'SUBJECT_ID': hadm_id, 'HADM_ID': hadm_id, 'ICUSTAY_ID': icustay_id,
+                'ITEMID': rng.choice(_MEANBP_ITEMIDS + [211], n), 'CHARTTIME': _random_times(rng, start, end, n),
+                'VALUENUM': rng.uniform(-10, 320, n).round(),
+                'ERROR': pd.array(rng.choice([0, 1, None], n, p=[0.6, 0.1, 0.3]), dtype='Int64')}))
+            n = int(rng.integers(0, 15))
+            tables['pivoted_bg_art'].append(pd.DataFrame({
+                'icustay_id': icustay_id, 'charttime': _random_times(rng, start, end, n),
+                'pao2fio2ratio': np.where(rng.random(n) < 0.2, np.nan, rng.uniform(50, 500, n).round())}))
+            tables['ventilation_durations'].append(
+                _intervals(rng, icustay_id, start, end, int(rng.integers(0, 4)), overlapping=True))
+            for drug in ['epinephrine', 'norepinephrine', 'dopamine', 'dobutamine']:
+                # Disjoint intervals: with overlapping doses, the order of the tied SQL rows is not defined
+                doses = _intervals(rng, icustay_id, start, end, int(rng.integers(0, 4)), overlapping=False)
+                rates = rng.choice([0, 0.05, 0.1, 0.3, 3, 8, 20], len(doses))
+                tables[f'{drug}_dose'].append(doses.assign(vaso_rate=rates))
+        n = int(rng.integers(5, 40))
+        start, end = admittime - pd.Timedelta(hours=30), admittime + pd.Timedelta(hours=100)
+        tables['pivoted_lab'].append(pd.DataFrame({
+            'hadm_id': hadm_id, 'charttime': _random_times(rng, start, end, n),
+            **{column: np.where(rng.random(n) < 0.3, np.nan, rng.uniform(low, high, n).round(1))
+               for column, low, high in [('bilirubin', 0.2, 15), ('creatinine', 0.3, 6), ('platelet', 10, 300)]}}))
+
+    for name, frames in tables.items():
+        dataset = 'mimiciii_clinical' if name.isupper() else 'mimiciii_derived'
+        os.makedirs(os.path.join(data_dir, dataset), exist_ok=True)
+        pd.concat(frames, ignore_index=True).to_parquet(os.path.join(data_dir, dataset, f'{name}.parquet'))
+    return pd.concat(tables['ICUSTAYS'])['HADM_ID'].unique()
+
+
+@pytest.fixture(scope='module', params=[0, 1, 2])
+def sofa_inputs(request, tmp_path_factory):
+    data_dir = str(tmp_path_factory.mktemp('sofa'))
+    hadm_ids = _write_sofa_inputs(data_dir, seed=request.param)
+    previous_backend = data_utils.get_query_backend()
+    data_utils.set_query_backend(LocalMimicBackend(data_dir))
+    yield hadm_ids
+    data_utils.set_query_backend(previous_backend)
+
+
+def test_local_sofa_matches_sql(sofa_inputs):
+    assert len(sofa_engine.SOFA_calculate_local(PROJECT_ID)) > 0
+    assert len(sofa_engine.validate_against_sql(PROJECT_ID)) == 0
+
+
+def test_local_sofa_matches_sql_on_a_subset(sofa_inputs):
+    assert len(sofa_engine.validate_against_sql(PROJECT_ID, hadm_ids=sofa_inputs[:3])) == 0
+
+
+def test_incremental_sofa_reads_from_the_watermarks(sofa_inputs):
+    sofa_df = sofa_engine.SOFA_calculate_local(PROJECT_ID)
+    watermarks = sofa_engine.sofa_watermarks(sofa_df)
+    # Every other ICU stay is updated: admissions with two stays have one updated and one new stay
+    icustay_ids = watermarks['icustay_id'].to_numpy()[::2]
+    hadm_ids = sofa_df.loc[sofa_df['icustay_id'].isin(icustay_ids), 'hadm_id'].unique()
+    from_hours = sofa_engine.recompute_from_hours(watermarks, icustay_ids)
+
+    update_df = sofa_engine.SOFA_calculate_local(PROJECT_ID, hadm_ids=hadm_ids, from_hours=from_hours)
+    expected = sofa_df[sofa_df['hadm_id'].isin(hadm_ids)]
+    first_hr = expected['icustay_id'].map(from_hours)
+    expected = expected[first_hr.isna() | (expected['hr'] >= first_hr)].reset_index(drop=True)
+    pd.testing.assert_frame_equal(update_df, expected)
+
+    # The inputs are only read from the start of the windows of the first recomputed hour
+    tables = sofa_engine.load_sofa_tables(PROJECT_ID, hadm_ids=hadm_ids, from_hours=from_hours)
+    full_tables = sofa_engine.load_sofa_tables(PROJECT_ID, hadm_ids=hadm_ids)
+    first_read_hr = tables['icustay_hours'].groupby('icustay_id')['hr'].min()
+    assert (first_read_hr[from_hours.index] >= from_hours - 24).all()
+    assert sum(map(len, tables.values())) < sum(map(len, full_tables.values()))